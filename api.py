@@ -4,11 +4,23 @@
 Módulo con funciones de acceso a diferentes API's
 """
 
-import requests
+import copy
+import inspect
+import functools
+import threading
 import datetime as dt
-import pytz as tz
-import claves as key
+import util as ut
 import fechahora as fh
+import cliente_http as ch
+import metricas
+
+# Dependencias importadas solo cuando se usan por primera vez. El
+# módulo de claves solo es necesario al llamar a las API.
+requests = ut.ModuloPerezoso("requests")
+key = ut.ModuloPerezoso("claves")
+asyncio = ut.ModuloPerezoso("asyncio")
+
+log = metricas.Log("api")
 
 
 # Eventos del sol
@@ -40,7 +52,231 @@ GET_TIMEZONEDB_API_URL = "http://api.timezonedb.com/v2.1/get-time-zone"
 GC_MAPQUEST_API_URL    = "http://www.mapquestapi.com/geocoding/v1/address"
 GCI_MAPQUEST_API_URL   = "http://www.mapquestapi.com/geocoding/v1/reverse"
 
+# Cliente HTTP compartido por todas las peticiones a las API.
+CLIENTE_HTTP = ch.ClienteHttp()
+
+
+
+def estadisticas_latencia():
+    """
+    Obtener los contadores de latencia de las peticiones realizadas a
+    cada proveedor de API.
+
+    Retorno:
+        Diccionario {proveedor: {"peticiones", "errores",
+        "segundos_total", "segundos_max", "segundos_medio"}}.
+    """
+    return CLIENTE_HTTP.estadisticas()
+
+
+
+class VueloUnico:
+    """
+    Agrupador de llamadas simultáneas idénticas: mientras se ejecuta
+    una llamada para una clave, el resto de llamadas con la misma clave
+    esperan su resultado (o excepción) en lugar de repetirla. Sirve
+    tanto para hilos (llamar) como para asyncio (llamar_async).
+
+    Quien espera una llamada en curso recibe una copia superficial de
+    su resultado.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self._cerrojo = threading.Lock()
+        self._en_curso = dict()
+        self._en_curso_async = dict()
+        self._estadisticas = {"llamadas": 0, "agrupadas": 0}
+
+
+    def llamar(self, clave, funcion, *args, **kwargs):
+        """
+        Llamar a una función, o esperar el resultado de la llamada en
+        curso con la misma clave desde otro hilo.
+
+        Argumentos:
+            clave: valor hashable que identifica la llamada.
+            funcion: función a llamar.
+            args, kwargs: argumentos de la función.
+
+        Retorno:
+            Valor devuelto por la función.
+
+        Excepciones:
+            Las mismas que la función.
+        """
+        with self._cerrojo:
+            self._estadisticas["llamadas"] += 1
+            vuelo = self._en_curso.get(clave)
+            if vuelo is None:
+                vuelo = self._en_curso[clave] = \
+                    {"terminado": threading.Event(), "valor": None,
+                     "error": None}
+                es_lider = True
+            else:
+                self._estadisticas["agrupadas"] += 1
+                es_lider = False
+
+        if not es_lider:
+            vuelo["terminado"].wait()
+            if vuelo["error"] is not None:
+                raise vuelo["error"]
+            return copy.copy(vuelo["valor"])
+
+        try:
+            vuelo["valor"] = funcion(*args, **kwargs)
+        except BaseException as err:
+            vuelo["error"] = err
+            raise
+        finally:
+            with self._cerrojo:
+                del self._en_curso[clave]
+            vuelo["terminado"].set()
+
+        return vuelo["valor"]
+
+
+    async def llamar_async(self, clave, funcion, *args, **kwargs):
+        """
+        Esperar una función asíncrona, o el resultado de la llamada en
+        curso con la misma clave en el mismo bucle de eventos. Cancelar
+        una de las esperas no cancela la llamada para el resto.
+
+        Argumentos:
+            clave: valor hashable que identifica la llamada.
+            funcion: función asíncrona a llamar.
+            args, kwargs: argumentos de la función.
+
+        Retorno:
+            Valor devuelto por la función.
+
+        Excepciones:
+            Las mismas que la función.
+        """
+        bucle = asyncio.get_running_loop()
+        clave_bucle = (bucle, clave)
+
+        with self._cerrojo:
+            self._estadisticas["llamadas"] += 1
+            tarea = self._en_curso_async.get(clave_bucle)
+            if tarea is None:
+                tarea = self._en_curso_async[clave_bucle] = \
+                    bucle.create_task(funcion(*args, **kwargs))
+                tarea.add_done_callback(
+                    lambda _: self._terminar_async(clave_bucle))
+                es_lider = True
+            else:
+                self._estadisticas["agrupadas"] += 1
+                es_lider = False
+
+        valor = await asyncio.shield(tarea)
+        return valor if es_lider else copy.copy(valor)
+
+
+    def _terminar_async(self, clave_bucle):
+        """
+        Quitar una llamada asíncrona terminada de las llamadas en curso.
+        """
+        with self._cerrojo:
+            self._en_curso_async.pop(clave_bucle, None)
+
 
+    def estadisticas(self):
+        """
+        Obtener las estadísticas de agrupación de llamadas.
+
+        Retorno:
+            Diccionario {"llamadas", "agrupadas", "proporcion_agrupadas",
+            "en_curso"} con el número de llamadas recibidas, cuántas
+            esperaron a otra en curso en lugar de ejecutarse, la
+            proporción entre ambas y las llamadas en curso actualmente.
+        """
+        with self._cerrojo:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["en_curso"] = \
+                len(self._en_curso) + len(self._en_curso_async)
+
+        estadisticas["proporcion_agrupadas"] = \
+            estadisticas["agrupadas"] / estadisticas["llamadas"] \
+            if estadisticas["llamadas"] else 0.0
+
+        return estadisticas
+
+
+
+# Agrupadores de llamadas simultáneas de cada función de API decorada
+# con vuelo_unico.
+VUELOS_UNICOS = dict()
+
+
+
+def vuelo_unico(funcion):
+    """
+    Decorador que agrupa las llamadas simultáneas a una función con los
+    mismos argumentos mediante un VueloUnico, accesible en el atributo
+    vuelo_unico de la función decorada. El atributo clave_vuelo obtiene
+    la clave de unos argumentos (TypeError si no son válidos o no son
+    hashables).
+
+    Argumentos:
+        funcion: función a decorar.
+
+    Retorno:
+        Función decorada.
+    """
+    parametros = inspect.signature(funcion).parameters
+    nombres = tuple(parametros)
+    defectos = tuple(parametro.default for parametro in parametros.values())
+    vuelo = VUELOS_UNICOS[funcion.__name__] = VueloUnico()
+
+    def clave_vuelo(*args, **kwargs):
+        # Argumentos en el orden de la firma con los valores por defecto,
+        # de modo que la clave no depende de cómo se pasan.
+        if len(args) > len(nombres):
+            raise TypeError("Demasiados argumentos")
+        valores = list(args) + list(defectos[len(args):])
+        for nombre, valor in kwargs.items():
+            if nombre not in nombres[len(args):]:
+                raise TypeError("Argumento inesperado: {}".format(nombre))
+            valores[nombres.index(nombre)] = valor
+        if inspect.Parameter.empty in valores:
+            raise TypeError("Faltan argumentos")
+
+        clave = tuple(tuple(valor) if isinstance(valor, list) else valor
+                      for valor in valores)
+        hash(clave)
+        return clave
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        try:
+            clave = clave_vuelo(*args, **kwargs)
+        except TypeError:
+            return funcion(*args, **kwargs)
+        return vuelo.llamar(clave, funcion, *args, **kwargs)
+
+    envoltura.vuelo_unico = vuelo
+    envoltura.clave_vuelo = clave_vuelo
+    return envoltura
+
+
+
+def estadisticas_vuelo_unico():
+    """
+    Obtener las estadísticas de agrupación de llamadas simultáneas de
+    cada función de API decorada con vuelo_unico.
+
+    Retorno:
+        Diccionario {función: estadísticas de VueloUnico}.
+    """
+    return {nombre: vuelo.estadisticas()
+            for nombre, vuelo in VUELOS_UNICOS.items()}
+
+
+
+@vuelo_unico
 def timezonedb_get(localizacion, timestamp=None):
     """
     Uso de API TimeZoneDB (http://api.timezonedb.com/v2/get-time-zone)
@@ -89,7 +325,8 @@ def timezonedb_get(localizacion, timestamp=None):
     if timestamp is not None:
         parametros_url["time"] = timestamp
 
-    res = requests.get(GET_TIMEZONEDB_API_URL, parametros_url).json()
+    res = CLIENTE_HTTP.get("timezonedb", GET_TIMEZONEDB_API_URL,
+                           parametros_url).json()
     if res["status"] != "OK":
         raise RuntimeError("Error API TimeZoneDB: {}".format(res["message"]))
        
@@ -104,9 +341,9 @@ def timezonedb_get(localizacion, timestamp=None):
         "{}, {}({})".format(datos["zona_horaria"].split("/")[1],
                             datos["nombre_pais"], datos["codigo_pais"])
 
-    tzone = tz.timezone(datos["zona_horaria"])
+    tzone = fh.zona_horaria(datos["zona_horaria"])
     fechahora = dt.datetime.utcfromtimestamp(datos["timestamp"])
-    datos["fechahora"] = tzone.localize(fechahora)
+    datos["fechahora"] = fh.localizar(fechahora, tzone)
     
     return datos
  
@@ -146,7 +383,7 @@ def google_timezone(latitud, longitud, timestamp=None):
                       "key": key.TZ_GOOGLE_API_KEY, "timestamp": timestamp,
                       "language": "es"}
 
-    res = requests.get(TZ_GOOGLE_API_URL, parametros_url).json()
+    res = CLIENTE_HTTP.get("google", TZ_GOOGLE_API_URL, parametros_url).json()
     if res["status"] != "OK":
         mensg = "API Google {}: {}".format(res["status"], res["errorMessage"])
         raise RuntimeError(mensg)
@@ -159,9 +396,9 @@ def google_timezone(latitud, longitud, timestamp=None):
     
     datos["timestamp"] = timestamp + datos["segundos_desfase"]
     
-    tzone = tz.timezone(datos["zona_horaria"])
+    tzone = fh.zona_horaria(datos["zona_horaria"])
     fechahora = dt.datetime.utcfromtimestamp(datos["timestamp"])
-    datos["fechahora"] = tzone.localize(fechahora)
+    datos["fechahora"] = fh.localizar(fechahora, tzone)
     
     return datos
 
@@ -183,7 +420,8 @@ def google_geocode(localizacion):
 
     Excepciones:
         RuntimeError en caso de no obtener resultado de la API. Contiene
-            el tipo de error devuelto por la API.
+            el tipo de error devuelto por la API (ZERO_RESULTS si la
+            localización no tiene resultados).
         TypeError si la localización está en un formato incorrecto.
     
     Mejoras:
@@ -206,7 +444,9 @@ def google_geocode(localizacion):
         if len(localizacion) != 2:
             raise TypeError("Debes introducir solo dos coordenadas.")
     
-    res = requests.get(GC_GOOGLE_API_URL, parametros_url).json()
+    res = CLIENTE_HTTP.get("google", GC_GOOGLE_API_URL, parametros_url).json()
+    if res["status"] == "OK" and not res["results"]:
+        res["status"] = "ZERO_RESULTS"
     if res["status"] != "OK":
         raise RuntimeError("Error API de Google: {}".format(res["status"]))
 
@@ -238,7 +478,8 @@ def mapquest_geocoding(localizacion):
 
     Excepciones:
         RuntimeError en caso de no obtener resultado de la API. Contiene
-            el tipo de error devuelto por la API.
+            el tipo de error devuelto por la API (ZERO_RESULTS si la
+            localización no tiene resultados).
         TypeError si la localizaión está en un formato incorrecto.
 
     Mejoras:
@@ -264,15 +505,18 @@ def mapquest_geocoding(localizacion):
         
         url = GCI_MAPQUEST_API_URL
     
-    res = requests.get(url, parametros_url)
+    res = CLIENTE_HTTP.get("mapquest", url, parametros_url)
    
     try:# Comparar mejor el status_code != 0
         res.raise_for_status()
     except requests.HTTPError as err:
-        print(err) #Log
+        log.warning("Error HTTP de la API", proveedor="mapquest", error=err)
         raise RuntimeError("Error API Mapquest")
    
-    loc = res.json()["results"][0]["locations"][0]
+    datos = res.json()
+    if not datos["results"] or not datos["results"][0]["locations"]:
+        raise RuntimeError("Error API Mapquest: ZERO_RESULTS")
+    loc = datos["results"][0]["locations"][0]
     direccion = "{}{}{}{}{}{}{}".format(loc["street"], 
                     '(' + loc["postalCode"] + ')' if loc["postalCode"] else "", 
                     ", " + loc["adminArea6"] if loc["adminArea6"] else "",
@@ -283,10 +527,12 @@ def mapquest_geocoding(localizacion):
     coordenadas = loc["latLng"]["lat"], loc["latLng"]["lng"]
 
     return {"direccion": direccion, "coordenadas": coordenadas, 
-            "mapa_url": loc["mapUrl"], "copyright": res["info"]["copyright"]}
+            "mapa_url": loc["mapUrl"],
+            "copyright": datos["info"]["copyright"]}
 
 
 
+@vuelo_unico
 def sunrise_sunset(latitud, longitud, fecha=None, local=False):
     """
     Obtener los datos de las horas de la puesta, salida y crepúsculo
@@ -322,7 +568,8 @@ def sunrise_sunset(latitud, longitud, fecha=None, local=False):
     parametros_url = {"lat": latitud, "lng": longitud, "formatted": 0}
     parametros_url["date"] = fecha.strftime("%Y-%m-%d")
 
-    res = requests.get(SOL_API_URL, parametros_url).json()
+    res = CLIENTE_HTTP.get("sunrise_sunset", SOL_API_URL,
+                           parametros_url).json()
     if res["status"] != "OK":
         raise RuntimeError("Error API sunrise-sunset {}".format(res["status"]))
 
@@ -335,11 +582,11 @@ def sunrise_sunset(latitud, longitud, fecha=None, local=False):
             continue
       
         fechahora = dt.datetime.strptime(dato, "%Y-%m-%dT%H:%M:%S+00:00")  
+        fechahora = fechahora.replace(tzinfo=fh.UTC)
         if local:
-            zona_horaria = tz.timezone(datos_api["zona_horaria"])
-            fechahoras_eventos_sol[evento] = zona_horaria.fromutc(fechahora)
-        else:
-            fechahoras_eventos_sol[evento] = tz.UTC.localize(fechahora)
+            zona_horaria = fh.zona_horaria(datos_api["zona_horaria"])
+            fechahora = fechahora.astimezone(zona_horaria)
+        fechahoras_eventos_sol[evento] = fechahora
 
     return fechahoras_eventos_sol
 
@@ -0,0 +1,138 @@
+#coding=utf-8
+
+"""
+Módulo con las variantes asíncronas (asyncio) de las funciones de
+acceso a API del módulo api.
+
+Las peticiones se ejecutan en un conjunto de hilos propio sobre el
+cliente HTTP compartido (api.CLIENTE_HTTP), de modo que un único bucle
+de eventos puede tener cientos de peticiones en curso a la vez.
+"""
+
+import asyncio
+import functools
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+import api
+import fechahora as fh
+
+
+# Número máximo de peticiones bloqueantes ejecutándose a la vez.
+MAX_PETICIONES_SIMULTANEAS = 64
+
+EJECUTOR = ThreadPoolExecutor(max_workers=MAX_PETICIONES_SIMULTANEAS,
+                              thread_name_prefix="api_async")
+
+
+
+async def ejecutar(funcion, *args, **kwargs):
+    """
+    Ejecutar una función bloqueante en el conjunto de hilos de este
+    módulo sin bloquear el bucle de eventos.
+
+    Argumentos:
+        funcion: función a ejecutar.
+        args, kwargs: argumentos de la función.
+
+    Retorno:
+        Valor devuelto por la función.
+
+    Excepciones:
+        Las mismas que la función.
+    """
+    bucle = asyncio.get_running_loop()
+    return await bucle.run_in_executor(
+        EJECUTOR, functools.partial(funcion, *args, **kwargs))
+
+
+
+async def ejecutar_agrupado(funcion, *args, **kwargs):
+    """
+    Ejecutar en el conjunto de hilos de este módulo una función de api
+    decorada con api.vuelo_unico, agrupando las llamadas asíncronas
+    simultáneas con los mismos argumentos en una sola ejecución.
+
+    Argumentos:
+        funcion: función decorada con api.vuelo_unico.
+        args, kwargs: argumentos de la función.
+
+    Retorno:
+        Valor devuelto por la función.
+
+    Excepciones:
+        Las mismas que la función.
+    """
+    try:
+        clave = funcion.clave_vuelo(*args, **kwargs)
+    except TypeError:
+        return await ejecutar(funcion, *args, **kwargs)
+
+    # Se ejecuta la función sin decorar para no contar dos veces la
+    # llamada en las estadísticas.
+    return await funcion.vuelo_unico.llamar_async(
+        clave, ejecutar, funcion.__wrapped__, *args, **kwargs)
+
+
+
+async def timezonedb_get(localizacion, timestamp=None):
+    """
+    Versión asíncrona de api.timezonedb_get.
+    """
+    return await ejecutar_agrupado(api.timezonedb_get, localizacion,
+                                   timestamp)
+
+
+
+async def google_timezone(latitud, longitud, timestamp=None):
+    """
+    Versión asíncrona de api.google_timezone.
+    """
+    return await ejecutar(api.google_timezone, latitud, longitud, timestamp)
+
+
+
+async def google_geocode(localizacion):
+    """
+    Versión asíncrona de api.google_geocode.
+    """
+    return await ejecutar(api.google_geocode, localizacion)
+
+
+
+async def mapquest_geocoding(localizacion):
+    """
+    Versión asíncrona de api.mapquest_geocoding.
+    """
+    return await ejecutar(api.mapquest_geocoding, localizacion)
+
+
+
+async def sunrise_sunset(latitud, longitud, fecha=None, local=False):
+    """
+    Versión asíncrona de api.sunrise_sunset. Si se piden las horas
+    locales de una fecha concreta, las peticiones de zona horaria y de
+    eventos del sol se realizan a la vez.
+
+    Argumentos:
+        Los mismos que api.sunrise_sunset.
+
+    Retorno:
+        El mismo diccionario que api.sunrise_sunset.
+
+    Excepciones:
+        Las mismas que api.sunrise_sunset.
+    """
+    if fecha is None or not local:
+        return await ejecutar_agrupado(api.sunrise_sunset, latitud,
+                                       longitud, fecha, local)
+    if not isinstance(fecha, dt.date):
+        raise TypeError("La fecha no es de tipo datetime.date o None.")
+
+    datos_api, fechahoras_eventos_sol = await asyncio.gather(
+        timezonedb_get((latitud, longitud)),
+        ejecutar_agrupado(api.sunrise_sunset, latitud, longitud, fecha))
+
+    zona_horaria = fh.zona_horaria(datos_api["zona_horaria"])
+    return {evento: (valor if evento == "duracion_dia"
+                     else valor.astimezone(zona_horaria))
+            for evento, valor in fechahoras_eventos_sol.items()}
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+#coding=utf-8
+
+"""
+Batería de pruebas de rendimiento del cálculo de tatwas y de las
+funciones de acceso a API (con respuestas grabadas, sin acceso a red).
+
+Uso:
+    python3 benchmark.py                      # Mostrar resultados.
+    python3 benchmark.py --guardar base.json  # Guardar línea base.
+    python3 benchmark.py --comparar base.json # Detectar regresiones.
+    python3 benchmark.py --presupuesto-importacion 30  # Tiempo máximo
+                                                       # (ms) de import.
+
+La batería falla siempre si importar tatwa supera el presupuesto (por
+defecto PRESUPUESTO_IMPORTACION_MS) o importa dependencias perezosas, o
+si importar tatwa, api o tatwametro importa dependencias de red.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import timeit
+import itertools
+import argparse
+import subprocess
+import tracemalloc
+import datetime as dt
+
+
+# El módulo de claves privadas no es necesario ya que las API no se
+# llegan a llamar, pero api lo importa.
+if "claves" not in sys.modules:
+    try:
+        import claves
+    except ImportError:
+        claves = types.ModuleType("claves")
+        claves.TIMEZONEDB_API_KEY = claves.TZ_GOOGLE_API_KEY = \
+            claves.GC_GOOGLE_API_KEY = claves.MAPQUEST_API_KEY = ""
+        sys.modules["claves"] = claves
+
+import api
+import fechahora as fh
+import tatwa as tw
+
+
+# Dependencias que solo deben importarse cuando se usan, no al importar
+# el módulo tatwa.
+DEPENDENCIAS_PEREZOSAS = ("requests", "urllib3", "zoneinfo", "ntplib",
+                          "claves", "sqlite3", "asyncio", "api", "cache",
+                          "efemerides", "logging")
+
+# Dependencias de red y claves que no debe importar ninguno de los
+# módulos de MODULOS_SIN_RED hasta que se usen.
+DEPENDENCIAS_RED = ("requests", "urllib3", "ntplib", "claves")
+MODULOS_SIN_RED = ("tatwa", "api", "tatwametro")
+
+# Tiempo máximo (ms) por defecto de la importación del módulo tatwa.
+PRESUPUESTO_IMPORTACION_MS = 50
+
+# Respuestas grabadas de cada API, indexadas por URL.
+RESPUESTAS_GRABADAS = {
+    api.SOL_API_URL:
+        {"status": "OK",
+         "results": {"sunrise": "2024-06-21T04:44:51+00:00",
+                     "sunset": "2024-06-21T19:48:37+00:00",
+                     "solar_noon": "2024-06-21T12:16:44+00:00",
+                     "day_length": 54226,
+                     "civil_twilight_begin": "2024-06-21T04:11:39+00:00",
+                     "civil_twilight_end": "2024-06-21T20:21:49+00:00",
+                     "nautical_twilight_begin": "2024-06-21T03:29:22+00:00",
+                     "nautical_twilight_end": "2024-06-21T21:04:06+00:00",
+                     "astronomical_twilight_begin":
+                         "2024-06-21T02:39:39+00:00",
+                     "astronomical_twilight_end":
+                         "2024-06-21T21:53:48+00:00"}},
+    api.GET_TIMEZONEDB_API_URL:
+        {"status": "OK", "message": "", "countryCode": "ES",
+         "countryName": "Spain", "zoneName": "Europe\\/Madrid",
+         "gmtOffset": 7200, "dst": "1", "timestamp": 1718971200},
+    api.GC_GOOGLE_API_URL:
+        {"status": "OK",
+         "results": [{"formatted_address": "Puerta del Sol, Madrid, España",
+                      "geometry": {"location": {"lat": 40.4168,
+                                                "lng": -3.7038}}}]},
+    api.GC_MAPQUEST_API_URL:
+        {"info": {"copyright": {"text": "© MapQuest"}},
+         "results": [{"locations": [{"street": "Puerta del Sol",
+                                     "postalCode": "28013",
+                                     "adminArea6": "", "adminArea5": "Madrid",
+                                     "adminArea4": "", "adminArea3": "Madrid",
+                                     "adminArea1": "ES",
+                                     "latLng": {"lat": 40.4168,
+                                                "lng": -3.7038},
+                                     "mapUrl": ""}]}]}}
+
+
+
+class RespuestaGrabada:
+    """
+    Respuesta HTTP con el contenido JSON grabado de una API.
+    """
+
+    ok = True
+
+    def __init__(self, datos):
+        self._datos = datos
+
+    def json(self):
+        return json.loads(self._datos)
+
+    def raise_for_status(self):
+        pass
+
+
+
+class ClienteGrabado:
+    """
+    Cliente HTTP con la misma interfaz que cliente_http.ClienteHttp
+    que devuelve las respuestas grabadas sin acceder a la red.
+    """
+
+    def __init__(self, respuestas):
+        self._respuestas = {url: json.dumps(datos)
+                            for url, datos in respuestas.items()}
+
+    def get(self, proveedor, url, parametros=None):
+        return RespuestaGrabada(self._respuestas[url])
+
+
+
+def _casos():
+    """
+    Crear los casos de la batería.
+
+    Retorno:
+        Diccionario {nombre del caso: función sin argumentos}.
+    """
+    zona_horaria = fh.zona_horaria("Europe/Madrid")
+    fecha = dt.date(2024, 6, 21)
+
+    entorno_tw = tw.EntornoTatwas()
+    entorno_tw._coordenadas = {"lat": 40.4168, "lng": -3.7038}
+    entorno_tw._zona_horaria = zona_horaria
+    entorno_tw._fechahoras_eventos_sol = \
+        {"salida": dt.datetime(2024, 6, 21, 6, 44, 51, tzinfo=zona_horaria),
+         "amanecer_astronomico":
+             dt.datetime(2024, 6, 21, 4, 39, 39, tzinfo=zona_horaria)}
+    entorno_tw.fecha_tw = fecha
+    entorno_tw.hora_tw = dt.time(12, 30, 15)
+
+    tatwa_a, tatwa_b = tw.Tatwa(14), tw.Tatwa("tejas", 3)
+
+    # Los tatwas calculados se reutilizan mientras no cambie la hora,
+    # así que se alterna entre dos horas para medir el cálculo real.
+    horas_tw = itertools.cycle((dt.time(12, 30, 15), dt.time(12, 30, 16)))
+
+    def calcular_tatwas():
+        entorno_tw.hora_tw = next(horas_tw)
+        entorno_tw.calcular_tatwas()
+
+    return {"tatwa_construccion_posicion": lambda: tw.Tatwa(14),
+            "tatwa_construccion_nombre": lambda: tw.Tatwa("tejas", 3),
+            "tatwa_aritmetica": lambda: (tatwa_a + 7) - 3,
+            "tatwa_comparaciones": lambda: (tatwa_a == tatwa_b,
+                                            tatwa_a < tatwa_b,
+                                            tatwa_a >= "vayu"),
+            "entorno_calcular_tatwas": calcular_tatwas,
+            "entorno_calcular_tatwas_memorizado": entorno_tw.calcular_tatwas,
+            "fechahora_combinar_fecha_hora":
+                lambda: fh.combinar_fecha_hora(fecha, dt.time(12, 30),
+                                               zona_horaria),
+            "api_sunrise_sunset": lambda: api.sunrise_sunset(40.4168,
+                                                             -3.7038, fecha),
+            "api_timezonedb_get":
+                lambda: api.timezonedb_get((40.4168, -3.7038)),
+            "api_google_geocode":
+                lambda: api.google_geocode("Puerta del Sol, Madrid"),
+            "api_mapquest_geocoding":
+                lambda: api.mapquest_geocoding("Puerta del Sol, Madrid")}
+
+
+
+def medir(funcion, segundos_minimos=0.2, repeticiones=5):
+    """
+    Medir el rendimiento de una función.
+
+    Argumentos:
+        funcion: función sin argumentos a medir.
+        segundos_minimos: duración mínima de cada repetición.
+        repeticiones: número de repeticiones (se toma la mejor).
+
+    Retorno:
+        Diccionario {"ops_por_segundo", "bytes_pico_por_op",
+        "bloques_por_op"} con las operaciones por segundo de la mejor
+        repetición, la memoria máxima asignada durante cada operación
+        (media) y los bloques de memoria que quedan asignados por
+        operación.
+    """
+    temporizador = timeit.Timer(funcion)
+    numero, _ = temporizador.autorange()
+    numero = max(1, int(numero * segundos_minimos / 0.2))
+    mejor = min(temporizador.repeat(repeat=repeticiones, number=numero))
+
+    operaciones = min(numero, 1000)
+    funcion()
+    pico_total = 0
+    tracemalloc.start()
+    bloques = sys.getallocatedblocks()
+    for _ in range(operaciones):
+        actual, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        funcion()
+        pico_total += max(0, tracemalloc.get_traced_memory()[1] - actual)
+    bloques = sys.getallocatedblocks() - bloques
+    tracemalloc.stop()
+
+    return {"ops_por_segundo": numero / mejor,
+            "bytes_pico_por_op": pico_total / operaciones,
+            "bloques_por_op": bloques / operaciones}
+
+
+
+def ejecutar(filtro=None, segundos_minimos=0.2):
+    """
+    Ejecutar la batería de pruebas de rendimiento.
+
+    Argumentos:
+        filtro: subcadena que deben contener los nombres de los casos
+            a ejecutar. None para todos.
+        segundos_minimos: duración mínima de cada repetición.
+
+    Retorno:
+        Diccionario {caso: resultado de medir()}.
+    """
+    cliente_http = api.CLIENTE_HTTP
+    api.CLIENTE_HTTP = ClienteGrabado(RESPUESTAS_GRABADAS)
+    try:
+        return {nombre: medir(funcion, segundos_minimos)
+                for nombre, funcion in sorted(_casos().items())
+                if filtro is None or filtro in nombre}
+    finally:
+        api.CLIENTE_HTTP = cliente_http
+
+
+
+def medir_importacion(modulo="tatwa", repeticiones=5):
+    """
+    Medir el tiempo de importación de un módulo en un intérprete nuevo
+    con python -X importtime.
+
+    Argumentos:
+        modulo: nombre del módulo a importar.
+        repeticiones: número de intérpretes lanzados (se toma el
+            mejor tiempo).
+
+    Retorno:
+        Diccionario {"milisegundos", "dependencias"} con el mejor
+        tiempo acumulado de importación del módulo y las
+        DEPENDENCIAS_PEREZOSAS importadas con él.
+
+    Excepciones:
+        RuntimeError si el módulo no puede importarse.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    mejor = None
+    for _ in range(repeticiones):
+        proceso = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import {}".format(modulo)],
+            cwd=directorio, stderr=subprocess.PIPE, universal_newlines=True)
+        if proceso.returncode != 0:
+            raise RuntimeError("Error al importar {}:\n{}"
+                               .format(modulo, proceso.stderr))
+
+        importados = set()
+        microsegundos = None
+        for linea in proceso.stderr.splitlines():
+            if not linea.startswith("import time:") or "|" not in linea:
+                continue
+            _, acumulado, nombre = linea.split("|")
+            importados.add(nombre.strip())
+            if nombre.strip() == modulo and not nombre[1:].startswith(" "):
+                microsegundos = int(acumulado)
+
+        if microsegundos is not None \
+           and (mejor is None or microsegundos < mejor):
+            mejor = microsegundos
+
+    return {"milisegundos": mejor / 1000,
+            "dependencias": sorted(importados
+                                   & set(DEPENDENCIAS_PEREZOSAS))}
+
+
+
+def dependencias_red_importadas(modulos=MODULOS_SIN_RED):
+    """
+    Importar cada módulo en un intérprete nuevo y obtener las
+    DEPENDENCIAS_RED que quedan importadas.
+
+    Argumentos:
+        modulos: nombres de los módulos a importar.
+
+    Retorno:
+        Diccionario {módulo: lista de dependencias importadas} con los
+        módulos que importan alguna.
+
+    Excepciones:
+        RuntimeError si algún módulo no puede importarse.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    importadas = dict()
+    for modulo in modulos:
+        proceso = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, {}; print(' '.join(sorted(set(sys.modules)"
+             " & set({!r}))))".format(modulo, DEPENDENCIAS_RED)],
+            cwd=directorio, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if proceso.returncode != 0:
+            raise RuntimeError("Error al importar {}:\n{}"
+                               .format(modulo, proceso.stderr))
+        if proceso.stdout.split():
+            importadas[modulo] = proceso.stdout.split()
+
+    return importadas
+
+
+
+def comparar(resultados, base, tolerancia):
+    """
+    Comparar unos resultados con una línea base.
+
+    Argumentos:
+        resultados: resultados de ejecutar().
+        base: resultados guardados de la línea base.
+        tolerancia: pérdida relativa máxima de operaciones por segundo
+            permitida (0.1 = 10%).
+
+    Retorno:
+        Lista de tuplas (caso, ops/s base, ops/s actuales) de los casos
+        con regresión.
+    """
+    regresiones = list()
+    for nombre, resultado in resultados.items():
+        if nombre not in base:
+            continue
+        ops_base = base[nombre]["ops_por_segundo"]
+        if resultado["ops_por_segundo"] < ops_base * (1 - tolerancia):
+            regresiones.append((nombre, ops_base,
+                                resultado["ops_por_segundo"]))
+
+    return regresiones
+
+
+
+def main():
+    """
+    Función principal
+    """
+    analizador = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    analizador.add_argument("--guardar", metavar="JSON",
+                            help="guardar los resultados como línea base")
+    analizador.add_argument("--comparar", metavar="JSON",
+                            help="comparar con una línea base guardada")
+    analizador.add_argument("--tolerancia", type=float, default=0.1,
+                            help="pérdida relativa permitida (0.1 = 10%%)")
+    analizador.add_argument("--filtro", help="ejecutar solo estos casos")
+    analizador.add_argument("--segundos", type=float, default=0.2,
+                            help="duración mínima de cada repetición")
+    analizador.add_argument("--presupuesto-importacion", type=float,
+                            metavar="MS", default=PRESUPUESTO_IMPORTACION_MS,
+                            help="fallar si importar tatwa tarda más (por"
+                                 " defecto %(default)s) o importa"
+                                 " dependencias perezosas")
+    argumentos = analizador.parse_args()
+
+    resultados = ejecutar(argumentos.filtro, argumentos.segundos)
+
+    print("{:<32}{:>14}{:>14}{:>12}".format("Caso", "ops/s", "bytes pico",
+                                            "bloques"))
+    for nombre, resultado in resultados.items():
+        print("{:<32}{:>14,.0f}{:>14,.0f}{:>12.2f}"
+              .format(nombre, resultado["ops_por_segundo"],
+                      resultado["bytes_pico_por_op"],
+                      resultado["bloques_por_op"]))
+
+    if argumentos.guardar:
+        with open(argumentos.guardar, "w", encoding="utf-8") as archivo:
+            json.dump({"fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": sys.version.split()[0],
+                       "resultados": resultados}, archivo, indent=2)
+
+    importacion = medir_importacion()
+    print("\nImportar tatwa: {:.1f} ms (dependencias perezosas importadas:"
+          " {})".format(importacion["milisegundos"],
+                        ", ".join(importacion["dependencias"]) or "ninguna"))
+    if importacion["milisegundos"] > argumentos.presupuesto_importacion \
+       or importacion["dependencias"]:
+        print("REGRESIÓN importación: presupuesto {} ms"
+              .format(argumentos.presupuesto_importacion))
+        sys.exit(1)
+
+    importadas = dependencias_red_importadas()
+    for modulo, dependencias in sorted(importadas.items()):
+        print("REGRESIÓN importación de {}: importa {}"
+              .format(modulo, ", ".join(dependencias)))
+    if importadas:
+        sys.exit(1)
+
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding="utf-8") as archivo:
+            base = json.load(archivo)["resultados"]
+
+        regresiones = comparar(resultados, base, argumentos.tolerancia)
+        for nombre, ops_base, ops_actuales in regresiones:
+            print("REGRESIÓN {}: {:,.0f} -> {:,.0f} ops/s"
+                  .format(nombre, ops_base, ops_actuales))
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,692 @@
+#coding=utf-8
+
+"""
+Módulo de cachés de los datos obtenidos de las API: persistente
+(SQLite) y en memoria, incluida la geocodificación de direcciones.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import collections
+import datetime as dt
+import unicodedata
+import util as ut
+import metricas
+
+# Dependencias importadas solo cuando se usan por primera vez.
+api = ut.ModuloPerezoso("api")
+
+
+RUTA_CACHE_POR_DEFECTO = os.path.join(os.path.expanduser("~"),
+                                      ".tatwametro_cache.sqlite")
+
+# Comas con los espacios que las rodean en una dirección.
+_SEPARADOR_DIRECCION = re.compile(r"\s*,[\s,]*")
+
+# Estado con el que las funciones de geocodificación indican en sus
+# errores que la localización no tiene resultados. Son los únicos
+# errores que guarda CacheGeocodificacion: los demás (conexión, límite
+# de consultas, errores internos de la API) son transitorios.
+ESTADO_SIN_RESULTADOS = "ZERO_RESULTS"
+
+
+
+def _series_consultas(cache, resultados):
+    """
+    Obtener las series de metricas.CONSULTAS_CACHE de una caché para
+    cada resultado de consulta.
+    """
+    return {resultado: metricas.CONSULTAS_CACHE.etiquetar(
+                cache=cache, resultado=resultado)
+            for resultado in resultados}
+
+
+
+class CacheEventosSol:
+    """
+    Caché persistente en disco de las horas de los eventos del sol.
+    Se usa como una fuente de eventos del sol más (misma interfaz que
+    api.sunrise_sunset) que envuelve a otra fuente, a la cual solo se
+    accede cuando los datos no están guardados.
+
+    Las claves son las coordenadas cuantizadas a un número de decimales
+    y la fecha. Cuando se supera el número máximo de entradas se
+    desalojan las usadas hace más tiempo.
+
+    Los aciertos no escriben en la base de datos: el último acceso de
+    una entrada solo se actualiza si es más antiguo que una décima
+    parte de la capacidad, y esas actualizaciones se acumulan y se
+    escriben juntas con el siguiente fallo o en lotes de
+    MAX_ACCESOS_PENDIENTES, de modo que los procesos que comparten el
+    archivo no compiten por el cerrojo de escritura en cada consulta.
+    """
+
+    # Número máximo de actualizaciones de acceso acumuladas.
+    MAX_ACCESOS_PENDIENTES = 256
+
+    def __init__(self, fuente=None, ruta=RUTA_CACHE_POR_DEFECTO,
+                 precision=3, max_entradas=100000):
+        """
+        Constructor.
+
+        Argumentos:
+            fuente: función con la interfaz de api.sunrise_sunset a la
+                cual se piden los eventos que no estén en la caché.
+                None para api.sunrise_sunset.
+            ruta: ruta del archivo SQLite. ":memory:" para una caché
+                no persistente.
+            precision: número de decimales de las coordenadas usados en
+                la clave. 3 decimales equivalen a unos 100 metros.
+            max_entradas: número máximo de entradas (int >= 1) en la
+                caché.
+
+        Excepciones:
+            TypeError o ValueError si los argumentos son incorrectos.
+            sqlite3.Error si no se puede abrir la base de datos.
+        """
+        if fuente is None:
+            fuente = api.sunrise_sunset
+        if not callable(fuente):
+            raise TypeError("La fuente de eventos del sol debe ser una"
+                            " función.")
+        if not isinstance(precision, int) or precision < 0:
+            raise ValueError("La precisión debe ser un entero >= 0.")
+        if not isinstance(max_entradas, int) or max_entradas < 1:
+            raise ValueError("El máximo de entradas debe ser un entero >= 1.")
+
+        self._fuente = fuente
+        self._precision = precision
+        self._max_entradas = max_entradas
+        self._umbral_acceso = max(1, max_entradas // 10)
+        self._accesos_pendientes = dict()
+        self._cerrojo = threading.Lock()
+        self._estadisticas = {"aciertos": 0, "fallos": 0, "desalojos": 0}
+        self._consultas = _series_consultas("eventos_sol",
+                                            ("acierto", "fallo"))
+
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        if ruta != ":memory:":
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS eventos_sol ("
+            " lat INTEGER, lng INTEGER, fecha TEXT, datos TEXT,"
+            " acceso INTEGER, PRIMARY KEY (lat, lng, fecha))")
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS eventos_sol_acceso"
+            " ON eventos_sol (acceso)")
+        self._conexion.commit()
+
+        self._entradas, self._acceso = self._conexion.execute(
+            "SELECT COUNT(*), COALESCE(MAX(acceso), 0) FROM eventos_sol"
+            ).fetchone()
+
+
+    def __call__(self, latitud, longitud, fecha=None, local=False):
+        """
+        Obtener las horas de los eventos del sol, desde la caché si
+        están guardadas o desde la fuente en caso contrario. Las
+        peticiones sin fecha (fecha actual) o con horas locales no se
+        guardan y se redirigen directamente a la fuente.
+
+        Argumentos:
+            Los mismos que api.sunrise_sunset.
+
+        Retorno:
+            El mismo diccionario que api.sunrise_sunset. Si los datos
+            se obtienen de la fuente, se piden para las coordenadas
+            cuantizadas.
+
+        Excepciones:
+            Las mismas que la fuente.
+        """
+        if fecha is None or local:
+            return self._fuente(latitud, longitud, fecha, local)
+        if not isinstance(fecha, dt.date):
+            raise TypeError("La fecha no es de tipo datetime.date o None.")
+
+        escala = 10 ** self._precision
+        lat = round(float(latitud) * escala)
+        lng = round(float(longitud) * escala)
+        clave = (lat, lng, fecha.isoformat())
+
+        with self._cerrojo:
+            fila = self._conexion.execute(
+                "SELECT datos, acceso FROM eventos_sol WHERE lat = ? AND"
+                " lng = ? AND fecha = ?", clave).fetchone()
+            if fila is not None:
+                self._estadisticas["aciertos"] += 1
+                self._consultas["acierto"].incrementar()
+                self._acceso += 1
+                if self._acceso - fila[1] > self._umbral_acceso:
+                    self._accesos_pendientes[clave] = self._acceso
+                    if len(self._accesos_pendientes) \
+                       >= self.MAX_ACCESOS_PENDIENTES:
+                        self._escribir_accesos()
+                        self._conexion.commit()
+                return self._deserializar(fila[0])
+
+            self._estadisticas["fallos"] += 1
+            self._consultas["fallo"].incrementar()
+
+        fechahoras_eventos_sol = self._fuente(lat / escala, lng / escala,
+                                              fecha)
+
+        with self._cerrojo:
+            self._acceso += 1
+            cursor = self._conexion.execute(
+                "INSERT OR IGNORE INTO eventos_sol VALUES (?, ?, ?, ?, ?)",
+                clave + (self._serializar(fechahoras_eventos_sol),
+                         self._acceso))
+            if cursor.rowcount > 0:
+                self._entradas += 1
+            self._escribir_accesos()
+            self._desalojar()
+            self._conexion.commit()
+
+        return fechahoras_eventos_sol
+
+
+    def _escribir_accesos(self):
+        """
+        Escribir las actualizaciones de acceso acumuladas, sin confirmar
+        la transacción. Debe llamarse con el cerrojo adquirido.
+        """
+        if not self._accesos_pendientes:
+            return
+
+        self._conexion.executemany(
+            "UPDATE eventos_sol SET acceso = ? WHERE lat = ? AND lng = ?"
+            " AND fecha = ?",
+            [(acceso,) + clave for clave, acceso
+             in self._accesos_pendientes.items()])
+        self._accesos_pendientes.clear()
+
+
+    def _desalojar(self):
+        """
+        Eliminar las entradas usadas hace más tiempo hasta no superar
+        el número máximo de entradas. Debe llamarse con el cerrojo
+        adquirido.
+        """
+        exceso = self._entradas - self._max_entradas
+        if exceso <= 0:
+            return
+
+        self._conexion.execute(
+            "DELETE FROM eventos_sol WHERE rowid IN (SELECT rowid FROM"
+            " eventos_sol ORDER BY acceso LIMIT ?)", (exceso,))
+        self._entradas = self._conexion.execute(
+            "SELECT COUNT(*) FROM eventos_sol").fetchone()[0]
+        self._estadisticas["desalojos"] += exceso
+
+
+    @staticmethod
+    def _serializar(fechahoras_eventos_sol):
+        """
+        Convertir los eventos del sol a JSON, con las fechas y horas
+        como segundos UNIX y la duración del día en segundos.
+        """
+        return json.dumps({evento: (valor.total_seconds()
+                                    if isinstance(valor, dt.timedelta)
+                                    else valor.timestamp())
+                           for evento, valor in fechahoras_eventos_sol.items()})
+
+
+    @staticmethod
+    def _deserializar(datos):
+        """
+        Convertir el JSON guardado al formato de api.sunrise_sunset.
+        """
+        fechahoras_eventos_sol = dict()
+        for evento, valor in json.loads(datos).items():
+            if evento == "duracion_dia":
+                fechahoras_eventos_sol[evento] = dt.timedelta(seconds=valor)
+            else:
+                fechahoras_eventos_sol[evento] = \
+                    dt.datetime.fromtimestamp(valor, dt.timezone.utc)
+
+        return fechahoras_eventos_sol
+
+
+    def estadisticas(self):
+        """
+        Obtener las estadísticas de uso de la caché.
+
+        Retorno:
+            Diccionario {"aciertos", "fallos", "desalojos", "entradas"}
+            con los contadores desde la creación del objeto y el número
+            actual de entradas guardadas.
+        """
+        with self._cerrojo:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["entradas"] = self._entradas
+
+        return estadisticas
+
+
+    def vaciar(self):
+        """
+        Eliminar todas las entradas de la caché.
+        """
+        with self._cerrojo:
+            self._accesos_pendientes.clear()
+            self._conexion.execute("DELETE FROM eventos_sol")
+            self._conexion.commit()
+            self._entradas = 0
+
+
+    def cerrar(self):
+        """
+        Cerrar la conexión con la base de datos, escribiendo antes las
+        actualizaciones de acceso pendientes.
+        """
+        with self._cerrojo:
+            self._escribir_accesos()
+            self._conexion.commit()
+            self._conexion.close()
+
+
+
+class CacheMemoria:
+    """
+    Caché en memoria de los resultados de una función (por ejemplo una
+    fuente de eventos del sol o un resolutor de zonas horarias), con la
+    misma interfaz que la función. Puede usarse desde varios hilos a la
+    vez. Cuando se supera el número máximo de entradas se desalojan las
+    usadas hace más tiempo. Los fallos simultáneos de una misma entrada
+    se agrupan en una sola llamada a la función (api.VueloUnico).
+
+    Los resultados se comparten entre todas las llamadas, por lo que no
+    deben modificarse.
+    """
+
+    def __init__(self, funcion, max_entradas=10000, nombre="memoria"):
+        """
+        Constructor.
+
+        Argumentos:
+            funcion: función cuyos resultados se guardan.
+            max_entradas: número máximo de entradas (int >= 1) en la
+                caché.
+            nombre: nombre de la caché en metricas.CONSULTAS_CACHE.
+
+        Excepciones:
+            TypeError o ValueError si los argumentos son incorrectos.
+        """
+        if not callable(funcion):
+            raise TypeError("La función de la caché debe ser una función.")
+        if not isinstance(max_entradas, int) or max_entradas < 1:
+            raise ValueError("El máximo de entradas debe ser un entero >= 1.")
+
+        self._funcion = funcion
+        self._max_entradas = max_entradas
+        self._cerrojo = threading.Lock()
+        self._vuelo = api.VueloUnico()
+        self._entradas = collections.OrderedDict()
+        self._estadisticas = {"aciertos": 0, "fallos": 0, "desalojos": 0}
+        self._consultas = _series_consultas(nombre, ("acierto", "fallo"))
+
+
+    def __call__(self, *args, **kwargs):
+        """
+        Obtener el resultado de la función, desde la caché si está
+        guardado. Las llamadas con argumentos no hashables se redirigen
+        directamente a la función.
+
+        Retorno:
+            El resultado de la función.
+
+        Excepciones:
+            Las mismas que la función. Las excepciones no se guardan.
+        """
+        clave = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(clave)
+        except TypeError:
+            return self._funcion(*args, **kwargs)
+
+        with self._cerrojo:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self._estadisticas["aciertos"] += 1
+                self._consultas["acierto"].incrementar()
+                return self._entradas[clave]
+            self._estadisticas["fallos"] += 1
+            self._consultas["fallo"].incrementar()
+
+        valor = self._vuelo.llamar(clave, self._funcion, *args, **kwargs)
+
+        with self._cerrojo:
+            self._entradas[clave] = valor
+            while len(self._entradas) > self._max_entradas:
+                self._entradas.popitem(last=False)
+                self._estadisticas["desalojos"] += 1
+
+        return valor
+
+
+    def estadisticas(self):
+        """
+        Obtener las estadísticas de uso de la caché.
+
+        Retorno:
+            Diccionario {"aciertos", "fallos", "agrupadas", "desalojos",
+            "entradas"} con los contadores desde la creación del objeto
+            (agrupadas son los fallos que esperaron a otra llamada en
+            curso) y el número actual de entradas guardadas.
+        """
+        with self._cerrojo:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["entradas"] = len(self._entradas)
+        estadisticas["agrupadas"] = self._vuelo.estadisticas()["agrupadas"]
+
+        return estadisticas
+
+
+    def vaciar(self):
+        """
+        Eliminar todas las entradas de la caché.
+        """
+        with self._cerrojo:
+            self._entradas.clear()
+
+
+
+def normalizar_direccion(direccion):
+    """
+    Normalizar una dirección para usarla como clave de caché: forma
+    Unicode NFKC, sin distinguir mayúsculas y minúsculas, sin espacios
+    repetidos ni al principio o final y con las comas seguidas de un
+    único espacio.
+
+    Argumentos:
+        direccion: cadena con la dirección.
+
+    Retorno:
+        Cadena con la dirección normalizada.
+    """
+    direccion = unicodedata.normalize("NFKC", direccion).casefold()
+    direccion = " ".join(direccion.split())
+
+    return _SEPARADOR_DIRECCION.sub(", ", direccion).strip(", ")
+
+
+
+class CacheGeocodificacion:
+    """
+    Caché de una función de geocodificación directa (dirección a
+    coordenadas) e inversa (coordenadas a dirección) con su misma
+    interfaz, como api.google_geocode o api.mapquest_geocoding. Puede
+    usarse desde varios hilos a la vez.
+
+    Las direcciones se normalizan (normalizar_direccion) y las
+    coordenadas se cuantizan a un número de decimales para formar las
+    claves. Cada entrada caduca pasado un tiempo. Las localizaciones
+    sin resultados (RuntimeError con ESTADO_SIN_RESULTADOS) también se
+    guardan, durante menos tiempo, para no repetir consultas que no
+    pueden tener éxito; el resto de errores de la función se propagan
+    sin guardarse. Las entradas se guardan en
+    memoria y, de manera opcional, en una base de datos SQLite
+    compartida por varias funciones y procesos.
+    """
+
+    def __init__(self, funcion=None, ruta=None, ttl=30 * 86400,
+                 ttl_error=3600, precision=5, max_entradas=10000,
+                 reloj=time.time):
+        """
+        Constructor.
+
+        Argumentos:
+            funcion: función de geocodificación. None para
+                api.google_geocode.
+            ruta: ruta del archivo SQLite donde guardar también las
+                entradas. None para una caché solo en memoria.
+            ttl: segundos de validez de cada resultado.
+            ttl_error: segundos de validez de cada localización sin
+                resultados.
+            precision: número de decimales de las coordenadas usados en
+                la clave. 5 decimales equivalen a alrededor de 1 metro.
+            max_entradas: número máximo de entradas (int >= 1) en
+                memoria.
+            reloj: función que devuelve los segundos UNIX actuales.
+
+        Excepciones:
+            TypeError o ValueError si los argumentos son incorrectos.
+            sqlite3.Error si no se puede abrir la base de datos.
+        """
+        if funcion is None:
+            funcion = api.google_geocode
+        if not callable(funcion):
+            raise TypeError("La función de geocodificación debe ser una"
+                            " función.")
+        if ttl <= 0 or ttl_error < 0:
+            raise ValueError("Los tiempos de validez deben ser positivos.")
+        if not isinstance(precision, int) or precision < 0:
+            raise ValueError("La precisión debe ser un entero >= 0.")
+        if not isinstance(max_entradas, int) or max_entradas < 1:
+            raise ValueError("El máximo de entradas debe ser un entero >= 1.")
+
+        self._funcion = funcion
+        self._nombre = "{}.{}".format(getattr(funcion, "__module__", ""),
+                                      getattr(funcion, "__qualname__",
+                                              type(funcion).__name__))
+        self._ttl = ttl
+        self._ttl_error = ttl_error
+        self._precision = precision
+        self._max_entradas = max_entradas
+        self._reloj = reloj
+        self._cerrojo = threading.Lock()
+        self._entradas = collections.OrderedDict()
+        self._estadisticas = {"aciertos": 0, "aciertos_error": 0,
+                              "fallos": 0, "desalojos": 0}
+        self._consultas = _series_consultas(
+            "geocodificacion", ("acierto", "acierto_error", "fallo"))
+
+        self._conexion = None
+        if ruta is not None:
+            self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+            if ruta != ":memory:":
+                self._conexion.execute("PRAGMA journal_mode=WAL")
+                self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS geocodificacion ("
+                " funcion TEXT, clave TEXT, datos TEXT, error TEXT,"
+                " caducidad REAL, PRIMARY KEY (funcion, clave))")
+            self._conexion.execute(
+                "DELETE FROM geocodificacion WHERE caducidad <= ?",
+                (self._reloj(),))
+            self._conexion.commit()
+
+
+    def _clave(self, localizacion):
+        """
+        Obtener la clave de una localización y la localización usada
+        al llamar a la función.
+
+        Excepciones:
+            TypeError si la localización está en un formato incorrecto.
+        """
+        if isinstance(localizacion, str):
+            clave = normalizar_direccion(localizacion)
+            if not clave:
+                raise TypeError("Dirección vacía.")
+            return "d:" + clave, localizacion
+
+        try:
+            latitud, longitud = localizacion
+            latitud = round(float(latitud), self._precision)
+            longitud = round(float(longitud), self._precision)
+        except (TypeError, ValueError):
+            raise TypeError("Formato de localización incorrecto.")
+
+        return "c:{!r},{!r}".format(latitud, longitud), (latitud, longitud)
+
+
+    def _buscar(self, clave, ahora):
+        """
+        Buscar una entrada vigente en memoria o en la base de datos.
+        Debe llamarse con el cerrojo adquirido.
+
+        Retorno:
+            Tupla (caducidad, valor, error) o None si no existe.
+        """
+        entrada = self._entradas.get(clave)
+        if entrada is not None:
+            if entrada[0] > ahora:
+                self._entradas.move_to_end(clave)
+                return entrada
+            del self._entradas[clave]
+
+        if self._conexion is None:
+            return None
+
+        fila = self._conexion.execute(
+            "SELECT caducidad, datos, error FROM geocodificacion WHERE"
+            " funcion = ? AND clave = ? AND caducidad > ?",
+            (self._nombre, clave, ahora)).fetchone()
+        if fila is None or fila[2] is not None \
+           and ESTADO_SIN_RESULTADOS not in fila[2]:
+            # Los errores transitorios guardados por versiones
+            # anteriores se ignoran.
+            return None
+
+        entrada = (fila[0], None if fila[1] is None
+                            else self._deserializar(fila[1]), fila[2])
+        self._guardar_memoria(clave, entrada)
+
+        return entrada
+
+
+    def _guardar_memoria(self, clave, entrada):
+        """
+        Guardar una entrada en memoria desalojando las usadas hace más
+        tiempo. Debe llamarse con el cerrojo adquirido.
+        """
+        self._entradas[clave] = entrada
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self._max_entradas:
+            self._entradas.popitem(last=False)
+            self._estadisticas["desalojos"] += 1
+
+
+    def __call__(self, localizacion):
+        """
+        Geocodificar una localización, desde la caché si el resultado
+        (o la falta de resultados) está guardado y vigente o llamando a
+        la función en caso contrario.
+
+        Argumentos:
+            localizacion: dirección str o coordenadas [latitud, longitud].
+                Las coordenadas se pasan a la función cuantizadas.
+
+        Retorno:
+            El resultado de la función.
+
+        Excepciones:
+            TypeError si la localización está en un formato incorrecto.
+            RuntimeError si la función produce un error, o no obtuvo
+                resultados y aún está guardado.
+        """
+        clave, localizacion = self._clave(localizacion)
+
+        with self._cerrojo:
+            entrada = self._buscar(clave, self._reloj())
+            if entrada is not None:
+                _, valor, error = entrada
+                if error is None:
+                    self._estadisticas["aciertos"] += 1
+                    self._consultas["acierto"].incrementar()
+                    return valor
+                self._estadisticas["aciertos_error"] += 1
+                self._consultas["acierto_error"].incrementar()
+                raise RuntimeError(error)
+            self._estadisticas["fallos"] += 1
+            self._consultas["fallo"].incrementar()
+
+        try:
+            valor = self._funcion(localizacion)
+        except RuntimeError as err:
+            if ESTADO_SIN_RESULTADOS not in str(err):
+                raise
+            valor, error, ttl = None, str(err), self._ttl_error
+        else:
+            error, ttl = None, self._ttl
+
+        with self._cerrojo:
+            entrada = (self._reloj() + ttl, valor, error)
+            self._guardar_memoria(clave, entrada)
+            if self._conexion is not None:
+                self._conexion.execute(
+                    "INSERT OR REPLACE INTO geocodificacion VALUES"
+                    " (?, ?, ?, ?, ?)",
+                    (self._nombre, clave,
+                     None if error is not None else json.dumps(valor),
+                     error, entrada[0]))
+                self._conexion.commit()
+
+        if error is not None:
+            raise RuntimeError(error)
+
+        return valor
+
+
+    @classmethod
+    def _deserializar(cls, datos):
+        """
+        Convertir el JSON guardado al resultado de la función, con las
+        listas (coordenadas) como tuplas.
+        """
+        def tuplas(valor):
+            if isinstance(valor, list):
+                return tuple(tuplas(elemento) for elemento in valor)
+            if isinstance(valor, dict):
+                return {clave: tuplas(elemento)
+                        for clave, elemento in valor.items()}
+            return valor
+
+        return tuplas(json.loads(datos))
+
+
+    def estadisticas(self):
+        """
+        Obtener las estadísticas de uso de la caché.
+
+        Retorno:
+            Diccionario {"aciertos", "aciertos_error", "fallos",
+            "desalojos", "entradas"} con los contadores desde la
+            creación del objeto y el número actual de entradas en
+            memoria.
+        """
+        with self._cerrojo:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["entradas"] = len(self._entradas)
+
+        return estadisticas
+
+
+    def vaciar(self):
+        """
+        Eliminar todas las entradas de la función de la caché.
+        """
+        with self._cerrojo:
+            self._entradas.clear()
+            if self._conexion is not None:
+                self._conexion.execute(
+                    "DELETE FROM geocodificacion WHERE funcion = ?",
+                    (self._nombre,))
+                self._conexion.commit()
+
+
+    def cerrar(self):
+        """
+        Cerrar la conexión con la base de datos, si existe.
+        """
+        with self._cerrojo:
+            if self._conexion is not None:
+                self._conexion.close()
+                self._conexion = None
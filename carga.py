@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+#coding=utf-8
+
+"""
+Generador de carga local para medir el rendimiento del servicio HTTP
+de tatwas (servidor.py).
+
+Uso:
+    python3 servidor.py --fuente efemerides --zonas zonas.bin &
+    python3 carga.py http://127.0.0.1:8080 --peticiones 20000 --hilos 32
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+import datetime as dt
+from urllib.parse import urlsplit, urlencode
+
+
+# Ubicaciones usadas por defecto en las peticiones.
+UBICACIONES = ((40.4168, -3.7038), (48.8566, 2.3522), (51.5074, -0.1278),
+               (41.3874, 2.1686), (52.5200, 13.4050), (38.7223, -9.1393))
+
+
+
+def _peticiones(numero, ubicaciones, instante, semilla):
+    """
+    Crear las rutas de las peticiones, repartidas entre las rutas del
+    servicio y las ubicaciones.
+    """
+    aleatorio = random.Random(semilla)
+    rutas = list()
+    for _ in range(numero):
+        latitud, longitud = aleatorio.choice(ubicaciones)
+        parametros = {"lat": latitud, "lng": longitud}
+        if instante is not None:
+            parametros["instante"] = instante
+        tipo = aleatorio.random()
+        if tipo < 0.8:
+            rutas.append("/tatwa?" + urlencode(parametros))
+        elif tipo < 0.9:
+            parametros["tatwa"] = "tejas"
+            rutas.append("/proximo?" + urlencode(parametros))
+        else:
+            if instante is not None:
+                parametros["fecha"] = \
+                    dt.datetime.utcfromtimestamp(instante).date().isoformat()
+                del parametros["instante"]
+            rutas.append("/horario?" + urlencode(parametros))
+
+    return rutas
+
+
+
+def generar_carga(url, peticiones=10000, hilos=16, ubicaciones=UBICACIONES,
+                  instante=None, semilla=0):
+    """
+    Lanzar peticiones al servicio desde varios hilos, cada uno con su
+    propia conexión persistente.
+
+    Argumentos:
+        url: URL base del servicio.
+        peticiones: número total de peticiones.
+        hilos: número de hilos (clientes simultáneos).
+        ubicaciones: secuencia de tuplas (latitud, longitud).
+        instante: segundos UNIX del instante de las peticiones. None
+            para el instante actual del servidor.
+        semilla: semilla de la elección aleatoria de peticiones.
+
+    Retorno:
+        Diccionario {"peticiones", "errores", "segundos",
+        "peticiones_por_segundo", "latencia_p50", "latencia_p95",
+        "latencia_p99", "latencia_max"} con las latencias en segundos.
+    """
+    destino = urlsplit(url)
+    rutas = _peticiones(peticiones, ubicaciones, instante, semilla)
+    latencias = list()
+    errores = [0]
+    cerrojo = threading.Lock()
+
+    def cliente(rutas_cliente):
+        conexion = http.client.HTTPConnection(destino.hostname, destino.port)
+        latencias_cliente = list()
+        errores_cliente = 0
+        for ruta in rutas_cliente:
+            inicio = time.perf_counter()
+            try:
+                conexion.request("GET", ruta)
+                respuesta = conexion.getresponse()
+                respuesta.read()
+            except (OSError, http.client.HTTPException):
+                conexion.close()
+                errores_cliente += 1
+                continue
+            latencias_cliente.append(time.perf_counter() - inicio)
+            errores_cliente += respuesta.status != 200
+        conexion.close()
+
+        with cerrojo:
+            latencias.extend(latencias_cliente)
+            errores[0] += errores_cliente
+
+    clientes = [threading.Thread(target=cliente, args=(rutas[i::hilos],))
+                for i in range(hilos)]
+    inicio = time.perf_counter()
+    for hilo in clientes:
+        hilo.start()
+    for hilo in clientes:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+
+    latencias.sort()
+    percentil = lambda p: latencias[min(len(latencias) - 1,
+                                        int(p * len(latencias)))] \
+                          if latencias else None
+
+    return {"peticiones": peticiones, "errores": errores[0],
+            "segundos": segundos,
+            "peticiones_por_segundo": peticiones / segundos,
+            "latencia_p50": percentil(0.50), "latencia_p95": percentil(0.95),
+            "latencia_p99": percentil(0.99),
+            "latencia_max": latencias[-1] if latencias else None}
+
+
+
+def main():
+    """
+    Función principal
+    """
+    analizador = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    analizador.add_argument("url", nargs="?", default="http://127.0.0.1:8080")
+    analizador.add_argument("--peticiones", type=int, default=10000)
+    analizador.add_argument("--hilos", type=int, default=16)
+    analizador.add_argument("--instante", type=float,
+                            help="segundos UNIX de las peticiones (por"
+                                 " defecto el instante actual)")
+    argumentos = analizador.parse_args()
+
+    resultado = generar_carga(argumentos.url, argumentos.peticiones,
+                              argumentos.hilos,
+                              instante=argumentos.instante)
+    json.dump(resultado, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
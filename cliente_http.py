@@ -0,0 +1,170 @@
+#coding=utf-8
+
+"""
+Módulo con el cliente HTTP compartido por todas las funciones de
+acceso a API: conexiones persistentes, tiempos de espera y reintentos.
+"""
+
+import time
+import threading
+import util as ut
+import metricas
+
+# requests solo se importa al realizar la primera petición.
+requests = ut.ModuloPerezoso("requests")
+
+
+# Tiempos de espera (conexión, lectura) en segundos para cada proveedor.
+TIEMPOS_ESPERA = {"timezonedb": (3.05, 5), "google": (3.05, 5),
+                  "mapquest": (3.05, 10), "sunrise_sunset": (3.05, 5)}
+TIEMPO_ESPERA_POR_DEFECTO = (3.05, 10)
+
+# Códigos de estado HTTP considerados errores transitorios.
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+
+
+class ClienteHttp:
+    """
+    Cliente HTTP con una sesión de conexiones persistentes (keep-alive)
+    reutilizadas entre peticiones, tiempos de espera por proveedor y
+    reintentos con espera exponencial ante errores transitorios.
+    También registra la latencia de las peticiones de cada proveedor.
+
+    La sesión se crea al realizar la primera petición.
+    """
+
+    def __init__(self, tiempos_espera=None, reintentos=3, factor_espera=0.5,
+                 conexiones_por_host=10):
+        """
+        Constructor.
+
+        Argumentos:
+            tiempos_espera: diccionario {proveedor: segundos o tupla
+                (conexión, lectura)} que actualiza TIEMPOS_ESPERA.
+            reintentos: número máximo de reintentos de cada petición.
+            factor_espera: factor de la espera exponencial entre
+                reintentos (factor * 2 ** (reintento - 1) segundos).
+            conexiones_por_host: número máximo de conexiones abiertas
+                guardadas para cada host.
+        """
+        self._tiempos_espera = dict(TIEMPOS_ESPERA)
+        if tiempos_espera is not None:
+            self._tiempos_espera.update(tiempos_espera)
+
+        self._reintentos = reintentos
+        self._factor_espera = factor_espera
+        self._conexiones_por_host = conexiones_por_host
+        self._sesion = None
+
+        self._cerrojo = threading.Lock()
+        self._latencias = dict()
+
+
+    def _obtener_sesion(self):
+        """
+        Obtener la sesión de conexiones persistentes, creándola la
+        primera vez.
+        """
+        with self._cerrojo:
+            if self._sesion is not None:
+                return self._sesion
+
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            reintento = Retry(total=self._reintentos,
+                              backoff_factor=self._factor_espera,
+                              status_forcelist=ESTADOS_REINTENTABLES,
+                              allowed_methods=frozenset(["GET"]),
+                              raise_on_status=False)
+            adaptador = HTTPAdapter(
+                pool_connections=len(self._tiempos_espera),
+                pool_maxsize=self._conexiones_por_host, max_retries=reintento)
+            sesion = requests.Session()
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            self._sesion = sesion
+
+        return sesion
+
+
+    def get(self, proveedor, url, parametros=None):
+        """
+        Realizar una petición GET.
+
+        Argumentos:
+            proveedor: nombre del proveedor de la API, usado para el
+                tiempo de espera y las estadísticas.
+            url: URL de la petición.
+            parametros: diccionario con los parámetros de la URL.
+
+        Retorno:
+            Objeto requests.Response.
+
+        Excepciones:
+            RuntimeError si la petición no puede completarse (error de
+                conexión o tiempo de espera agotado tras los reintentos).
+        """
+        tiempo_espera = self._tiempos_espera.get(proveedor,
+                                                 TIEMPO_ESPERA_POR_DEFECTO)
+        sesion = self._sesion or self._obtener_sesion()
+        inicio = time.perf_counter()
+        try:
+            respuesta = sesion.get(url, params=parametros,
+                                   timeout=tiempo_espera)
+        except requests.RequestException as err:
+            self._registrar(proveedor, time.perf_counter() - inicio, True)
+            raise RuntimeError("Error de conexión con {}: {}"
+                               .format(proveedor, err))
+
+        self._registrar(proveedor, time.perf_counter() - inicio,
+                        not respuesta.ok)
+        return respuesta
+
+
+    def _registrar(self, proveedor, segundos, es_error):
+        """
+        Acumular la latencia de una petición de un proveedor y
+        observarla en el histograma metricas.PETICIONES_API.
+        """
+        metricas.PETICIONES_API.observar(
+            segundos, proveedor=proveedor,
+            resultado="error" if es_error else "ok")
+        with self._cerrojo:
+            latencia = self._latencias.setdefault(
+                proveedor, {"peticiones": 0, "errores": 0,
+                            "segundos_total": 0.0, "segundos_max": 0.0})
+            latencia["peticiones"] += 1
+            latencia["errores"] += es_error
+            latencia["segundos_total"] += segundos
+            latencia["segundos_max"] = max(latencia["segundos_max"], segundos)
+
+
+    def estadisticas(self):
+        """
+        Obtener los contadores de latencia de cada proveedor.
+
+        Retorno:
+            Diccionario {proveedor: {"peticiones", "errores",
+            "segundos_total", "segundos_max", "segundos_medio"}}.
+        """
+        with self._cerrojo:
+            estadisticas = {proveedor: dict(latencia) for proveedor, latencia
+                            in self._latencias.items()}
+
+        for latencia in estadisticas.values():
+            latencia["segundos_medio"] = \
+                latencia["segundos_total"] / latencia["peticiones"]
+
+        return estadisticas
+
+
+    def cerrar(self):
+        """
+        Cerrar todas las conexiones abiertas.
+        """
+        with self._cerrojo:
+            if self._sesion is not None:
+                self._sesion.close()
+                self._sesion = None
@@ -0,0 +1,382 @@
+#coding=utf-8
+
+"""
+Módulo con el demonio que emite un evento en el instante exacto en el
+que cambia el tatwa de cada ubicación configurada.
+
+En lugar de calcular periódicamente los tatwas de cada ubicación, el
+demonio guarda en un montículo el instante del siguiente cambio de
+tatwa de cada una y duerme hasta el más próximo. Los intervalos de
+tatwas se obtienen de manera perezosa de EntornoTatwas.horario_tatwas,
+que pasa automáticamente a los eventos del sol del día siguiente.
+"""
+
+import sys
+import json
+import time
+import heapq
+import socket
+import itertools
+import threading
+import datetime as dt
+import tatwa as tw
+import metricas
+
+
+# Espera máxima entre comprobaciones del reloj: si la hora del sistema
+# se ajusta mientras el demonio duerme, el siguiente cambio se
+# reprograma como mucho en este tiempo.
+MAX_SEGUNDOS_ESPERA = 60
+
+# Espera antes de reintentar obtener los tatwas de una ubicación tras
+# un error al obtener las horas de los eventos del sol.
+SEGUNDOS_REINTENTO = 60
+
+# Espera antes de volver a buscar tatwas de una ubicación cuyo horario
+# ha finalizado por no tener eventos del sol durante
+# EntornoTatwas._MAX_DIAS_SIN_EVENTO días (polos).
+SEGUNDOS_SIN_EVENTOS = 86400
+
+log = metricas.Log("demonio")
+
+
+
+def serializar_evento(evento_tw):
+    """
+    Convertir un evento de cambio de tatwa en un diccionario
+    serializable como JSON.
+
+    Argumentos:
+        evento_tw: diccionario de evento emitido por DemonioTatwas.
+
+    Retorno:
+        Diccionario con el tatwa como nombre, posición y ciclo, y las
+        fechas en formato ISO 8601.
+    """
+    datos = dict(evento_tw)
+    tatwa = datos.pop("tatwa")
+    datos.update({"tatwa": tatwa.nombre, "posicion": tatwa.posicion,
+                  "ciclo": tatwa.ciclo,
+                  "fecha_sol": datos["fecha_sol"].isoformat(),
+                  "fechahora_inicio": datos["fechahora_inicio"].isoformat(),
+                  "fechahora_fin": datos["fechahora_fin"].isoformat()})
+
+    return datos
+
+
+
+def emisor_json(archivo=None):
+    """
+    Crear un emisor que escribe cada evento como una línea JSON.
+
+    Argumentos:
+        archivo: objeto archivo de texto donde escribir. None para la
+            salida estándar.
+
+    Retorno:
+        Función que recibe un evento de cambio de tatwa.
+    """
+    def emitir(evento_tw):
+        salida = sys.stdout if archivo is None else archivo
+        salida.write(json.dumps(serializar_evento(evento_tw),
+                                ensure_ascii=False) + "\n")
+        salida.flush()
+
+    return emitir
+
+
+
+class EmisorSocket:
+    """
+    Emisor que envía cada evento como un datagrama JSON a un socket
+    local UNIX. Si no hay ningún proceso escuchando el evento se
+    descarta, sin detener el demonio.
+    """
+
+    def __init__(self, ruta):
+        """
+        Constructor.
+
+        Argumentos:
+            ruta: ruta del socket UNIX de datagramas destino.
+        """
+        self._ruta = ruta
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+
+    def __call__(self, evento_tw):
+        datos = json.dumps(serializar_evento(evento_tw), ensure_ascii=False)
+        try:
+            self._socket.sendto(datos.encode("utf-8"), self._ruta)
+        except OSError as err:
+            log.warning("Error al enviar el evento al socket",
+                        ruta=self._ruta, error=err)
+
+
+    def cerrar(self):
+        """
+        Cerrar el socket.
+        """
+        self._socket.close()
+
+
+
+class DemonioTatwas:
+    """
+    Demonio que emite un evento en el instante en el que cambia el
+    tatwa de cada ubicación. Cada evento es un diccionario con el
+    formato de EntornoTatwas.horario_tatwas más las claves "ubicacion",
+    "latitud", "longitud" y "evento" (evento del sol desde el que se
+    cuentan los tatwas).
+    """
+
+    def __init__(self, emisor=None, evento="salida", reloj=time.time,
+                 **opciones_entorno):
+        """
+        Constructor.
+
+        Argumentos:
+            emisor: función que recibe cada evento de cambio de tatwa.
+                None para escribirlos como líneas JSON en la salida
+                estándar.
+            evento: evento del sol desde el cual se cuentan los tatwas.
+            reloj: función que devuelve los segundos UNIX actuales (por
+                ejemplo fechahora.RELOJ_NTP.timestamp).
+            opciones_entorno: argumentos de EntornoTatwas para los
+                entornos de cada ubicación.
+
+        Excepciones:
+            ValueError si el evento no es válido para calcular tatwas.
+        """
+        eventos_validos = tw.EntornoTatwas._EVENTOS_SOL_PARA_TATWAS
+        if evento not in eventos_validos:
+            raise ValueError("Evento {} no válido para calcular tatwas: {}"
+                             .format(evento, eventos_validos))
+
+        self._emisor = emisor_json() if emisor is None else emisor
+        self._evento = evento
+        self._reloj = reloj
+        self._opciones_entorno = opciones_entorno
+
+        self._ubicaciones = dict()
+        self._programados = list()
+        self._secuencia = itertools.count()
+        self._condicion = threading.Condition()
+        self._parado = False
+
+
+    def agregar_ubicacion(self, nombre, latitud, longitud):
+        """
+        Agregar una ubicación al demonio y emitir su tatwa actual. Puede
+        llamarse desde otro hilo mientras el demonio está en ejecución;
+        las horas de los eventos del sol se obtienen y el tatwa actual
+        se emite sin bloquear al resto de ubicaciones.
+
+        Argumentos:
+            nombre: nombre único de la ubicación.
+            latitud, longitud: coordenadas de la ubicación.
+
+        Excepciones:
+            ValueError si ya existe una ubicación con ese nombre o las
+                coordenadas no son válidas.
+            RuntimeError si ocurre algún error al obtener la zona
+                horaria. Los errores al obtener las horas de los eventos
+                del sol no se propagan: se reintentan pasados
+                SEGUNDOS_REINTENTO.
+        """
+        with self._condicion:
+            if nombre in self._ubicaciones:
+                raise ValueError("La ubicación {} ya existe".format(nombre))
+
+        entorno_tw = tw.EntornoTatwas(**self._opciones_entorno)
+        entorno_tw.fijar_coordenadas(latitud, longitud)
+
+        ahora = self._reloj()
+        ubicacion = {"nombre": nombre, "entorno": entorno_tw,
+                     "latitud": latitud, "longitud": longitud,
+                     "horario": self._horario(entorno_tw, ahora),
+                     "pendiente": None, "timestamp_fin": ahora}
+
+        with self._condicion:
+            if nombre in self._ubicaciones:
+                raise ValueError("La ubicación {} ya existe".format(nombre))
+            self._ubicaciones[nombre] = ubicacion
+        self._avanzar_y_programar(ubicacion, ahora)
+
+
+    def quitar_ubicacion(self, nombre):
+        """
+        Quitar una ubicación del demonio. Sus cambios ya programados se
+        descartan al llegar su instante.
+
+        Argumentos:
+            nombre: nombre de la ubicación.
+
+        Excepciones:
+            ValueError si no existe la ubicación.
+        """
+        with self._condicion:
+            if self._ubicaciones.pop(nombre, None) is None:
+                raise ValueError("La ubicación {} no existe".format(nombre))
+
+
+    def _horario(self, entorno_tw, timestamp):
+        """
+        Crear el generador de intervalos de tatwas de un entorno que
+        finalizan después de un instante. Solo finaliza si pasan
+        EntornoTatwas._MAX_DIAS_SIN_EVENTO días sin el evento del sol.
+        """
+        fecha = dt.datetime.fromtimestamp(
+            timestamp, entorno_tw._zona_horaria).date() - dt.timedelta(days=1)
+
+        return itertools.dropwhile(
+            lambda ventana: ventana["fechahora_fin"].timestamp() <= timestamp,
+            entorno_tw.horario_tatwas(fecha, dt.date.max, self._evento))
+
+
+    def _programar(self, timestamp, ubicacion):
+        """
+        Programar el siguiente cambio de una ubicación.
+        """
+        heapq.heappush(self._programados,
+                       (timestamp, next(self._secuencia), ubicacion))
+
+
+    def _avanzar(self, ubicacion, ahora):
+        """
+        Emitir el siguiente intervalo de tatwa de una ubicación si ya ha
+        comenzado. Se llama sin el cerrojo adquirido, ya que puede
+        acceder a la fuente de eventos del sol y al emisor. Si no puede
+        obtenerse el siguiente intervalo se reintenta pasados
+        SEGUNDOS_REINTENTO (SEGUNDOS_SIN_EVENTOS si el horario ha
+        finalizado). Los errores del emisor se registran sin detener el
+        demonio.
+
+        Retorno:
+            Timestamp del siguiente cambio a programar.
+        """
+        if ubicacion["pendiente"] is None:
+            try:
+                ubicacion["pendiente"] = next(ubicacion["horario"])
+            except StopIteration:
+                log.warning("Ubicación sin eventos del sol",
+                            ubicacion=ubicacion["nombre"],
+                            evento=self._evento)
+                return self._reintentar(ubicacion, ahora,
+                                        ahora + SEGUNDOS_SIN_EVENTOS)
+            except Exception as err:
+                if isinstance(err, RuntimeError):
+                    log.warning("Error al obtener el siguiente tatwa",
+                                ubicacion=ubicacion["nombre"], error=err)
+                else:
+                    log.exception("Error inesperado al obtener el"
+                                  " siguiente tatwa",
+                                  ubicacion=ubicacion["nombre"])
+                return self._reintentar(ubicacion, ubicacion["timestamp_fin"],
+                                        ahora + SEGUNDOS_REINTENTO)
+
+        ventana = ubicacion["pendiente"]
+        timestamp_inicio = ventana["fechahora_inicio"].timestamp()
+        if timestamp_inicio > ahora:
+            # Días sin evento del sol (latitudes polares).
+            return timestamp_inicio
+
+        evento_tw = dict(ventana, ubicacion=ubicacion["nombre"],
+                         latitud=ubicacion["latitud"],
+                         longitud=ubicacion["longitud"], evento=self._evento)
+        ubicacion["pendiente"] = None
+        ubicacion["timestamp_fin"] = ventana["fechahora_fin"].timestamp()
+        try:
+            self._emisor(evento_tw)
+        except Exception:
+            log.exception("Error al emitir el cambio de tatwa",
+                          ubicacion=ubicacion["nombre"])
+
+        return ubicacion["timestamp_fin"]
+
+
+    def _avanzar_y_programar(self, ubicacion, ahora):
+        """
+        Avanzar una ubicación sin el cerrojo adquirido y programar su
+        siguiente cambio si sigue en el demonio.
+        """
+        timestamp = self._avanzar(ubicacion, ahora)
+
+        with self._condicion:
+            if self._ubicaciones.get(ubicacion["nombre"]) is ubicacion:
+                self._programar(timestamp, ubicacion)
+                self._condicion.notify()
+
+
+    def _reintentar(self, ubicacion, desde, timestamp):
+        """
+        Recrear el horario de una ubicación desde un instante (el final
+        de su último intervalo emitido o el actual) para reintentar en
+        otro.
+
+        Retorno:
+            Timestamp del reintento.
+        """
+        try:
+            ubicacion["horario"] = self._horario(ubicacion["entorno"], desde)
+        except Exception:
+            log.exception("Error al recrear el horario de tatwas",
+                          ubicacion=ubicacion["nombre"])
+
+        return timestamp
+
+
+    def ejecutar(self):
+        """
+        Ejecutar el demonio hasta que se llame a detener. El hilo
+        duerme hasta el siguiente cambio de tatwa de cualquiera de las
+        ubicaciones, sin consultas periódicas. El cerrojo solo se
+        mantiene para consultar y modificar el montículo: los cambios se
+        obtienen y emiten sin él.
+        """
+        while True:
+            with self._condicion:
+                ubicacion = None
+                while not self._parado and ubicacion is None:
+                    ahora = self._reloj()
+                    if not self._programados:
+                        self._condicion.wait()
+                        continue
+
+                    timestamp, _, siguiente = self._programados[0]
+                    if timestamp > ahora:
+                        self._condicion.wait(min(timestamp - ahora,
+                                                 MAX_SEGUNDOS_ESPERA))
+                        continue
+
+                    heapq.heappop(self._programados)
+                    if self._ubicaciones.get(siguiente["nombre"]) \
+                       is siguiente:
+                        ubicacion = siguiente
+                if self._parado:
+                    return
+
+            self._avanzar_y_programar(ubicacion, ahora)
+
+
+    def iniciar(self):
+        """
+        Ejecutar el demonio en un hilo en segundo plano.
+
+        Retorno:
+            Objeto threading.Thread del demonio.
+        """
+        hilo = threading.Thread(target=self.ejecutar, name="demonio_tatwas",
+                                daemon=True)
+        hilo.start()
+
+        return hilo
+
+
+    def detener(self):
+        """
+        Detener la ejecución del demonio.
+        """
+        with self._condicion:
+            self._parado = True
+            self._condicion.notify()
@@ -0,0 +1,226 @@
+#coding=utf-8
+
+"""
+Módulo de cálculo local (sin acceso a red) de las efemérides del sol
+usando el algoritmo de la NOAA (National Oceanic and Atmospheric
+Administration): salida, puesta, mediodía y crepúsculos.
+"""
+
+import math
+import datetime as dt
+import util as ut
+import fechahora as fh
+
+# Dependencias importadas solo cuando se usan por primera vez.
+api = ut.ModuloPerezoso("api")
+
+
+# Ángulo cenital (grados) de cada par de eventos amanecer/ocaso. El de
+# salida y puesta incluye la refracción atmosférica y el radio solar.
+CENITS_EVENTOS_SOL = {("salida", "puesta"): 90.833,
+                      ("amanecer_civil", "ocaso_civil"): 96.0,
+                      ("amanecer_nautico", "ocaso_nautico"): 102.0,
+                      ("amanecer_astronomico", "ocaso_astronomico"): 108.0}
+
+# Fechahora usada por sunrise-sunset.org para eventos que no ocurren en
+# el día (latitudes polares). Se mantiene para tener el mismo formato.
+FECHAHORA_EVENTO_INEXISTENTE = dt.datetime(1970, 1, 1, 0, 0, 1,
+                                           tzinfo=dt.timezone.utc)
+
+# Día juliano correspondiente al ordinal 0 de datetime.date a las 0h UTC.
+_DIA_JULIANO_ORDINAL = 1721424.5
+_MINUTOS_DIA = 24 * 60
+
+
+
+def _posicion_sol(dia_juliano):
+    """
+    Calcular la declinación del sol y la ecuación del tiempo para un
+    instante expresado en día juliano.
+
+    Argumentos:
+        dia_juliano: día juliano (float) del instante a calcular.
+
+    Retorno:
+        Tupla (declinación en radianes, ecuación del tiempo en minutos).
+    """
+    jc = (dia_juliano - 2451545.0) / 36525.0
+
+    longitud_media = math.radians((280.46646 + jc * (36000.76983
+                                   + jc * 0.0003032)) % 360)
+    anomalia_media = math.radians(357.52911 + jc * (35999.05029
+                                  - 0.0001537 * jc))
+    excentricidad = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    ecuacion_centro = \
+        math.sin(anomalia_media) * (1.914602 - jc * (0.004817
+                                    + 0.000014 * jc)) \
+        + math.sin(2 * anomalia_media) * (0.019993 - 0.000101 * jc) \
+        + math.sin(3 * anomalia_media) * 0.000289
+
+    omega = math.radians(125.04 - 1934.136 * jc)
+    longitud_aparente = math.radians(math.degrees(longitud_media)
+                                     + ecuacion_centro - 0.00569
+                                     - 0.00478 * math.sin(omega))
+
+    oblicuidad_media = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059
+                             - jc * 0.001813))) / 60) / 60
+    oblicuidad = math.radians(oblicuidad_media + 0.00256 * math.cos(omega))
+
+    declinacion = math.asin(math.sin(oblicuidad)
+                            * math.sin(longitud_aparente))
+
+    y = math.tan(oblicuidad / 2) ** 2
+    ecuacion_tiempo = 4 * math.degrees(
+        y * math.sin(2 * longitud_media)
+        - 2 * excentricidad * math.sin(anomalia_media)
+        + 4 * excentricidad * y * math.sin(anomalia_media)
+            * math.cos(2 * longitud_media)
+        - 0.5 * y * y * math.sin(4 * longitud_media)
+        - 1.25 * excentricidad ** 2 * math.sin(2 * anomalia_media))
+
+    return declinacion, ecuacion_tiempo
+
+
+
+def _coseno_angulo_horario(latitud, declinacion, cenit):
+    """
+    Calcular el coseno del ángulo horario en el cual el sol alcanza un
+    ángulo cenital determinado.
+
+    Argumentos:
+        latitud: latitud en radianes.
+        declinacion: declinación del sol en radianes.
+        cenit: ángulo cenital en grados.
+
+    Retorno:
+        Coseno del ángulo horario. Si es > 1 el sol nunca alcanza el
+        cenit ese día (siempre por debajo) y si es < -1 nunca baja de
+        él (siempre por encima).
+    """
+    return math.cos(math.radians(cenit)) \
+           / (math.cos(latitud) * math.cos(declinacion)) \
+           - math.tan(latitud) * math.tan(declinacion)
+
+
+
+def _minutos_evento(latitud, longitud, dia_juliano, cenit, signo):
+    """
+    Calcular los minutos UTC, relativos a las 0h del día juliano, en
+    los que ocurre un evento de amanecer (signo -1) u ocaso (signo 1).
+    Se realiza una segunda iteración con la posición del sol en el
+    instante estimado del evento para mejorar la precisión.
+
+    Argumentos:
+        latitud: latitud en radianes.
+        longitud: longitud en grados.
+        dia_juliano: día juliano a las 0h UTC de la fecha.
+        cenit: ángulo cenital del evento en grados.
+        signo: -1 para amaneceres, 1 para ocasos.
+
+    Retorno:
+        Minutos (float) desde las 0h UTC, o None si el evento no ocurre.
+    """
+    minutos = _MINUTOS_DIA / 2 - 4 * longitud
+
+    for _ in range(2):
+        declinacion, ecuacion_tiempo = \
+            _posicion_sol(dia_juliano + minutos / _MINUTOS_DIA)
+        coseno = _coseno_angulo_horario(latitud, declinacion, cenit)
+        if not -1 <= coseno <= 1:
+            return None
+
+        angulo_horario = math.degrees(math.acos(coseno))
+        minutos = _MINUTOS_DIA / 2 - 4 * longitud - ecuacion_tiempo \
+                  + signo * 4 * angulo_horario
+
+    return minutos
+
+
+
+def sunrise_sunset(latitud, longitud, fecha=None, local=False,
+                   zona_horaria=None):
+    """
+    Calcular localmente las horas de la puesta, salida y crepúsculos
+    del sol. Sustituye a api.sunrise_sunset devolviendo los mismos
+    datos sin realizar ninguna petición de red.
+
+    Argumentos:
+        latitud: latitud donde obtener las horas del sol.
+        longitud: longitud donde obtener las horas del sol.
+        fecha: fecha en el cual obtener las horas del sol. Tiene que
+            ser tipo datetime.date. Por defecto se toma la fecha solar
+            media actual de la longitud solicitada.
+        local: flag para indicar si las horas a obtener son locales
+            o UTC.
+        zona_horaria: implementación de datetime.tzinfo usada si local
+            es True. Si es None se obtiene mediante la API TimeZoneDB.
+
+    Retorno:
+        Diccionario con las hora y fecha UTC de cada evento del sol
+            en formato datetime.datetime, excepto "duracion_dia" que
+            tiene formato datetime.timedelta. Los eventos que no
+            ocurren en la fecha toman FECHAHORA_EVENTO_INEXISTENTE.
+
+    Excepciones:
+        TypeError si los tipos de argumentos no son correctos.
+        RuntimeError si local es True sin zona_horaria y la API de
+            zonas horarias produce algún error.
+    """
+    if fecha is None:
+        fecha = (dt.datetime.utcnow()
+                 + dt.timedelta(hours=float(longitud) / 15)).date()
+    elif not isinstance(fecha, dt.date):
+        raise TypeError("La fecha no es de tipo datetime.date o None.")
+
+    if local and zona_horaria is None:
+        zona_horaria = \
+            fh.zona_horaria(api.timezonedb_get((latitud,
+                                                longitud))["zona_horaria"])
+
+    try:
+        latitud_rad = math.radians(float(latitud))
+        longitud = float(longitud)
+    except (TypeError, ValueError):
+        raise TypeError("Las coordenadas no están en formato numérico.")
+
+    dia_juliano = fecha.toordinal() + _DIA_JULIANO_ORDINAL
+    medianoche = dt.datetime.combine(fecha, dt.time(), fh.UTC)
+
+    minutos_eventos = dict()
+    for (amanecer, ocaso), cenit in CENITS_EVENTOS_SOL.items():
+        minutos_eventos[amanecer] = \
+            _minutos_evento(latitud_rad, longitud, dia_juliano, cenit, -1)
+        minutos_eventos[ocaso] = \
+            _minutos_evento(latitud_rad, longitud, dia_juliano, cenit, 1)
+
+    _, ecuacion_tiempo = _posicion_sol(dia_juliano + 0.5 - longitud / 360)
+    minutos_eventos["mediodia"] = _MINUTOS_DIA / 2 - 4 * longitud \
+                                  - ecuacion_tiempo
+
+    fechahoras_eventos_sol = dict()
+    for evento, minutos in minutos_eventos.items():
+        if minutos is None:
+            fechahora = FECHAHORA_EVENTO_INEXISTENTE
+        else:
+            fechahora = medianoche + dt.timedelta(seconds=round(minutos * 60))
+
+        if local:
+            fechahora = fechahora.astimezone(zona_horaria)
+        fechahoras_eventos_sol[evento] = fechahora
+
+    if minutos_eventos["salida"] is not None \
+       and minutos_eventos["puesta"] is not None:
+        duracion_dia = dt.timedelta(
+            seconds=round(minutos_eventos["puesta"] * 60)
+                    - round(minutos_eventos["salida"] * 60))
+    else:
+        declinacion, _ = _posicion_sol(dia_juliano + 0.5 - longitud / 360)
+        coseno = _coseno_angulo_horario(latitud_rad, declinacion,
+                                        CENITS_EVENTOS_SOL[("salida",
+                                                            "puesta")])
+        duracion_dia = dt.timedelta(days=1 if coseno < -1 else 0)
+
+    fechahoras_eventos_sol["duracion_dia"] = duracion_dia
+
+    return fechahoras_eventos_sol
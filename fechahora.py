@@ -4,12 +4,659 @@
 Módulo con funciones de utilidades sobre fechas.
 """
 
+import time
+import bisect
+import threading
 import datetime as dt
-import pytz as tz
-import ntplib
-import api
+import util as ut
+import metricas
+
+# Dependencias importadas solo cuando se usan por primera vez.
+zoneinfo = ut.ModuloPerezoso("zoneinfo")
+ntplib = ut.ModuloPerezoso("ntplib")
+statistics = ut.ModuloPerezoso("statistics")
+futures = ut.ModuloPerezoso("concurrent.futures")
+api = ut.ModuloPerezoso("api")
+
+log = metricas.Log("fechahora")
 
 NTP_URL = "europe.pool.ntp.org"
+SERVIDORES_NTP = (NTP_URL, "time.cloudflare.com", "time.google.com")
+
+# Zona horaria UTC.
+UTC = dt.timezone.utc
+
+# Ordinal (datetime.date.toordinal) del 01/01/1970.
+_ORDINAL_EPOCH = dt.date(1970, 1, 1).toordinal()
+
+# Instante 01/01/1970 00:00 UTC y unidad de los microsegundos UNIX.
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=UTC)
+_MICROSEGUNDO = dt.timedelta(microseconds=1)
+
+# Límite de los microsegundos UNIX (año 2106) por debajo del cual pasar
+# por float segundos tiene un error menor de medio microsegundo, es
+# decir, datetime.fromtimestamp los redondea al valor exacto.
+_LIMITE_MICROSEGUNDOS_FLOAT = 2 ** 32 * 10 ** 6
+
+# Zonas horarias y tablas de desfases creadas, compartidas en el proceso.
+_zonas_horarias = dict()
+_tablas_desfases = dict()
+_cerrojo_tablas = threading.Lock()
+
+
+
+class RelojNtp:
+    """
+    Reloj que mide el desfase con varios servidores NTP una sola vez
+    (o periódicamente en segundo plano) y a partir de él sirve la hora
+    actual usando el reloj monótono del sistema, sin realizar una
+    petición NTP por cada consulta.
+
+    El error de la hora servida es el error de la medición (la mitad
+    del retardo de ida y vuelta) más la deriva acumulada del reloj
+    local desde la sincronización. Cuando la medición es demasiado
+    antigua o el error supera el máximo se vuelve a sincronizar, como
+    mucho una vez cada espera_reintento segundos y desde un solo hilo.
+    """
+
+    def __init__(self, servidores=SERVIDORES_NTP, max_antiguedad=3600,
+                 max_error=1.0, deriva_ppm=100, tiempo_espera=2,
+                 espera_reintento=60):
+        """
+        Constructor.
+
+        Argumentos:
+            servidores: secuencia de servidores NTP a consultar.
+            max_antiguedad: segundos tras los cuales la sincronización
+                se considera caducada.
+            max_error: error máximo permitido (segundos) de la hora
+                servida antes de volver a sincronizar.
+            deriva_ppm: deriva máxima supuesta del reloj local en
+                partes por millón.
+            tiempo_espera: segundos de espera de cada consulta NTP.
+            espera_reintento: segundos mínimos entre intentos de
+                sincronización (con éxito o no) desde timestamp().
+        """
+        self._servidores = tuple(servidores)
+        self._max_antiguedad = max_antiguedad
+        self._max_error = max_error
+        self._deriva = deriva_ppm * 1e-6
+        self._tiempo_espera = tiempo_espera
+        self._espera_reintento = espera_reintento
+        self._proximo_intento = 0
+        self._cerrojo = threading.Lock()
+        self._cerrojo_sincronizacion = threading.Lock()
+        self._referencia = None
+        self._hilo = None
+        self._detener = threading.Event()
+
+
+    def _consultar(self, servidor):
+        """
+        Consultar un servidor NTP.
+
+        Retorno:
+            Tupla (desfase, retardo) en segundos o None si hay error.
+        """
+        inicio = time.perf_counter()
+        try:
+            respuesta = ntplib.NTPClient().request(
+                servidor, timeout=self._tiempo_espera)
+        except (ntplib.NTPException, OSError) as err:
+            metricas.CONSULTAS_NTP.observar(time.perf_counter() - inicio,
+                                            servidor=servidor,
+                                            resultado="error")
+            log.warning("Error en la consulta NTP", servidor=servidor,
+                        error=err)
+            return None
+
+        metricas.CONSULTAS_NTP.observar(time.perf_counter() - inicio,
+                                        servidor=servidor, resultado="ok")
+
+        return respuesta.offset, respuesta.delay
+
+
+    def sincronizar(self):
+        """
+        Medir el desfase del reloj local con todos los servidores a la
+        vez y fijar como referencia la mediana de las mediciones.
+
+        Excepciones:
+            RuntimeError si ningún servidor responde.
+        """
+        with self._cerrojo_sincronizacion:
+            self._sincronizar()
+
+
+    def _sincronizar(self):
+        """
+        Sincronizar con el cerrojo de sincronización ya adquirido. Tras
+        el intento, con éxito o no, timestamp() no vuelve a sincronizar
+        hasta pasado espera_reintento.
+        """
+        try:
+            self._medir()
+        finally:
+            self._proximo_intento = \
+                time.monotonic() + self._espera_reintento
+
+
+    def _medir(self):
+        """
+        Consultar todos los servidores y fijar la referencia.
+        """
+        with futures.ThreadPoolExecutor(max_workers=len(self._servidores)) \
+                as hilos:
+            mediciones = [medicion for medicion
+                          in hilos.map(self._consultar, self._servidores)
+                          if medicion is not None]
+        if not mediciones:
+            raise RuntimeError("Error al acceder a los servidores NTP")
+
+        desfase = statistics.median(desfase for desfase, _ in mediciones)
+        error = max(retardo for _, retardo in mediciones) / 2 \
+                + (max(desfase for desfase, _ in mediciones)
+                   - min(desfase for desfase, _ in mediciones)) / 2
+
+        with self._cerrojo:
+            self._referencia = (time.monotonic(), time.time() + desfase, error)
+
+
+    def error(self):
+        """
+        Obtener el error estimado (segundos) de la hora servida.
+
+        Retorno:
+            Error estimado o None si no se ha sincronizado.
+        """
+        referencia = self._referencia
+        if referencia is None:
+            return None
+
+        monotono, _, error = referencia
+        return error + (time.monotonic() - monotono) * self._deriva
+
+
+    def timestamp(self):
+        """
+        Obtener el timestamp UTC actual. Si no se ha sincronizado o la
+        sincronización ha caducado se sincroniza antes, salvo que no
+        haya pasado espera_reintento desde el último intento: mientras
+        tanto (o si falla la resincronización) se sigue sirviendo la
+        hora de la referencia anterior.
+
+        Retorno:
+            Número de segundos representando el timestamp UTC actual.
+
+        Excepciones:
+            RuntimeError si no se ha podido sincronizar ninguna vez.
+        """
+        referencia = self._referencia
+        if (referencia is None or self._caducada(referencia)) \
+           and time.monotonic() >= self._proximo_intento:
+            referencia = self._resincronizar(referencia)
+        if referencia is None:
+            raise RuntimeError("Error al acceder a los servidores NTP")
+
+        monotono, timestamp, _ = referencia
+        return timestamp + (time.monotonic() - monotono)
+
+
+    def _resincronizar(self, referencia):
+        """
+        Sincronizar desde timestamp(). Solo un hilo consulta los
+        servidores a la vez: si ya hay una referencia, el resto sigue
+        usándola sin esperar; si no, esperan al intento en curso.
+
+        Retorno:
+            Referencia a usar (None si nunca se ha sincronizado).
+
+        Excepciones:
+            RuntimeError si falla la primera sincronización.
+        """
+        if not self._cerrojo_sincronizacion.acquire(
+                blocking=referencia is None):
+            return referencia
+
+        try:
+            # Otro hilo ha podido intentarlo mientras se esperaba.
+            if self._referencia is referencia \
+               and time.monotonic() >= self._proximo_intento:
+                try:
+                    self._sincronizar()
+                except RuntimeError:
+                    if referencia is None:
+                        raise
+            return self._referencia
+        finally:
+            self._cerrojo_sincronizacion.release()
+
+
+    def _caducada(self, referencia):
+        """
+        Comprobar si una referencia es demasiado antigua o su error
+        supera el máximo permitido.
+        """
+        monotono, _, error = referencia
+        antiguedad = time.monotonic() - monotono
+
+        return antiguedad > self._max_antiguedad \
+               or error + antiguedad * self._deriva > self._max_error
+
+
+    def iniciar(self, intervalo=None):
+        """
+        Iniciar un hilo en segundo plano que resincroniza el reloj
+        periódicamente, de modo que timestamp() nunca espera a NTP.
+
+        Argumentos:
+            intervalo: segundos entre sincronizaciones. Por defecto
+                la mitad de la antigüedad máxima.
+        """
+        if self._hilo is not None:
+            return
+        if intervalo is None:
+            intervalo = self._max_antiguedad / 2
+
+        def sincronizar_periodicamente():
+            while True:
+                try:
+                    self.sincronizar()
+                except RuntimeError as err:
+                    log.error("Error en la sincronización NTP periódica",
+                              error=err)
+                if self._detener.wait(intervalo):
+                    break
+
+        self._detener.clear()
+        self._hilo = threading.Thread(target=sincronizar_periodicamente,
+                                      name="reloj_ntp", daemon=True)
+        self._hilo.start()
+
+
+    def detener(self):
+        """
+        Detener el hilo de sincronización en segundo plano.
+        """
+        if self._hilo is None:
+            return
+
+        self._detener.set()
+        self._hilo.join()
+        self._hilo = None
+
+
+# Reloj compartido usado para obtener la hora actual por NTP.
+RELOJ_NTP = RelojNtp()
+
+
+
+def zona_horaria(nombre):
+    """
+    Obtener la zona horaria de un nombre de la base de datos tz. Cada
+    zona se crea una sola vez y se comparte en todo el proceso.
+
+    Argumentos:
+        nombre: nombre de la zona horaria ("Europe/Madrid").
+
+    Retorno:
+        Objeto zoneinfo.ZoneInfo.
+
+    Excepciones:
+        ValueError si la zona horaria no existe.
+    """
+    zona = _zonas_horarias.get(nombre)
+    if zona is None:
+        try:
+            zona = zoneinfo.ZoneInfo(nombre)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError, TypeError) as err:
+            log.warning("Zona horaria inválida", zona=nombre, error=err)
+            raise ValueError("Zona horaria inválida: {}".format(nombre))
+        _zonas_horarias[nombre] = zona
+
+    return zona
+
+
+
+class TablaDesfases:
+    """
+    Tabla precalculada de los cambios de desfase UTC de una zona
+    horaria, con la que se obtiene el desfase de un instante, o de una
+    hora local, mediante una única búsqueda binaria.
+
+    La tabla cubre un intervalo de años que se amplía cuando se
+    consulta un instante fuera de él: el desfase se muestrea cada
+    SEGUNDOS_MUESTRA y cada cambio se localiza al segundo por bisección.
+    """
+
+    # Separación en segundos de las muestras del desfase. Dos cambios de
+    # desfase separados por menos tiempo pueden no detectarse.
+    SEGUNDOS_MUESTRA = 86400
+
+    # Desfase UTC máximo (en valor absoluto) de cualquier zona horaria.
+    MAX_SEGUNDOS_DESFASE = 86400
+
+
+    def __init__(self, zona):
+        """
+        Constructor.
+
+        Argumentos:
+            zona: implementación de datetime.tzinfo.
+        """
+        self.zona = zona
+        self._anios = dict()
+        self._cerrojo = threading.Lock()
+        # Segundos UNIX de inicio y fin cubiertos, instantes de cada
+        # cambio y estados (desfase, horario de verano) desde cada uno, y
+        # horas locales (en segundos) desde las que cambia el desfase a
+        # aplicar a una hora local junto con dicho desfase.
+        self._tabla = (0, 0, (), (), (), ())
+
+
+    def _estado(self, timestamp):
+        """
+        Desfase UTC en segundos y si es horario de verano en un instante.
+        """
+        fechahora = dt.datetime.fromtimestamp(timestamp, self.zona)
+        return (int(fechahora.utcoffset().total_seconds()),
+                bool(fechahora.dst()))
+
+
+    def _cambios_anio(self, anio):
+        """
+        Lista de tuplas (instante, estado) con el estado al comienzo de
+        un año UTC y cada uno de sus cambios.
+        """
+        inicio = (dt.date(anio, 1, 1).toordinal() - _ORDINAL_EPOCH) * 86400
+        fin = (dt.date(anio + 1, 1, 1).toordinal() - _ORDINAL_EPOCH) * 86400
+
+        cambios = [(inicio, self._estado(inicio))]
+        for muestra in range(inicio + self.SEGUNDOS_MUESTRA,
+                             fin + self.SEGUNDOS_MUESTRA,
+                             self.SEGUNDOS_MUESTRA):
+            muestra = min(muestra, fin - 1)
+            estado = self._estado(muestra)
+            while estado != cambios[-1][1]:
+                # Primer segundo con un estado distinto del anterior.
+                a, b = cambios[-1][0], muestra
+                while b - a > 1:
+                    medio = (a + b) // 2
+                    if self._estado(medio) == cambios[-1][1]:
+                        a = medio
+                    else:
+                        b = medio
+                cambios.append((b, self._estado(b)))
+
+        return cambios
+
+
+    def _ampliar(self, timestamp):
+        """
+        Ampliar la tabla para cubrir un instante con margen de un año
+        por cada lado.
+
+        Excepciones:
+            ValueError si el instante está fuera del rango de fechas.
+        """
+        try:
+            anio = dt.datetime.fromtimestamp(timestamp, UTC).year
+        except (OverflowError, OSError) as err:
+            log.warning("Instante fuera de rango", timestamp=timestamp,
+                        error=err)
+            raise ValueError("Instante fuera de rango: {}".format(timestamp))
+        if not dt.MINYEAR < anio < dt.MAXYEAR - 1:
+            raise ValueError("Instante fuera de rango: {}".format(timestamp))
+
+        with self._cerrojo:
+            if self._anios:
+                anio_inicio = min(min(self._anios), anio - 1)
+                anio_fin = max(max(self._anios), anio + 1)
+            else:
+                anio_inicio, anio_fin = anio - 1, anio + 1
+
+            instantes, estados = list(), list()
+            for anio_tabla in range(anio_inicio, anio_fin + 1):
+                if anio_tabla not in self._anios:
+                    self._anios[anio_tabla] = self._cambios_anio(anio_tabla)
+                for instante, estado in self._anios[anio_tabla]:
+                    if not estados or estado != estados[-1]:
+                        instantes.append(instante)
+                        estados.append(estado)
+
+            # En cada cambio, las horas locales entre ambos desfases se
+            # saltan o se repiten: se les aplica el desfase sin horario
+            # de verano (o el anterior si ambos son iguales en esto).
+            limites_locales = [instantes[0] + estados[0][0]]
+            desfases_locales = [estados[0][0]]
+            for i in range(1, len(instantes)):
+                anterior, nuevo = estados[i - 1], estados[i]
+                ambiguo = anterior if anterior[1] <= nuevo[1] else nuevo
+                limites_locales.append(
+                    instantes[i] + min(anterior[0], nuevo[0]))
+                desfases_locales.append(ambiguo[0])
+                limites_locales.append(
+                    instantes[i] + max(anterior[0], nuevo[0]))
+                desfases_locales.append(nuevo[0])
+
+            fin = (dt.date(anio_fin + 1, 1, 1).toordinal()
+                   - _ORDINAL_EPOCH) * 86400
+            self._tabla = (instantes[0], fin, tuple(instantes),
+                           tuple(estados), tuple(limites_locales),
+                           tuple(desfases_locales))
+
+            return self._tabla
+
+
+    def _tabla_cubriendo(self, inicio, fin):
+        """
+        Obtener la tabla asegurando que cubre el intervalo [inicio, fin).
+        """
+        tabla = self._tabla
+        if not tabla[0] <= inicio:
+            tabla = self._ampliar(inicio)
+        if not fin < tabla[1]:
+            tabla = self._ampliar(fin)
+
+        return tabla
+
+
+    def desfase(self, timestamp):
+        """
+        Obtener el desfase UTC de la zona en un instante.
+
+        Argumentos:
+            timestamp: segundos UNIX.
+
+        Retorno:
+            Desfase UTC en segundos.
+
+        Excepciones:
+            ValueError si el instante está fuera del rango de fechas.
+        """
+        _, _, instantes, estados, _, _ = self._tabla_cubriendo(timestamp,
+                                                               timestamp)
+
+        return estados[bisect.bisect_right(instantes, timestamp) - 1][0]
+
+
+    def timestamp_utc(self, segundos_locales):
+        """
+        Convertir una hora local en segundos UNIX. Si la hora local es
+        ambigua (se repite al retrasar la hora) o no existe (se salta
+        al adelantarla) se usa el desfase sin horario de verano, como
+        pytz.localize con is_dst=False.
+
+        Argumentos:
+            segundos_locales: segundos desde el 01/01/1970 de la hora
+                local, sin tener en cuenta el desfase.
+
+        Retorno:
+            Segundos UNIX de la hora local.
+
+        Excepciones:
+            ValueError si la hora está fuera del rango de fechas.
+        """
+        inicio, fin, _, _, limites, desfases = self._tabla
+        if not (inicio + self.MAX_SEGUNDOS_DESFASE <= segundos_locales
+                < fin - self.MAX_SEGUNDOS_DESFASE):
+            inicio, fin, _, _, limites, desfases = self._tabla_cubriendo(
+                segundos_locales - self.MAX_SEGUNDOS_DESFASE,
+                segundos_locales + self.MAX_SEGUNDOS_DESFASE)
+
+        return segundos_locales - desfases[
+            bisect.bisect_right(limites, segundos_locales) - 1]
+
+
+
+def tabla_desfases(zona):
+    """
+    Obtener la tabla de desfases de una zona horaria, compartida en
+    todo el proceso.
+
+    Argumentos:
+        zona: implementación de datetime.tzinfo.
+
+    Retorno:
+        Objeto TablaDesfases.
+    """
+    tabla = _tablas_desfases.get(zona)
+    if tabla is None:
+        with _cerrojo_tablas:
+            tabla = _tablas_desfases.setdefault(zona, TablaDesfases(zona))
+
+    return tabla
+
+
+
+def timestamp_local(fechahora, zona):
+    """
+    Obtener los segundos UNIX de una fecha y hora local sin zona
+    horaria. Las horas ambiguas o inexistentes por cambios de hora usan
+    el desfase sin horario de verano.
+
+    Argumentos:
+        fechahora: objeto datetime.datetime sin zona horaria.
+        zona: implementación de datetime.tzinfo de la hora local.
+
+    Retorno:
+        Segundos UNIX (float).
+
+    Excepciones:
+        ValueError si fechahora tiene zona horaria o está fuera del
+            rango de fechas.
+    """
+    return _segundos_local(fechahora, zona) + fechahora.microsecond / 1e6
+
+
+
+def microsegundos_local(fechahora, zona):
+    """
+    Obtener los microsegundos UNIX (enteros) de una fecha y hora local
+    sin zona horaria. Es el equivalente exacto de timestamp_local.
+
+    Argumentos:
+        fechahora: objeto datetime.datetime sin zona horaria.
+        zona: implementación de datetime.tzinfo de la hora local.
+
+    Retorno:
+        Microsegundos desde el 01/01/1970 UTC (int).
+
+    Excepciones:
+        ValueError si fechahora tiene zona horaria o está fuera del
+            rango de fechas.
+    """
+    return _segundos_local(fechahora, zona) * 10 ** 6 + fechahora.microsecond
+
+
+
+def _segundos_local(fechahora, zona):
+    """
+    Obtener los segundos UNIX enteros (sin los microsegundos) de una
+    fecha y hora local sin zona horaria.
+    """
+    if fechahora.tzinfo is not None:
+        raise ValueError("La fecha y hora ya tiene zona horaria")
+
+    segundos = ((fechahora.toordinal() - _ORDINAL_EPOCH) * 86400
+                + fechahora.hour * 3600 + fechahora.minute * 60
+                + fechahora.second)
+    if isinstance(zona, dt.timezone):
+        return segundos - int(zona.utcoffset(None).total_seconds())
+
+    return tabla_desfases(zona).timestamp_utc(segundos)
+
+
+
+def microsegundos_utc(fechahora):
+    """
+    Obtener los microsegundos UNIX (enteros, sin error de redondeo)
+    de una fecha y hora.
+
+    Argumentos:
+        fechahora: objeto datetime.datetime. Si no tiene zona horaria
+            se considera hora local del sistema, como en
+            datetime.timestamp.
+
+    Retorno:
+        Microsegundos desde el 01/01/1970 UTC (int).
+    """
+    if fechahora.tzinfo is None:
+        fechahora = fechahora.astimezone()
+
+    return (fechahora - _EPOCH) // _MICROSEGUNDO
+
+
+
+def fechahora_microsegundos(microsegundos, zona):
+    """
+    Obtener la fecha y hora local de unos microsegundos UNIX. Es el
+    equivalente exacto (sin pasar por float) de
+    datetime.fromtimestamp(microsegundos / 1e6, zona).
+
+    Argumentos:
+        microsegundos: microsegundos desde el 01/01/1970 UTC (int).
+        zona: implementación de datetime.tzinfo. None para la hora
+            local del sistema sin zona horaria.
+
+    Retorno:
+        Objeto datetime.datetime.
+    """
+    if 0 <= microsegundos < _LIMITE_MICROSEGUNDOS_FLOAT:
+        return dt.datetime.fromtimestamp(microsegundos / 1e6, zona)
+
+    fechahora = _EPOCH + dt.timedelta(microseconds=microsegundos)
+    if zona is None:
+        return fechahora.astimezone().replace(tzinfo=None)
+
+    return fechahora.astimezone(zona)
+
+
+
+def localizar(fechahora, zona):
+    """
+    Asignar una zona horaria a una fecha y hora local sin zona. Las
+    horas ambiguas o inexistentes por cambios de hora usan el desfase
+    sin horario de verano (como pytz.localize), y las inexistentes se
+    normalizan a la hora local equivalente.
+
+    Argumentos:
+        fechahora: objeto datetime.datetime sin zona horaria.
+        zona: implementación de datetime.tzinfo.
+
+    Retorno:
+        Objeto datetime.datetime con zona horaria.
+
+    Excepciones:
+        ValueError si fechahora tiene zona horaria o está fuera del
+            rango de fechas.
+    """
+    if isinstance(zona, dt.timezone):
+        if fechahora.tzinfo is not None:
+            raise ValueError("La fecha y hora ya tiene zona horaria")
+        return fechahora.replace(tzinfo=zona)
+
+    return dt.datetime.fromtimestamp(timestamp_local(fechahora, zona), zona)
 
 
 def restar_horas(hora1, hora2, es_mismo_dia=True):
@@ -48,7 +695,7 @@ def obtener_actual_timestamp(modo="ntp"):
     Obtener el actual timestamp UTC.
 
     Argumentos:
-        modo: "ntp" si se usa el servidor NTP.
+        modo: "ntp" si se usa el reloj sincronizado por NTP (RELOJ_NTP).
               "api" si se usa la api TimeZoneDB.
               "local" si se usa la máquina local.
     Retorno:
@@ -58,17 +705,14 @@ def obtener_actual_timestamp(modo="ntp"):
         RuntimeError si no se obtiene la hora del servidor ntp.
     """
     if modo == "ntp":
-        try:
-            return ntplib.NTPClient().request(NTP_URL).tx_time
-        except ntplib.NTPException as err:
-            print(err) #Log
-            raise RuntimeError("Error al acceder al servidor NTP")
+        return RELOJ_NTP.timestamp()
     
     if modo == "api":
         try:
             return api.timezonedb_get("UTC")["timestamp"]
         except RuntimeError as err:
-            print(err) #Log
+            log.warning("Error al obtener el timestamp de TimeZoneDB",
+                        error=err)
             raise RuntimeError("Error al acceder al API TimeZoneDB")
     
     if modo == "local":
@@ -85,9 +729,9 @@ def obtener_fechahora(zona_horaria, timestamp=None):
     sistema)
 
     Argumentos:
-        zona_horaria: implementación de datetime.tzinfo 
-            (tz.tzfile.DstTzInfo, tz.UTC)) con la zona horaria donde
-            obtener la fecha y hora.
+        zona_horaria: implementación de datetime.tzinfo
+            (zoneinfo.ZoneInfo, UTC) con la zona horaria donde obtener
+            la fecha y hora.
         timestamp: valor int representando el número de segundos en 
             UTC desde el 01/01/1970 (tiempo UNIX). Si es None se
             toma el momento presente.
@@ -122,7 +766,7 @@ def combinar_fecha_hora(fecha = None, hora = None, zona_horaria = None):
         fecha: objeto datetime.date. Si None se toma la fecha actual.
         zona_horaria: zona horaria a usar para obtener la fecha y hora
             actuales. Implementación de datetime.tzinfo
-            (pytz.tzfile.DstTzInfo o pytz.UTC)
+            (zoneinfo.ZoneInfo, UTC).
 
     Retorno:
         Objeto datetime.datetime con la fecha y hora unidas.
@@ -130,7 +774,7 @@ def combinar_fecha_hora(fecha = None, hora = None, zona_horaria = None):
     Excepciones:
         TypeError si hora y fecha no son datetime.time y datetime.date
             respectivamente, o zona_horaria no es una implementación
-            de datetime.tzinfo (tz.tzfile.DstTzInfo, tz.UTC):
+            de datetime.tzinfo (zoneinfo.ZoneInfo, UTC).
         RuntimeError si no se puede acceder al servidor ntp para
             obtener la hora actual.
     """
@@ -138,7 +782,8 @@ def combinar_fecha_hora(fecha = None, hora = None, zona_horaria = None):
         try:
             fechahora = obtener_fechahora(zona_horaria)
         except TypeError as err:
-            print(err) #Log
+            log.warning("Zona horaria inválida", zona=zona_horaria,
+                        error=err)
             raise TypeError("combinar_fecha_hora: Inválida zona_horaria")
 
         if hora is None:
@@ -152,15 +797,16 @@ def combinar_fecha_hora(fecha = None, hora = None, zona_horaria = None):
         try:
             return dt.datetime.combine(fecha, hora)
         except TypeError as err:
-            print(err) #Log
+            log.warning("Fecha u hora inválida", fecha=fecha, hora=hora,
+                        error=err)
             raise TypeError("combinar_fecha_hora: Fecha u hora inválida.")
-    elif not isinstance(zona_horaria, tz.tzfile.DstTzInfo) \
-         and zona_horaria != tz.UTC:
+    elif not isinstance(zona_horaria, dt.tzinfo):
         raise TypeError("combinar_fecha_hora: zona_horaria inválida.")
     
     try:
-        return zona_horaria.localize(dt.datetime.combine(fecha, hora))
+        return localizar(dt.datetime.combine(fecha, hora), zona_horaria)
     except TypeError as err:
-        print(err) #Log
+        log.warning("Fecha u hora inválida", fecha=fecha, hora=hora,
+                    zona=zona_horaria, error=err)
         raise TypeError("combinar_fecha_hora: Fecha u hora inválida")
                 
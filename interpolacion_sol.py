@@ -0,0 +1,305 @@
+#coding=utf-8
+
+"""
+Módulo con una fuente de horas de eventos del sol que solo pide a la
+fuente real (por defecto api.sunrise_sunset) las fechas de muestra,
+una cada cierto número de días, e interpola linealmente las horas de
+las fechas intermedias.
+
+Las horas de los eventos del sol cambian de forma suave de un día a
+otro, salvo en las discontinuidades: eventos que dejan de ocurrir en
+latitudes polares o que pasan de un día UTC a otro. El error de la
+interpolación de cada fecha se estima interpolando del mismo modo las
+horas calculadas localmente con efemerides.sunrise_sunset, que tienen
+la misma forma; si el error estimado de algún evento supera la
+tolerancia (por ejemplo cerca de una discontinuidad), la fecha se pide
+a la fuente real.
+"""
+
+import threading
+import collections
+import datetime as dt
+import util as ut
+import metricas
+import fechahora as fh
+
+# Dependencias importadas solo cuando se usan por primera vez.
+api = ut.ModuloPerezoso("api")
+ef = ut.ModuloPerezoso("efemerides")
+
+
+# Error estimado de las horas interpoladas.
+ERRORES = metricas.REGISTRO.histograma(
+    "tatwametro_interpolacion_sol_error_segundos",
+    "Error estimado de las horas de eventos del sol interpoladas.",
+    limites=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+
+# Horas devueltas interpoladas o pedidas a la fuente real.
+_CONSULTAS = {resultado: metricas.CONSULTAS_CACHE.etiquetar(
+                  cache="interpolacion_sol", resultado=resultado)
+              for resultado in ("interpolada", "real")}
+
+
+
+def _segundos(valor, medianoche):
+    """
+    Convertir la hora de un evento en segundos desde la medianoche UTC
+    de su fecha ("duracion_dia" en sus segundos).
+
+    Retorno:
+        Segundos (float) o None si el evento no ocurre en la fecha.
+    """
+    if isinstance(valor, dt.timedelta):
+        return valor.total_seconds()
+    if valor == ef.FECHAHORA_EVENTO_INEXISTENTE:
+        return None
+
+    return (valor - medianoche).total_seconds()
+
+
+
+class InterpolacionSol:
+    """
+    Fuente de horas de eventos del sol con la interfaz de
+    api.sunrise_sunset que interpola las horas entre fechas de muestra.
+    Puede usarse como fuente de eventos del sol de EntornoTatwas.
+
+    Las fechas de muestra son aquellas cuyo ordinal es múltiplo de
+    dias_muestra, de modo que son las mismas para cualquier intervalo
+    de fechas consultado. Las horas pedidas a la fuente real (muestras
+    y fechas que superan la tolerancia) se guardan en memoria.
+
+    Uso:
+        fuente = InterpolacionSol(cache.CacheEventosSol(), tolerancia=30)
+        EntornoTatwas(fuente_eventos_sol=fuente)
+    """
+
+    def __init__(self, fuente=None, dias_muestra=7, tolerancia=60,
+                 modelo=None, max_muestras=10000):
+        """
+        Constructor.
+
+        Argumentos:
+            fuente: función con la interfaz de api.sunrise_sunset a la
+                cual se piden las horas de las fechas de muestra. None
+                para api.sunrise_sunset.
+            dias_muestra: días (int >= 2) entre fechas de muestra.
+            tolerancia: error máximo estimado en segundos de las horas
+                interpoladas de cada evento.
+            modelo: función con la interfaz de api.sunrise_sunset, sin
+                acceso a red, usada para estimar el error de la
+                interpolación. None para efemerides.sunrise_sunset.
+            max_muestras: número máximo de fechas (int >= 1) guardadas.
+
+        Excepciones:
+            TypeError o ValueError si los argumentos son incorrectos.
+        """
+        if fuente is None:
+            fuente = api.sunrise_sunset
+        if modelo is None:
+            modelo = ef.sunrise_sunset
+        if not callable(fuente) or not callable(modelo):
+            raise TypeError("La fuente y el modelo de eventos del sol deben"
+                            " ser funciones.")
+        if not isinstance(dias_muestra, int) or dias_muestra < 2:
+            raise ValueError("Los días entre muestras deben ser un entero"
+                             " >= 2.")
+        if tolerancia < 0:
+            raise ValueError("La tolerancia debe ser >= 0.")
+        if not isinstance(max_muestras, int) or max_muestras < 1:
+            raise ValueError("El máximo de muestras debe ser un entero >= 1.")
+
+        self._fuente = fuente
+        self._dias_muestra = dias_muestra
+        self._tolerancia = tolerancia
+        self._modelo = modelo
+        self._max_muestras = max_muestras
+        self._cerrojo = threading.Lock()
+        self._vuelo = api.VueloUnico()
+        self._muestras = collections.OrderedDict()
+        self._estadisticas = {"reales": 0, "interpoladas": 0,
+                              "fuera_tolerancia": 0, "error_max": 0.0}
+
+
+    def __reduce__(self):
+        # En otros procesos se empieza sin muestras guardadas.
+        return type(self), (self._fuente, self._dias_muestra,
+                            self._tolerancia, self._modelo,
+                            self._max_muestras)
+
+
+    def _muestra(self, latitud, longitud, fecha):
+        """
+        Obtener las horas de la fuente real y del modelo de una fecha,
+        pidiéndolas solo la primera vez.
+
+        Retorno:
+            Tupla (horas de la fuente, horas del modelo).
+
+        Excepciones:
+            Las mismas que la fuente.
+        """
+        clave = (latitud, longitud, fecha.toordinal())
+        with self._cerrojo:
+            muestra = self._muestras.get(clave)
+            if muestra is not None:
+                self._muestras.move_to_end(clave)
+                return muestra
+
+        muestra = self._vuelo.llamar(clave, self._pedir_muestra, latitud,
+                                     longitud, fecha)
+
+        with self._cerrojo:
+            if clave not in self._muestras:
+                self._estadisticas["reales"] += 1
+            self._muestras[clave] = muestra
+            while len(self._muestras) > self._max_muestras:
+                self._muestras.popitem(last=False)
+
+        return muestra
+
+
+    def _pedir_muestra(self, latitud, longitud, fecha):
+        return (self._fuente(latitud, longitud, fecha),
+                self._modelo(latitud, longitud, fecha))
+
+
+    def interpolar(self, latitud, longitud, fecha):
+        """
+        Obtener las horas UTC de los eventos del sol de una fecha junto
+        con el error estimado de la interpolación.
+
+        Argumentos:
+            latitud: latitud de la ubicación.
+            longitud: longitud de la ubicación.
+            fecha: objeto datetime.date.
+
+        Retorno:
+            Tupla (horas, error). horas es el diccionario de
+            api.sunrise_sunset y error el máximo error estimado en
+            segundos de sus eventos (0 si las horas son de la fuente
+            real).
+
+        Excepciones:
+            TypeError si los tipos de argumentos no son correctos.
+            Las mismas que la fuente.
+        """
+        if not isinstance(fecha, dt.date):
+            raise TypeError("La fecha no es de tipo datetime.date.")
+        try:
+            latitud, longitud = float(latitud), float(longitud)
+        except (TypeError, ValueError):
+            raise TypeError("Las coordenadas no están en formato numérico.")
+
+        desplazamiento = fecha.toordinal() % self._dias_muestra
+        with self._cerrojo:
+            muestra = self._muestras.get((latitud, longitud,
+                                          fecha.toordinal()))
+        if desplazamiento == 0 or muestra is not None:
+            _CONSULTAS["real"].incrementar()
+            return self._muestra(latitud, longitud, fecha)[0], 0.0
+
+        fecha_inicio = fecha - dt.timedelta(days=desplazamiento)
+        fecha_fin = fecha_inicio + dt.timedelta(days=self._dias_muestra)
+        horas_inicio, modelo_inicio = \
+            self._muestra(latitud, longitud, fecha_inicio)
+        horas_fin, modelo_fin = self._muestra(latitud, longitud, fecha_fin)
+        modelo = self._modelo(latitud, longitud, fecha)
+
+        peso = desplazamiento / self._dias_muestra
+        medianoches = [dt.datetime.combine(dia, dt.time(), fh.UTC)
+                       for dia in (fecha_inicio, fecha_fin, fecha)]
+        horas = dict()
+        error = 0.0
+        for evento, valor_inicio in horas_inicio.items():
+            segundos_inicio = _segundos(valor_inicio, medianoches[0])
+            segundos_fin = _segundos(horas_fin[evento], medianoches[1])
+            try:
+                segundos_modelo = [
+                    _segundos(valores[evento], medianoche) for valores,
+                    medianoche in zip((modelo_inicio, modelo_fin, modelo),
+                                      medianoches)]
+            except KeyError:
+                segundos_modelo = None
+            if segundos_inicio is segundos_fin is None \
+               and segundos_modelo == [None, None, None]:
+                # El evento no ocurre en ninguna de las fechas.
+                horas[evento] = valor_inicio
+                continue
+            if segundos_inicio is None or segundos_fin is None \
+               or segundos_modelo is None or None in segundos_modelo:
+                # Discontinuidad o evento sin modelo: no se interpola.
+                error = None
+                break
+
+            segundos = round(segundos_inicio
+                             + (segundos_fin - segundos_inicio) * peso)
+            error = max(error, abs(segundos_modelo[2] - segundos_modelo[0]
+                                   - (segundos_modelo[1]
+                                      - segundos_modelo[0]) * peso))
+            if evento == "duracion_dia":
+                horas[evento] = dt.timedelta(seconds=segundos)
+            else:
+                horas[evento] = medianoches[2] + dt.timedelta(seconds=segundos)
+
+        if error is None or error > self._tolerancia:
+            with self._cerrojo:
+                self._estadisticas["fuera_tolerancia"] += 1
+            _CONSULTAS["real"].incrementar()
+            return self._muestra(latitud, longitud, fecha)[0], 0.0
+
+        with self._cerrojo:
+            self._estadisticas["interpoladas"] += 1
+            self._estadisticas["error_max"] = \
+                max(self._estadisticas["error_max"], error)
+        _CONSULTAS["interpolada"].incrementar()
+        ERRORES.observar(error)
+
+        return horas, error
+
+
+    def __call__(self, latitud, longitud, fecha=None, local=False):
+        """
+        Obtener las horas de los eventos del sol. Las peticiones sin
+        fecha (fecha actual) o con horas locales se redirigen
+        directamente a la fuente.
+
+        Argumentos:
+            Los mismos que api.sunrise_sunset.
+
+        Retorno:
+            El mismo diccionario que api.sunrise_sunset.
+
+        Excepciones:
+            Las mismas que la fuente.
+        """
+        if fecha is None or local:
+            return self._fuente(latitud, longitud, fecha, local)
+
+        return self.interpolar(latitud, longitud, fecha)[0]
+
+
+    def estadisticas(self):
+        """
+        Obtener los contadores de uso.
+
+        Retorno:
+            Diccionario {"reales", "interpoladas", "fuera_tolerancia",
+            "error_max", "muestras"}: fechas pedidas a la fuente,
+            fechas interpoladas, fechas pedidas por superar la
+            tolerancia, máximo error estimado en segundos y fechas
+            guardadas.
+        """
+        with self._cerrojo:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["muestras"] = len(self._muestras)
+
+        return estadisticas
+
+
+    def vaciar(self):
+        """
+        Eliminar todas las fechas guardadas.
+        """
+        with self._cerrojo:
+            self._muestras.clear()
@@ -0,0 +1,179 @@
+#coding=utf-8
+
+"""
+Módulo de cálculo de tatwas por lotes para muchas ubicaciones e
+instantes, repartiendo el trabajo entre un conjunto de procesos.
+"""
+
+import os
+import collections
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+import api
+import cache
+import tatwa as tw
+import resolutor_zonas as rz
+
+
+# Número máximo de entornos (uno por ubicación) guardados en cada
+# proceso.
+MAX_ENTORNOS_POR_PROCESO = 1024
+
+# Configuración y entornos de cada proceso de trabajo.
+_configuracion = None
+_entornos = collections.OrderedDict()
+
+
+
+def _iniciar_proceso(fuente_eventos_sol, ruta_cache_eventos_sol, ruta_zonas):
+    """
+    Inicializar un proceso de trabajo creando la configuración común a
+    todos sus entornos. La caché de eventos del sol (SQLite) y el
+    archivo de zonas horarias (mmap) son compartidos por todos los
+    procesos.
+    """
+    global _configuracion
+
+    if ruta_zonas is None:
+        resolutor_zonas = api.timezonedb_get
+    else:
+        resolutor_zonas = rz.ResolutorZonas(ruta_zonas)
+
+    if ruta_cache_eventos_sol is not None:
+        fuente_eventos_sol = \
+            cache.CacheEventosSol(
+                tw.EntornoTatwas.FUENTES_EVENTOS_SOL.get(fuente_eventos_sol,
+                                                         fuente_eventos_sol),
+                ruta_cache_eventos_sol)
+
+    _configuracion = {"fuente_eventos_sol": fuente_eventos_sol,
+                      "resolutor_zonas": resolutor_zonas}
+    _entornos.clear()
+
+
+
+def _obtener_entorno(latitud, longitud):
+    """
+    Obtener el entorno de tatwas de unas coordenadas, creándolo (y
+    resolviendo su zona horaria) solo la primera vez en el proceso.
+    """
+    clave = (latitud, longitud)
+    entorno_tw = _entornos.get(clave)
+    if entorno_tw is not None:
+        _entornos.move_to_end(clave)
+        return entorno_tw
+
+    entorno_tw = tw.EntornoTatwas(**_configuracion)
+    entorno_tw.fijar_coordenadas(latitud, longitud)
+
+    _entornos[clave] = entorno_tw
+    if len(_entornos) > MAX_ENTORNOS_POR_PROCESO:
+        _entornos.popitem(last=False)
+
+    return entorno_tw
+
+
+
+def _calcular_peticion(latitud, longitud, timestamp):
+    """
+    Calcular los tatwas de una ubicación en un instante usando los
+    últimos eventos del sol ocurridos antes de dicho instante.
+
+    Retorno:
+        Diccionario de tatwas con el formato de
+        EntornoTatwas.calcular_tatwas.
+    """
+    entorno_tw = _obtener_entorno(latitud, longitud)
+    return entorno_tw.calcular_tatwas_fechahora(
+        dt.datetime.fromtimestamp(timestamp, dt.timezone.utc))
+
+
+
+def _calcular_bloque(peticiones):
+    """
+    Calcular un bloque de peticiones en un proceso de trabajo.
+
+    Retorno:
+        Lista con el resultado (o la excepción) de cada petición.
+    """
+    resultados = list()
+    for latitud, longitud, timestamp in peticiones:
+        try:
+            resultados.append(_calcular_peticion(latitud, longitud,
+                                                 timestamp))
+        except (ValueError, TypeError, RuntimeError) as err:
+            resultados.append(err)
+
+    return resultados
+
+
+
+def _bloques(peticiones, tamaño_bloque):
+    """
+    Agrupar de manera perezosa las peticiones en bloques.
+    """
+    bloque = list()
+    for peticion in peticiones:
+        bloque.append(tuple(peticion))
+        if len(bloque) == tamaño_bloque:
+            yield bloque
+            bloque = list()
+    if bloque:
+        yield bloque
+
+
+
+def calcular_tatwas_lote(peticiones, procesos=None, tamaño_bloque=64,
+                         max_bloques_pendientes=None,
+                         fuente_eventos_sol="api",
+                         ruta_cache_eventos_sol=cache.RUTA_CACHE_POR_DEFECTO,
+                         ruta_zonas=None):
+    """
+    Generador que calcula los tatwas de muchas ubicaciones e instantes
+    repartiendo el trabajo entre varios procesos. Las peticiones se
+    consumen de manera perezosa y solo se mantienen en curso un número
+    limitado de bloques, por lo que la memoria usada está acotada aunque
+    el número de peticiones sea muy grande.
+
+    Argumentos:
+        peticiones: iterable de tuplas (latitud, longitud, timestamp),
+            donde timestamp son los segundos UNIX UTC del instante.
+        procesos: número de procesos de trabajo. None para tantos como
+            procesadores.
+        tamaño_bloque: número de peticiones enviadas juntas a un
+            proceso.
+        max_bloques_pendientes: número máximo de bloques en curso. Por
+            defecto el doble del número de procesos.
+        fuente_eventos_sol: nombre de una de las fuentes de
+            EntornoTatwas.FUENTES_EVENTOS_SOL o función (definida a
+            nivel de módulo para poder enviarse a los procesos).
+        ruta_cache_eventos_sol: ruta de la caché persistente de eventos
+            del sol compartida por todos los procesos. None para no
+            usar caché.
+        ruta_zonas: ruta del archivo de zonas horarias compilado con
+            resolutor_zonas.compilar_zonas. None para usar la API
+            TimeZoneDB.
+
+    Retorno:
+        Generador de resultados, en el mismo orden que las peticiones:
+        diccionario de tatwas (formato de EntornoTatwas.calcular_tatwas)
+        o la excepción producida al calcularlos.
+    """
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    if max_bloques_pendientes is None:
+        max_bloques_pendientes = 2 * procesos
+
+    with ProcessPoolExecutor(max_workers=procesos,
+                             initializer=_iniciar_proceso,
+                             initargs=(fuente_eventos_sol,
+                                       ruta_cache_eventos_sol,
+                                       ruta_zonas)) as ejecutor:
+        pendientes = collections.deque()
+        for bloque in _bloques(peticiones, tamaño_bloque):
+            if len(pendientes) >= max_bloques_pendientes:
+                yield from pendientes.popleft().result()
+            pendientes.append(ejecutor.submit(_calcular_bloque, bloque))
+
+        while pendientes:
+            yield from pendientes.popleft().result()
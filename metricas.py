@@ -0,0 +1,694 @@
+#coding=utf-8
+
+"""
+Módulo de instrumentación: contadores e histogramas de duración de las
+peticiones a API, consultas NTP, etapas de EntornoTatwas y consultas a
+cachés, exportables en el formato de texto de Prometheus, y registro
+estructurado (log) de los errores.
+
+Las métricas se acumulan en el registro global REGISTRO y pueden
+exportarse a un archivo o servirse en una ruta HTTP local:
+
+    with metricas.ETAPAS.etiquetar(etapa="calcular_tatwas").medir():
+        ...
+    metricas.REGISTRO.escribir("tatwametro.prom")
+"""
+
+import os
+import sys
+import time
+import bisect
+import threading
+import util as ut
+
+# logging y json solo se importan al registrar o exportar el primer
+# mensaje, de modo que importar el módulo no encarece la importación
+# de tatwa.
+logging = ut.ModuloPerezoso("logging")
+json = ut.ModuloPerezoso("json")
+
+
+# Límites superiores (en segundos) de los intervalos de los histogramas
+# de duración, desde las consultas en memoria hasta las peticiones HTTP.
+LIMITES_SEGUNDOS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1,
+                    0.25, 0.5, 1, 2.5, 5, 10)
+
+# Tipo MIME del formato de texto de Prometheus.
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+
+def _escapar(valor):
+    """
+    Escapar el valor de una etiqueta para el formato de Prometheus.
+    """
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"") \
+                     .replace("\n", "\\n")
+
+
+
+def _formatear_numero(valor):
+    """
+    Formatear un valor numérico para el formato de Prometheus.
+    """
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, int) or float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+
+def _formatear_etiquetas(nombres, valores, adicionales=()):
+    """
+    Formatear el conjunto de etiquetas {nombre="valor",...} de una
+    serie, vacío si no tiene etiquetas.
+    """
+    pares = list(zip(nombres, valores)) + list(adicionales)
+    if not pares:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(nombre, _escapar(valor))
+                          for nombre, valor in pares) + "}"
+
+
+
+class _Metrica:
+    """
+    Base de las métricas: series identificadas por los valores de sus
+    etiquetas.
+    """
+
+    TIPO = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        """
+        Constructor.
+
+        Argumentos:
+            nombre: nombre de la métrica en Prometheus.
+            ayuda: descripción de la métrica.
+            etiquetas: secuencia de nombres de etiquetas de las series.
+        """
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = dict()
+        self._cerrojo = threading.Lock()
+
+
+    def _crear_serie(self):
+        raise NotImplementedError
+
+
+    def etiquetar(self, **etiquetas):
+        """
+        Obtener la serie de unos valores de etiquetas, creándola si no
+        existe. La serie puede guardarse para no repetir la búsqueda en
+        cada medición.
+
+        Argumentos:
+            etiquetas: valor de cada una de las etiquetas de la métrica.
+
+        Retorno:
+            Objeto serie de la métrica.
+
+        Excepciones:
+            ValueError si no se indican exactamente las etiquetas de la
+                métrica.
+        """
+        if len(etiquetas) != len(self.etiquetas):
+            raise ValueError("Las etiquetas de {} son {}"
+                             .format(self.nombre, self.etiquetas))
+        try:
+            clave = tuple(str(etiquetas[nombre]) for nombre in self.etiquetas)
+        except KeyError:
+            raise ValueError("Las etiquetas de {} son {}"
+                             .format(self.nombre, self.etiquetas))
+
+        serie = self._series.get(clave)
+        if serie is None:
+            with self._cerrojo:
+                serie = self._series.setdefault(clave, self._crear_serie())
+
+        return serie
+
+
+    def muestras(self):
+        """
+        Obtener una copia de los valores de todas las series.
+
+        Retorno:
+            Diccionario {tupla de valores de etiquetas: valores}.
+        """
+        with self._cerrojo:
+            series = dict(self._series)
+
+        return {clave: serie.valores() for clave, serie in series.items()}
+
+
+    def exportar(self):
+        """
+        Obtener las líneas de la métrica en el formato de texto de
+        Prometheus.
+
+        Retorno:
+            Lista de líneas.
+        """
+        lineas = ["# HELP {} {}".format(self.nombre,
+                                        self.ayuda.replace("\n", " ")),
+                  "# TYPE {} {}".format(self.nombre, self.TIPO)]
+        for clave, valores in sorted(self.muestras().items()):
+            lineas.extend(self._lineas_serie(clave, valores))
+
+        return lineas
+
+
+
+class _SerieContador:
+    """
+    Serie de un contador.
+    """
+
+    def __init__(self):
+        self._valor = 0
+        self._cerrojo = threading.Lock()
+
+
+    def incrementar(self, valor=1):
+        """
+        Incrementar el contador.
+
+        Argumentos:
+            valor: cantidad no negativa a sumar.
+        """
+        with self._cerrojo:
+            self._valor += valor
+
+
+    def valores(self):
+        return self._valor
+
+
+
+class Contador(_Metrica):
+    """
+    Contador de sucesos (solo se incrementa).
+    """
+
+    TIPO = "counter"
+
+    def _crear_serie(self):
+        return _SerieContador()
+
+
+    def incrementar(self, valor=1, **etiquetas):
+        """
+        Incrementar la serie de unos valores de etiquetas.
+
+        Argumentos:
+            valor: cantidad no negativa a sumar.
+            etiquetas: valor de cada una de las etiquetas.
+        """
+        self.etiquetar(**etiquetas).incrementar(valor)
+
+
+    def _lineas_serie(self, clave, valor):
+        return ["{}{} {}".format(self.nombre,
+                                 _formatear_etiquetas(self.etiquetas, clave),
+                                 _formatear_numero(valor))]
+
+
+
+class _Medicion:
+    """
+    Gestor de contexto que observa en un histograma los segundos
+    transcurridos en su bloque.
+    """
+
+    __slots__ = ("_serie", "_inicio")
+
+    def __init__(self, serie):
+        self._serie = serie
+
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *excepcion):
+        self._serie.observar(time.perf_counter() - self._inicio)
+        return False
+
+
+
+class _SerieHistograma:
+    """
+    Serie de un histograma.
+    """
+
+    def __init__(self, limites):
+        self._limites = limites
+        self._cuentas = [0] * (len(limites) + 1)
+        self._suma = 0.0
+        self._cerrojo = threading.Lock()
+
+
+    def observar(self, valor):
+        """
+        Añadir una observación.
+
+        Argumentos:
+            valor: valor observado (segundos en los histogramas de
+                duración).
+        """
+        posicion = bisect.bisect_left(self._limites, valor)
+        with self._cerrojo:
+            self._cuentas[posicion] += 1
+            self._suma += valor
+
+
+    def medir(self):
+        """
+        Obtener un gestor de contexto que observa la duración de su
+        bloque, se produzca o no una excepción.
+        """
+        return _Medicion(self)
+
+
+    def valores(self):
+        with self._cerrojo:
+            return list(self._cuentas), self._suma
+
+
+
+class Histograma(_Metrica):
+    """
+    Histograma de valores observados (por defecto duraciones en
+    segundos) con intervalos fijos.
+    """
+
+    TIPO = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        """
+        Constructor.
+
+        Argumentos:
+            nombre: nombre de la métrica en Prometheus.
+            ayuda: descripción de la métrica.
+            etiquetas: secuencia de nombres de etiquetas de las series.
+            limites: secuencia creciente de límites superiores de los
+                intervalos, sin incluir el infinito.
+
+        Excepciones:
+            ValueError si los límites no son crecientes.
+        """
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(float(limite) for limite in limites)
+        if list(self.limites) != sorted(set(self.limites)):
+            raise ValueError("Los límites del histograma no son crecientes")
+
+
+    def _crear_serie(self):
+        return _SerieHistograma(self.limites)
+
+
+    def observar(self, valor, **etiquetas):
+        """
+        Añadir una observación a la serie de unos valores de etiquetas.
+
+        Argumentos:
+            valor: valor observado.
+            etiquetas: valor de cada una de las etiquetas.
+        """
+        self.etiquetar(**etiquetas).observar(valor)
+
+
+    def medir(self, **etiquetas):
+        """
+        Obtener un gestor de contexto que observa la duración de su
+        bloque en la serie de unos valores de etiquetas.
+        """
+        return self.etiquetar(**etiquetas).medir()
+
+
+    def _lineas_serie(self, clave, valores):
+        cuentas, suma = valores
+        lineas = list()
+        acumulado = 0
+        for limite, cuenta in zip(self.limites + (float("inf"),), cuentas):
+            acumulado += cuenta
+            lineas.append("{}_bucket{} {}".format(
+                self.nombre,
+                _formatear_etiquetas(self.etiquetas, clave,
+                                     (("le", _formatear_numero(limite)),)),
+                acumulado))
+
+        etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+        lineas.append("{}_sum{} {}".format(self.nombre, etiquetas,
+                                           _formatear_numero(suma)))
+        lineas.append("{}_count{} {}".format(self.nombre, etiquetas,
+                                             acumulado))
+        return lineas
+
+
+
+class Registro:
+    """
+    Conjunto de métricas exportadas juntas.
+    """
+
+    def __init__(self):
+        self._metricas = dict()
+        self._cerrojo = threading.Lock()
+
+
+    def _registrar(self, clase, nombre, ayuda, etiquetas, **opciones):
+        """
+        Obtener una métrica del registro, creándola si no existe.
+
+        Excepciones:
+            ValueError si ya existe una métrica con el mismo nombre y
+                distinto tipo o etiquetas.
+        """
+        with self._cerrojo:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = \
+                    clase(nombre, ayuda, etiquetas, **opciones)
+            elif type(metrica) is not clase \
+                 or metrica.etiquetas != tuple(etiquetas):
+                raise ValueError("Ya existe la métrica {} con otro tipo o"
+                                 " etiquetas".format(nombre))
+
+        return metrica
+
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        """
+        Obtener un contador del registro, creándolo si no existe.
+
+        Argumentos:
+            nombre: nombre de la métrica en Prometheus.
+            ayuda: descripción de la métrica.
+            etiquetas: secuencia de nombres de etiquetas de las series.
+
+        Retorno:
+            Objeto Contador.
+        """
+        return self._registrar(Contador, nombre, ayuda, etiquetas)
+
+
+    def histograma(self, nombre, ayuda, etiquetas=(),
+                   limites=LIMITES_SEGUNDOS):
+        """
+        Obtener un histograma del registro, creándolo si no existe.
+
+        Argumentos:
+            nombre: nombre de la métrica en Prometheus.
+            ayuda: descripción de la métrica.
+            etiquetas: secuencia de nombres de etiquetas de las series.
+            limites: límites superiores de los intervalos.
+
+        Retorno:
+            Objeto Histograma.
+        """
+        return self._registrar(Histograma, nombre, ayuda, etiquetas,
+                               limites=limites)
+
+
+    def exportar(self):
+        """
+        Exportar todas las métricas en el formato de texto de
+        Prometheus (versión 0.0.4).
+
+        Retorno:
+            Cadena con las métricas.
+        """
+        with self._cerrojo:
+            metricas = sorted(self._metricas.items())
+
+        lineas = list()
+        for _, metrica in metricas:
+            lineas.extend(metrica.exportar())
+
+        return "\n".join(lineas) + "\n"
+
+
+    def escribir(self, ruta):
+        """
+        Escribir las métricas en un archivo (por ejemplo para el
+        textfile collector de node_exporter). El archivo se sustituye
+        de forma atómica, de modo que nunca se lee a medio escribir.
+
+        Argumentos:
+            ruta: ruta del archivo.
+
+        Excepciones:
+            OSError si no se puede escribir el archivo.
+        """
+        temporal = "{}.{}.tmp".format(ruta, os.getpid())
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            archivo.write(self.exportar())
+        os.replace(temporal, ruta)
+
+
+
+# Registro global y métricas del proyecto.
+REGISTRO = Registro()
+
+PETICIONES_API = REGISTRO.histograma(
+    "tatwametro_api_peticion_segundos",
+    "Duración de las peticiones HTTP a cada proveedor de API.",
+    ("proveedor", "resultado"))
+CONSULTAS_NTP = REGISTRO.histograma(
+    "tatwametro_ntp_consulta_segundos",
+    "Duración de las consultas a cada servidor NTP.",
+    ("servidor", "resultado"))
+ETAPAS = REGISTRO.histograma(
+    "tatwametro_etapa_segundos",
+    "Duración de cada etapa del cálculo de tatwas de EntornoTatwas.",
+    ("etapa",))
+CONSULTAS_CACHE = REGISTRO.contador(
+    "tatwametro_cache_consultas_total",
+    "Consultas a cada caché según su resultado.",
+    ("cache", "resultado"))
+MENSAJES_LOG = REGISTRO.contador(
+    "tatwametro_log_mensajes_total",
+    "Mensajes de log emitidos por cada módulo y nivel.",
+    ("modulo", "nivel"))
+
+
+
+class Log:
+    """
+    Registro estructurado de mensajes de un módulo: cada mensaje lleva
+    campos clave=valor, que se añaden al texto del mensaje y se pasan
+    al LogRecord (atributo "campos") para los formatos estructurados.
+    Los mensajes se emiten en el logger "tatwametro.<módulo>" y se
+    cuentan en MENSAJES_LOG.
+
+    Uso:
+        log = Log("api")
+        log.warning("Error de geocodificación", proveedor="mapquest")
+    """
+
+    def __init__(self, nombre):
+        """
+        Constructor.
+
+        Argumentos:
+            nombre: nombre del módulo.
+        """
+        self._nombre = nombre
+        self._logger = None
+
+
+    def _emitir(self, nivel, mensaje, campos, info_excepcion=False):
+        """
+        Emitir un mensaje con sus campos.
+        """
+        MENSAJES_LOG.incrementar(modulo=self._nombre, nivel=nivel)
+
+        logger = self._logger
+        if logger is None:
+            logger = self._logger = \
+                logging.getLogger("tatwametro." + self._nombre)
+        numero_nivel = getattr(logging, nivel.upper())
+        if not logger.isEnabledFor(numero_nivel):
+            return
+
+        texto = "".join([mensaje] + [" {}={}".format(campo, valor)
+                                     for campo, valor in campos.items()])
+        logger.log(numero_nivel, texto, exc_info=info_excepcion,
+                   extra={"campos": campos, "evento": mensaje})
+
+
+    def debug(self, mensaje, **campos):
+        self._emitir("debug", mensaje, campos)
+
+
+    def info(self, mensaje, **campos):
+        self._emitir("info", mensaje, campos)
+
+
+    def warning(self, mensaje, **campos):
+        self._emitir("warning", mensaje, campos)
+
+
+    def error(self, mensaje, **campos):
+        self._emitir("error", mensaje, campos)
+
+
+    def exception(self, mensaje, **campos):
+        """
+        Emitir un mensaje de error con la traza de la excepción que se
+        está tratando.
+        """
+        self._emitir("error", mensaje, campos, True)
+
+
+
+class FormateadorJson:
+    """
+    Formateador de logging que convierte cada mensaje en una línea
+    JSON con el instante, nivel, logger, mensaje y campos.
+    """
+
+    def format(self, registro):
+        """
+        Formatear un logging.LogRecord.
+
+        Retorno:
+            Cadena JSON de una línea.
+        """
+        datos = {"instante": registro.created, "nivel": registro.levelname,
+                 "logger": registro.name,
+                 "mensaje": getattr(registro, "evento",
+                                    registro.getMessage())}
+        datos.update(getattr(registro, "campos", {}))
+        if registro.exc_info:
+            datos["excepcion"] = \
+                logging.Formatter().formatException(registro.exc_info)
+
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+
+def configurar_log(nivel="WARNING", formato_json=False, archivo=None):
+    """
+    Configurar la salida de los mensajes de log del proyecto. Sin
+    configurar, logging solo muestra en la salida de error los mensajes
+    de nivel WARNING o superior, sin formato.
+
+    Argumentos:
+        nivel: nombre del nivel mínimo de los mensajes.
+        formato_json: flag para emitir cada mensaje como una línea
+            JSON en lugar de texto.
+        archivo: ruta del archivo donde añadir los mensajes. None para
+            la salida de error.
+
+    Excepciones:
+        ValueError si el nivel no existe.
+        OSError si no se puede abrir el archivo.
+    """
+    numero_nivel = logging.getLevelName(str(nivel).upper())
+    if not isinstance(numero_nivel, int):
+        raise ValueError("Nivel de log desconocido: {}".format(nivel))
+
+    if archivo is None:
+        manejador = logging.StreamHandler(sys.stderr)
+    else:
+        manejador = logging.FileHandler(archivo, encoding="utf-8")
+    if formato_json:
+        manejador.setFormatter(FormateadorJson())
+    else:
+        manejador.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    logger = logging.getLogger("tatwametro")
+    for anterior in list(logger.handlers):
+        logger.removeHandler(anterior)
+        anterior.close()
+    logger.addHandler(manejador)
+    logger.setLevel(numero_nivel)
+    logger.propagate = False
+
+
+
+def iniciar_servidor_metricas(puerto, host="127.0.0.1", registro=REGISTRO):
+    """
+    Servir las métricas en la ruta /metrics de un servidor HTTP local
+    que se ejecuta en un hilo en segundo plano.
+
+    Argumentos:
+        puerto: puerto de escucha (0 para uno libre).
+        host: dirección de escucha.
+        registro: registro de métricas a servir.
+
+    Retorno:
+        Objeto http.server.ThreadingHTTPServer, que se detiene con
+        shutdown().
+
+    Excepciones:
+        OSError si no se puede abrir el puerto.
+    """
+    import http.server
+
+    class ManejadorMetricas(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            cuerpo = registro.exportar().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", TIPO_CONTENIDO)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = http.server.ThreadingHTTPServer((host, puerto),
+                                               ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    return servidor
+
+
+
+def iniciar_escritura_metricas(ruta, intervalo=15, registro=REGISTRO):
+    """
+    Escribir las métricas en un archivo cada cierto tiempo desde un
+    hilo en segundo plano.
+
+    Argumentos:
+        ruta: ruta del archivo.
+        intervalo: segundos entre escrituras.
+        registro: registro de métricas a escribir.
+
+    Retorno:
+        Objeto threading.Event que detiene la escritura (tras una
+        última escritura) al activarse.
+    """
+    detener = threading.Event()
+
+    def escribir_periodicamente():
+        while True:
+            detenido = detener.wait(intervalo)
+            try:
+                registro.escribir(ruta)
+            except OSError as err:
+                Log("metricas").warning("Error al escribir las métricas",
+                                        ruta=ruta, error=err)
+            if detenido:
+                break
+
+    threading.Thread(target=escribir_periodicamente, name="metricas",
+                     daemon=True).start()
+
+    return detener
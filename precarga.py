@@ -0,0 +1,310 @@
+#coding=utf-8
+
+"""
+Módulo con la precarga en segundo plano de las horas de los eventos
+del sol de los próximos días de las ubicaciones activas.
+
+Al cambiar la fecha local de una ubicación, la primera petición de
+cada entorno de tatwas debe obtener las horas de los eventos del sol
+de la nueva fecha, lo que supone acceder a la API justo después de la
+medianoche de cada zona horaria. La precarga pide esas horas antes de
+la medianoche local de cada ubicación a la misma fuente (caché) que
+usan los entornos, de modo que al cambiar de fecha ya están guardadas.
+
+Un hilo planificador guarda en un montículo el instante de la próxima
+precarga de cada ubicación y duerme hasta el más próximo; las fechas a
+cargar se encolan en una cola limitada que atienden varios hilos.
+"""
+
+import time
+import heapq
+import queue
+import itertools
+import threading
+import datetime as dt
+import metricas
+
+
+# Espera máxima entre comprobaciones del reloj del planificador: si la
+# hora del sistema se ajusta mientras duerme, la siguiente precarga se
+# reprograma como mucho en este tiempo.
+MAX_SEGUNDOS_ESPERA = 60
+
+# Espera antes de reintentar encolar las fechas de una ubicación cuando
+# la cola de precargas está llena.
+SEGUNDOS_REINTENTO = 60
+
+# Fechas precargadas según su resultado.
+PRECARGAS = metricas.REGISTRO.contador(
+    "tatwametro_precarga_eventos_sol_total",
+    "Fechas de eventos del sol precargadas según su resultado.",
+    ("resultado",))
+
+log = metricas.Log("precarga")
+
+
+
+def _medianoche(fecha, zona_horaria):
+    """
+    Obtener el timestamp UTC del comienzo de una fecha local.
+    """
+    return dt.datetime.combine(fecha, dt.time(), zona_horaria).timestamp()
+
+
+
+class PrecargaEventosSol:
+    """
+    Precarga en segundo plano de las horas de los eventos del sol de la
+    fecha local actual y los días siguientes de cada ubicación
+    registrada. Las ubicaciones que no se registran de nuevo durante
+    un tiempo dejan de precargarse.
+
+    Uso:
+        precarga = PrecargaEventosSol(cache_eventos_sol, dias=2)
+        precarga.iniciar()
+        precarga.registrar(latitud, longitud, zona_horaria)
+    """
+
+    def __init__(self, fuente, dias=1, hilos=4, max_pendientes=1024,
+                 antelacion=600, caducidad=7 * 86400,
+                 max_ubicaciones=100000, reloj=time.time):
+        """
+        Constructor.
+
+        Argumentos:
+            fuente: función con la interfaz de api.sunrise_sunset a la
+                cual se piden las horas; debe ser la caché que usan
+                los entornos de tatwas (por ejemplo cache.CacheMemoria
+                o cache.CacheEventosSol).
+            dias: número de días (int >= 1) posteriores a la fecha
+                local actual que se precargan.
+            hilos: número de hilos (int >= 1) que piden las horas.
+            max_pendientes: tamaño máximo (int >= 1) de la cola de
+                fechas pendientes de precargar.
+            antelacion: segundos antes de la medianoche local de cada
+                ubicación en los que se precargan sus nuevas fechas.
+            caducidad: segundos sin registrarse tras los cuales una
+                ubicación deja de precargarse.
+            max_ubicaciones: número máximo de ubicaciones (int >= 1)
+                precargadas.
+            reloj: función que devuelve los segundos UNIX actuales (por
+                ejemplo fechahora.RELOJ_NTP.timestamp).
+
+        Excepciones:
+            TypeError o ValueError si los argumentos son incorrectos.
+        """
+        if not callable(fuente) or not callable(reloj):
+            raise TypeError("La fuente de eventos del sol y el reloj deben"
+                            " ser funciones.")
+        for nombre, valor in (("días", dias), ("hilos", hilos),
+                              ("pendientes", max_pendientes),
+                              ("ubicaciones", max_ubicaciones)):
+            if not isinstance(valor, int) or valor < 1:
+                raise ValueError("El número de {} debe ser un entero >= 1."
+                                 .format(nombre))
+        if antelacion < 0 or caducidad <= 0:
+            raise ValueError("La antelación debe ser >= 0 y la caducidad"
+                             " > 0.")
+
+        self._fuente = fuente
+        self._dias = dias
+        self._hilos = hilos
+        self._antelacion = antelacion
+        self._caducidad = caducidad
+        self._max_ubicaciones = max_ubicaciones
+        self._reloj = reloj
+
+        self._cola = queue.Queue(max_pendientes)
+        self._ubicaciones = dict()
+        self._programados = list()
+        self._secuencia = itertools.count()
+        self._condicion = threading.Condition()
+        self._parado = False
+        self._trabajadores = list()
+        self._estadisticas = {"ignoradas": 0, "caducadas": 0}
+        self._precargas = {resultado: PRECARGAS.etiquetar(resultado=resultado)
+                           for resultado in ("cargada", "error",
+                                             "cola_llena")}
+
+
+    def registrar(self, latitud, longitud, zona_horaria):
+        """
+        Registrar el uso de una ubicación. La primera vez se encolan
+        sus fechas y se programan sus precargas; las siguientes solo se
+        anota el uso, por lo que puede llamarse en cada petición.
+
+        Argumentos:
+            latitud, longitud: coordenadas de la ubicación tal y como
+                se pasan a la fuente (EntornoTatwas.coordenadas).
+            zona_horaria: implementación de datetime.tzinfo de la
+                ubicación.
+        """
+        clave = (latitud, longitud)
+        ubicacion = self._ubicaciones.get(clave)
+        if ubicacion is not None:
+            ubicacion["uso"] = self._reloj()
+            return
+
+        with self._condicion:
+            if clave in self._ubicaciones:
+                return
+            if len(self._ubicaciones) >= self._max_ubicaciones:
+                self._estadisticas["ignoradas"] += 1
+                return
+
+            ahora = self._reloj()
+            self._ubicaciones[clave] = \
+                {"clave": clave, "zona_horaria": zona_horaria,
+                 "uso": ahora, "hasta": None}
+            self._programar(ahora, self._ubicaciones[clave])
+            self._condicion.notify()
+
+
+    def _programar(self, timestamp, ubicacion):
+        """
+        Programar la siguiente precarga de una ubicación.
+        """
+        heapq.heappush(self._programados,
+                       (timestamp, next(self._secuencia), ubicacion))
+
+
+    def _encolar(self, ubicacion, ahora):
+        """
+        Encolar las fechas aún no precargadas de una ubicación, desde
+        la fecha local actual hasta los días siguientes a la fecha que
+        comienza dentro de la antelación, y programar su siguiente
+        precarga antes de la próxima medianoche local. Si la cola está
+        llena se reintenta pasados SEGUNDOS_REINTENTO.
+        """
+        if ahora - ubicacion["uso"] > self._caducidad:
+            del self._ubicaciones[ubicacion["clave"]]
+            self._estadisticas["caducadas"] += 1
+            return
+
+        zona_horaria = ubicacion["zona_horaria"]
+        fecha = dt.datetime.fromtimestamp(ahora, zona_horaria).date()
+        # Fecha local en la siguiente medianoche si está dentro de la
+        # antelación, o la actual en caso contrario.
+        fecha_proxima = dt.datetime.fromtimestamp(
+            ahora + self._antelacion, zona_horaria).date()
+        fecha_carga = fecha if ubicacion["hasta"] is None \
+                      else max(fecha, ubicacion["hasta"]
+                                      + dt.timedelta(days=1))
+        while fecha_carga <= fecha_proxima + dt.timedelta(days=self._dias):
+            try:
+                self._cola.put_nowait(ubicacion["clave"] + (fecha_carga,))
+            except queue.Full:
+                self._precargas["cola_llena"].incrementar()
+                self._programar(ahora + SEGUNDOS_REINTENTO, ubicacion)
+                return
+            ubicacion["hasta"] = fecha_carga
+            fecha_carga += dt.timedelta(days=1)
+
+        siguiente = fecha_proxima + dt.timedelta(days=1)
+        self._programar(_medianoche(siguiente, zona_horaria)
+                        - self._antelacion, ubicacion)
+
+
+    def _planificar(self):
+        """
+        Encolar las fechas de cada ubicación cuando llega su instante
+        de precarga hasta que se llame a detener.
+        """
+        with self._condicion:
+            while not self._parado:
+                ahora = self._reloj()
+                if not self._programados:
+                    self._condicion.wait()
+                    continue
+
+                timestamp, _, ubicacion = self._programados[0]
+                if timestamp > ahora:
+                    self._condicion.wait(min(timestamp - ahora,
+                                             MAX_SEGUNDOS_ESPERA))
+                    continue
+
+                heapq.heappop(self._programados)
+                if self._ubicaciones.get(ubicacion["clave"]) is ubicacion:
+                    self._encolar(ubicacion, ahora)
+
+
+    def _precargar(self):
+        """
+        Pedir a la fuente las fechas encoladas hasta recibir None.
+        """
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                break
+
+            latitud, longitud, fecha = tarea
+            try:
+                self._fuente(latitud, longitud, fecha)
+            except RuntimeError as err:
+                self._precargas["error"].incrementar()
+                log.warning("Error al precargar las horas de eventos del"
+                            " sol", latitud=latitud, longitud=longitud,
+                            fecha=fecha, error=err)
+            except Exception:
+                self._precargas["error"].incrementar()
+                log.exception("Error inesperado al precargar las horas de"
+                              " eventos del sol", latitud=latitud,
+                              longitud=longitud, fecha=fecha)
+            else:
+                self._precargas["cargada"].incrementar()
+
+
+    def iniciar(self):
+        """
+        Iniciar el hilo planificador y los hilos de precarga en segundo
+        plano.
+        """
+        if self._trabajadores:
+            return
+
+        self._parado = False
+        self._trabajadores = \
+            [threading.Thread(target=self._planificar,
+                              name="precarga_planificador", daemon=True)]
+        self._trabajadores += \
+            [threading.Thread(target=self._precargar,
+                              name="precarga_{}".format(indice), daemon=True)
+             for indice in range(self._hilos)]
+        for hilo in self._trabajadores:
+            hilo.start()
+
+
+    def detener(self):
+        """
+        Detener los hilos de precarga tras atender las fechas ya
+        encoladas.
+        """
+        if not self._trabajadores:
+            return
+
+        with self._condicion:
+            self._parado = True
+            self._condicion.notify()
+        for _ in range(self._hilos):
+            self._cola.put(None)
+        for hilo in self._trabajadores:
+            hilo.join()
+        self._trabajadores = list()
+
+
+    def estadisticas(self):
+        """
+        Obtener los contadores de uso.
+
+        Retorno:
+            Diccionario {"ubicaciones", "pendientes", "ignoradas",
+            "caducadas"}: ubicaciones precargadas, fechas en la cola,
+            ubicaciones no registradas por superar el máximo y
+            ubicaciones que han dejado de precargarse por no usarse.
+        """
+        with self._condicion:
+            estadisticas = dict(self._estadisticas)
+            estadisticas["ubicaciones"] = len(self._ubicaciones)
+        estadisticas["pendientes"] = self._cola.qsize()
+
+        return estadisticas
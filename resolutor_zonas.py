@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#coding=utf-8
+
+"""
+Módulo para obtener localmente (sin acceso a red) la zona horaria de
+unas coordenadas a partir de los polígonos de las zonas horarias.
+
+Los polígonos se obtienen del GeoJSON publicado por el proyecto
+timezone-boundary-builder y se compilan a un archivo binario con un
+índice espacial de celdas, que se lee mediante mmap sin analizarlo:
+
+    python3 resolutor_zonas.py combined.json zonas.bin
+"""
+
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+import threading
+from array import array
+
+
+# Cabecera del archivo binario: identificador, tamaño de celda en
+# grados y número de zonas, polígonos, anillos, vértices, índices de
+# celdas y bytes de los nombres de las zonas.
+_CABECERA = struct.Struct("<8sdIIIIII")
+_IDENTIFICADOR = b"TWZONAS1"
+
+# Directorios donde buscar las tablas de países de la base de datos tz.
+RUTAS_TZDATA = ("/usr/share/zoneinfo", "/usr/lib/zoneinfo",
+                "/usr/share/lib/zoneinfo", "/etc/zoneinfo")
+
+
+
+def _dimensiones_rejilla(tamaño_celda):
+    """
+    Obtener el número de columnas y filas de la rejilla de celdas.
+
+    Argumentos:
+        tamaño_celda: tamaño en grados del lado de cada celda.
+
+    Retorno:
+        Tupla (columnas, filas).
+    """
+    return math.ceil(360 / tamaño_celda), math.ceil(180 / tamaño_celda)
+
+
+
+def _celda(longitud, latitud, tamaño_celda, columnas, filas):
+    """
+    Obtener la columna y fila de la celda que contiene un punto.
+    """
+    columna = min(int((longitud + 180) // tamaño_celda), columnas - 1)
+    fila = min(int((latitud + 90) // tamaño_celda), filas - 1)
+
+    return max(columna, 0), max(fila, 0)
+
+
+
+def compilar_zonas(ruta_geojson, ruta_binaria, tamaño_celda=1.0):
+    """
+    Compilar el GeoJSON de límites de zonas horarias a un archivo
+    binario con columnas de tamaño fijo e índice de celdas.
+
+    Argumentos:
+        ruta_geojson: ruta del GeoJSON (FeatureCollection con la
+            propiedad "tzid" y geometrías Polygon o MultiPolygon).
+        ruta_binaria: ruta del archivo binario a generar.
+        tamaño_celda: tamaño en grados del lado de cada celda del
+            índice espacial.
+
+    Excepciones:
+        ValueError si el GeoJSON no tiene el formato esperado.
+        OSError si no se pueden leer o escribir los archivos.
+    """
+    with open(ruta_geojson, encoding="utf-8") as archivo:
+        try:
+            caracteristicas = json.load(archivo)["features"]
+        except (ValueError, KeyError) as err:
+            raise ValueError("GeoJSON de zonas incorrecto: {}".format(err))
+
+    zonas = list()
+    cajas = array("d")
+    poligonos = array("I")
+    anillos = array("I")
+    vertices = array("d")
+
+    for caracteristica in caracteristicas:
+        try:
+            zona = caracteristica["properties"]["tzid"]
+            geometria = caracteristica["geometry"]
+        except (KeyError, TypeError):
+            raise ValueError("Característica del GeoJSON sin tzid o"
+                             " geometría")
+
+        if geometria["type"] == "Polygon":
+            lista_poligonos = [geometria["coordinates"]]
+        elif geometria["type"] == "MultiPolygon":
+            lista_poligonos = geometria["coordinates"]
+        else:
+            raise ValueError("Geometría {} no soportada"
+                             .format(geometria["type"]))
+
+        zonas.append(zona)
+        for poligono in lista_poligonos:
+            poligonos.extend((len(zonas) - 1, len(anillos) // 2,
+                              len(poligono)))
+            for anillo in poligono:
+                anillos.extend((len(vertices) // 2, len(anillo)))
+                for longitud, latitud in anillo:
+                    vertices.extend((longitud, latitud))
+
+            exterior = poligono[0]
+            cajas.extend((min(v[0] for v in exterior),
+                          min(v[1] for v in exterior),
+                          max(v[0] for v in exterior),
+                          max(v[1] for v in exterior)))
+
+    columnas, filas = _dimensiones_rejilla(tamaño_celda)
+    contenido_celdas = [list() for _ in range(columnas * filas)]
+    for indice in range(len(poligonos) // 3):
+        min_lng, min_lat, max_lng, max_lat = cajas[indice * 4:indice * 4 + 4]
+        col_min, fila_min = _celda(min_lng, min_lat, tamaño_celda, columnas,
+                                   filas)
+        col_max, fila_max = _celda(max_lng, max_lat, tamaño_celda, columnas,
+                                   filas)
+        for fila in range(fila_min, fila_max + 1):
+            for columna in range(col_min, col_max + 1):
+                contenido_celdas[fila * columnas + columna].append(indice)
+
+    celdas = array("I")
+    indices = array("I")
+    for contenido in contenido_celdas:
+        celdas.extend((len(indices), len(contenido)))
+        indices.extend(contenido)
+
+    nombres = "\n".join(zonas).encode("utf-8")
+    nombres += b"\0" * (-len(nombres) % 8)
+
+    with open(ruta_binaria, "wb") as archivo:
+        archivo.write(_CABECERA.pack(_IDENTIFICADOR, tamaño_celda, len(zonas),
+                                     len(poligonos) // 3, len(anillos) // 2,
+                                     len(vertices) // 2, len(indices),
+                                     len(nombres)))
+        archivo.write(nombres)
+        # Las secciones se guardan en el orden de bytes nativo ya que se
+        # leen directamente desde la memoria mapeada.
+        for seccion in (cajas, vertices, poligonos, anillos, celdas,
+                        indices):
+            seccion.tofile(archivo)
+
+
+
+def _punto_en_anillo(longitud, latitud, coordenadas):
+    """
+    Comprobar mediante el algoritmo de lanzamiento de rayos si un punto
+    está dentro de un anillo de vértices.
+
+    Argumentos:
+        longitud: longitud del punto.
+        latitud: latitud del punto.
+        coordenadas: lista plana [lng0, lat0, lng1, lat1, ...] con los
+            vértices del anillo.
+
+    Retorno:
+        True si el punto está dentro del anillo.
+    """
+    dentro = False
+    lng_j, lat_j = coordenadas[-2], coordenadas[-1]
+    for i in range(0, len(coordenadas), 2):
+        lng_i, lat_i = coordenadas[i], coordenadas[i + 1]
+        if (lat_i > latitud) != (lat_j > latitud) \
+           and longitud < (lng_j - lng_i) * (latitud - lat_i) \
+                          / (lat_j - lat_i) + lng_i:
+            dentro = not dentro
+        lng_j, lat_j = lng_i, lat_i
+
+    return dentro
+
+
+
+def _cargar_paises():
+    """
+    Cargar desde la base de datos tz del sistema la relación entre
+    zonas horarias y países.
+
+    Retorno:
+        Tupla de diccionarios ({zona: código país}, {código: nombre}).
+        Vacíos si no se encuentran las tablas.
+    """
+    for ruta in RUTAS_TZDATA:
+        try:
+            with open(os.path.join(ruta, "zone.tab"),
+                      encoding="utf-8") as archivo:
+                codigos = {campos[2]: campos[0] for campos in
+                           (linea.rstrip("\n").split("\t")
+                            for linea in archivo if not linea.startswith("#"))
+                           if len(campos) >= 3}
+            with open(os.path.join(ruta, "iso3166.tab"),
+                      encoding="utf-8") as archivo:
+                nombres = {campos[0]: campos[1] for campos in
+                           (linea.rstrip("\n").split("\t")
+                            for linea in archivo if not linea.startswith("#"))
+                           if len(campos) >= 2}
+        except OSError:
+            continue
+
+        return codigos, nombres
+
+    return dict(), dict()
+
+
+
+def zona_por_longitud(longitud):
+    """
+    Obtener la zona horaria náutica (Etc/GMT±N) correspondiente a una
+    longitud. Se usa para puntos fuera de cualquier polígono (océanos).
+
+    Argumentos:
+        longitud: longitud en grados.
+
+    Retorno:
+        Nombre de la zona horaria.
+    """
+    horas = int(round(longitud / 15))
+    if horas == 0:
+        return "Etc/GMT"
+
+    # En las zonas Etc/GMT el signo está invertido respecto a UTC.
+    return "Etc/GMT{:+d}".format(-horas)
+
+
+
+class ResolutorZonas:
+    """
+    Resolutor local de zonas horarias a partir de coordenadas. Tiene la
+    misma interfaz que api.timezonedb_get para coordenadas, de modo que
+    puede usarse en EntornoTatwas como resolutor de zonas horarias.
+
+    El archivo binario se mapea en memoria (solo lectura) la primera
+    vez que se consulta, por lo que varios procesos comparten las
+    mismas páginas de memoria.
+    """
+
+    def __init__(self, ruta):
+        """
+        Constructor.
+
+        Argumentos:
+            ruta: ruta del archivo binario generado con compilar_zonas.
+        """
+        self._ruta = ruta
+        self._cerrojo = threading.Lock()
+        self._datos = None
+        self._paises = None
+
+
+    def _cargar(self):
+        """
+        Mapear en memoria el archivo binario y crear las vistas de
+        cada una de sus secciones.
+
+        Excepciones:
+            ValueError si el archivo no tiene el formato esperado.
+            OSError si no se puede abrir el archivo.
+        """
+        with open(self._ruta, "rb") as archivo:
+            memoria = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (identificador, tamaño_celda, n_zonas, n_poligonos, n_anillos,
+         n_vertices, n_indices, long_nombres) = \
+            _CABECERA.unpack_from(memoria, 0)
+        if identificador != _IDENTIFICADOR:
+            raise ValueError("Archivo de zonas horarias inválido")
+
+        vista = memoryview(memoria)
+        posicion = _CABECERA.size
+        nombres = bytes(vista[posicion:posicion + long_nombres])
+        posicion += long_nombres
+
+        secciones = list()
+        columnas, filas = _dimensiones_rejilla(tamaño_celda)
+        for formato, longitud in (("d", n_poligonos * 4),
+                                  ("d", n_vertices * 2),
+                                  ("I", n_poligonos * 3),
+                                  ("I", n_anillos * 2),
+                                  ("I", columnas * filas * 2),
+                                  ("I", n_indices)):
+            bytes_seccion = longitud * struct.calcsize(formato)
+            secciones.append(vista[posicion:posicion + bytes_seccion]
+                             .cast(formato))
+            posicion += bytes_seccion
+
+        self._datos = {"memoria": memoria, "tamaño_celda": tamaño_celda,
+                       "columnas": columnas, "filas": filas,
+                       "zonas": nombres.rstrip(b"\0").decode("utf-8")
+                                .split("\n")[:n_zonas],
+                       "cajas": secciones[0], "vertices": secciones[1],
+                       "poligonos": secciones[2], "anillos": secciones[3],
+                       "celdas": secciones[4], "indices": secciones[5]}
+
+
+    def zona_horaria(self, latitud, longitud):
+        """
+        Obtener el nombre de la zona horaria de unas coordenadas.
+
+        Argumentos:
+            latitud: latitud en grados.
+            longitud: longitud en grados.
+
+        Retorno:
+            Nombre de la zona horaria (Etc/GMT±N si las coordenadas no
+            están en ningún polígono).
+        """
+        if self._datos is None:
+            with self._cerrojo:
+                if self._datos is None:
+                    self._cargar()
+
+        datos = self._datos
+        columna, fila = _celda(longitud, latitud, datos["tamaño_celda"],
+                               datos["columnas"], datos["filas"])
+        celda = (fila * datos["columnas"] + columna) * 2
+        inicio, cuenta = datos["celdas"][celda], datos["celdas"][celda + 1]
+
+        cajas, anillos, vertices = \
+            datos["cajas"], datos["anillos"], datos["vertices"]
+        for indice in datos["indices"][inicio:inicio + cuenta]:
+            if not (cajas[indice * 4] <= longitud <= cajas[indice * 4 + 2]
+                    and cajas[indice * 4 + 1] <= latitud
+                        <= cajas[indice * 4 + 3]):
+                continue
+
+            zona, primer_anillo, n_anillos = \
+                datos["poligonos"][indice * 3:indice * 3 + 3]
+            for anillo in range(primer_anillo, primer_anillo + n_anillos):
+                primer_vertice = anillos[anillo * 2]
+                n_vertices = anillos[anillo * 2 + 1]
+                coordenadas = vertices[primer_vertice * 2:
+                                       (primer_vertice + n_vertices) * 2]
+                dentro = _punto_en_anillo(longitud, latitud,
+                                          coordenadas.tolist())
+                # El primer anillo es el exterior y el resto agujeros.
+                if dentro != (anillo == primer_anillo):
+                    break
+            else:
+                return datos["zonas"][zona]
+
+        return zona_por_longitud(longitud)
+
+
+    def __call__(self, localizacion, timestamp=None):
+        """
+        Obtener los datos de la zona horaria de unas coordenadas con el
+        mismo formato que api.timezonedb_get (sin los campos que
+        dependen del instante: fechahora, timestamp, horario_verano y
+        segundos_desfase).
+
+        Argumentos:
+            localizacion: coordenadas (lista [latitud, longitud]).
+            timestamp: ignorado. Existe por compatibilidad con
+                api.timezonedb_get.
+
+        Retorno:
+            Diccionario {"zona_horaria", "direccion", "nombre_pais",
+            "codigo_pais"}.
+
+        Excepciones:
+            TypeError si la localización está en un formato incorrecto.
+            OSError o ValueError si no se puede cargar el archivo.
+        """
+        try:
+            latitud, longitud = float(localizacion[0]), float(localizacion[1])
+        except (TypeError, IndexError, ValueError):
+            raise TypeError("Formato de localización incorrecto. Debe"
+                            " pasarse una lista de dos coordenadas")
+
+        zona_horaria = self.zona_horaria(latitud, longitud)
+
+        if self._paises is None:
+            self._paises = _cargar_paises()
+        codigos, nombres = self._paises
+        codigo_pais = codigos.get(zona_horaria, "")
+        nombre_pais = nombres.get(codigo_pais, "")
+
+        ciudad = zona_horaria.split("/")[-1].replace("_", " ")
+        direccion = "{}, {}({})".format(ciudad, nombre_pais, codigo_pais) \
+                    if codigo_pais else ciudad
+
+        return {"zona_horaria": zona_horaria, "direccion": direccion,
+                "nombre_pais": nombre_pais, "codigo_pais": codigo_pais}
+
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit("Uso: {} geojson binario [tamaño_celda]".format(sys.argv[0]))
+
+    compilar_zonas(sys.argv[1], sys.argv[2],
+                   float(sys.argv[3]) if len(sys.argv) == 4 else 1.0)
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+#coding=utf-8
+
+"""
+Servicio HTTP/JSON de cálculo de tatwas.
+
+Rutas (todas GET, con las coordenadas en los parámetros lat y lng):
+    /tatwa?lat=&lng=[&instante=]
+        Tatwas de cada evento del sol en un instante.
+    /horario?lat=&lng=[&fecha=][&fecha_fin=][&evento=]
+        Horario de tatwas de uno o varios días solares.
+    /proximo?lat=&lng=&tatwa=[&ciclo=][&instante=][&n=][&evento=]
+        Próximos intervalos en los que ocurre un tatwa.
+
+El instante puede indicarse como segundos UNIX o en formato ISO 8601
+(hora local de las coordenadas si no tiene zona horaria). Por defecto
+se toma el instante actual.
+
+Uso:
+    python3 servidor.py --puerto 8080 --fuente efemerides
+"""
+
+import math
+import json
+import argparse
+import time
+import itertools
+import threading
+import collections
+import datetime as dt
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import api
+import cache
+import metricas
+import tatwa as tw
+import fechahora as fh
+import precarga
+import tablas_sol as ts
+import interpolacion_sol as isol
+import resolutor_zonas as rz
+
+
+# Número máximo de entornos (uno por ubicación) guardados en cada hilo.
+MAX_ENTORNOS_POR_HILO = 1024
+
+# Número máximo de entradas de las cachés en memoria.
+MAX_ENTRADAS_ZONAS = 100000
+MAX_ENTRADAS_EVENTOS_SOL = 100000
+
+# Número máximo de intervalos devueltos por /horario y /proximo.
+MAX_INTERVALOS = 10000
+
+# Valor por defecto de los parámetros obligatorios.
+_OBLIGATORIO = object()
+
+# Duración de las peticiones atendidas por cada ruta del servicio.
+PETICIONES = metricas.REGISTRO.histograma(
+    "tatwametro_servidor_peticion_segundos",
+    "Duración de las peticiones atendidas por cada ruta del servicio.",
+    ("ruta", "estado"))
+
+log = metricas.Log("servidor")
+
+
+
+def _serializar(valor):
+    """
+    Convertir a JSON los valores de los resultados de EntornoTatwas.
+    """
+    if isinstance(valor, tw.Tatwa):
+        return {"nombre": valor.nombre, "posicion": valor.posicion,
+                "ciclo": valor.ciclo}
+    if isinstance(valor, tw.ResultadoTatwa):
+        return dict(valor)
+    if isinstance(valor, (dt.date, dt.time)):
+        return valor.isoformat()
+    if isinstance(valor, dt.timedelta):
+        return valor.total_seconds()
+
+    raise TypeError("Valor no serializable: {!r}".format(valor))
+
+
+
+class ServicioTatwas:
+    """
+    Lógica del servicio de tatwas, independiente del protocolo HTTP.
+    Las zonas horarias y las horas de los eventos del sol se guardan en
+    cachés en memoria compartidas por todos los hilos, y cada hilo
+    reutiliza un entorno de tatwas por ubicación, por lo que las
+    peticiones repetidas no vuelven a acceder a las API.
+    """
+
+    def __init__(self, fuente_eventos_sol="api",
+                 ruta_cache_eventos_sol=cache.RUTA_CACHE_POR_DEFECTO,
+                 resolutor_zonas=api.timezonedb_get, dias_precarga=None):
+        """
+        Constructor.
+
+        Argumentos:
+            fuente_eventos_sol: nombre de una de las fuentes de
+                EntornoTatwas.FUENTES_EVENTOS_SOL o función con la
+                interfaz de api.sunrise_sunset.
+            ruta_cache_eventos_sol: ruta de la caché persistente de
+                eventos del sol, usada tras la caché en memoria. None
+                para no usar caché persistente.
+            resolutor_zonas: función con la interfaz de
+                api.timezonedb_get.
+            dias_precarga: número de días posteriores a la fecha local
+                de cada ubicación usada cuyas horas de eventos del sol
+                se precargan en la caché en memoria. La precarga
+                (precarga.PrecargaEventosSol) queda en el atributo
+                precarga y debe iniciarse con precarga.iniciar(). None
+                para no precargar.
+        """
+        fuente_eventos_sol = tw.EntornoTatwas.FUENTES_EVENTOS_SOL.get(
+            fuente_eventos_sol, fuente_eventos_sol)
+        if ruta_cache_eventos_sol is not None:
+            fuente_eventos_sol = cache.CacheEventosSol(fuente_eventos_sol,
+                                                       ruta_cache_eventos_sol)
+
+        self.cache_eventos_sol = cache.CacheMemoria(
+            fuente_eventos_sol, MAX_ENTRADAS_EVENTOS_SOL,
+            "eventos_sol_memoria")
+        self.cache_zonas = cache.CacheMemoria(resolutor_zonas,
+                                              MAX_ENTRADAS_ZONAS, "zonas")
+        self.precarga = None
+        if dias_precarga is not None:
+            self.precarga = precarga.PrecargaEventosSol(
+                self.cache_eventos_sol, dias_precarga)
+        self._local = threading.local()
+
+
+    def _entorno(self, latitud, longitud):
+        """
+        Obtener el entorno de tatwas del hilo actual para unas
+        coordenadas, creándolo si no existe.
+        """
+        entornos = getattr(self._local, "entornos", None)
+        if entornos is None:
+            entornos = self._local.entornos = collections.OrderedDict()
+
+        clave = (latitud, longitud)
+        entorno_tw = entornos.get(clave)
+        if entorno_tw is not None:
+            entornos.move_to_end(clave)
+        else:
+            entorno_tw = tw.EntornoTatwas(self.cache_eventos_sol,
+                                          resolutor_zonas=self.cache_zonas)
+            entorno_tw.fijar_coordenadas(latitud, longitud)
+
+            entornos[clave] = entorno_tw
+            if len(entornos) > MAX_ENTORNOS_POR_HILO:
+                entornos.popitem(last=False)
+
+        if self.precarga is not None:
+            self.precarga.registrar(*entorno_tw.coordenadas,
+                                    entorno_tw._zona_horaria)
+
+        return entorno_tw
+
+
+    @staticmethod
+    def _parametro(parametros, nombre, conversion=str, defecto=_OBLIGATORIO):
+        """
+        Obtener y convertir un parámetro de la petición.
+
+        Excepciones:
+            ValueError si el parámetro es obligatorio (sin valor por
+                defecto) y no existe, o no puede convertirse.
+        """
+        valores = parametros.get(nombre)
+        if not valores:
+            if defecto is _OBLIGATORIO:
+                raise ValueError("Falta el parámetro {}".format(nombre))
+            return defecto
+
+        try:
+            return conversion(valores[0])
+        except (ValueError, TypeError):
+            raise ValueError("Valor incorrecto del parámetro {}: {}"
+                             .format(nombre, valores[0]))
+
+
+    @staticmethod
+    def _instante(parametros):
+        """
+        Obtener el parámetro instante como datetime.datetime (sin zona
+        horaria si se considera hora local) o None si no existe.
+        """
+        valores = parametros.get("instante")
+        if not valores:
+            return None
+
+        try:
+            segundos = float(valores[0])
+        except ValueError:
+            try:
+                return dt.datetime.fromisoformat(valores[0])
+            except ValueError:
+                raise ValueError("Valor incorrecto del parámetro instante:"
+                                 " {}".format(valores[0]))
+
+        # Los segundos no finitos o fuera del rango de fechas de la
+        # plataforma no son ValueError en fromtimestamp.
+        if not math.isfinite(segundos):
+            raise ValueError("Valor incorrecto del parámetro instante: {}"
+                             .format(valores[0]))
+        try:
+            return dt.datetime.fromtimestamp(segundos, fh.UTC)
+        except (ValueError, OverflowError, OSError):
+            raise ValueError("Instante fuera de rango: {}"
+                             .format(valores[0]))
+
+
+    def tatwa(self, parametros):
+        """
+        Tatwas de cada evento del sol en un instante.
+        """
+        entorno_tw = self._entorno(self._parametro(parametros, "lat", float),
+                                   self._parametro(parametros, "lng", float))
+        tatwas = entorno_tw.calcular_tatwas_fechahora(
+            self._instante(parametros))
+
+        return {"coordenadas": entorno_tw.coordenadas,
+                "zona_horaria": entorno_tw.zona_horaria,
+                "fechahora": entorno_tw.fechahora_tw, "tatwas": tatwas}
+
+
+    def horario(self, parametros):
+        """
+        Horario de tatwas de uno o varios días solares.
+        """
+        entorno_tw = self._entorno(self._parametro(parametros, "lat", float),
+                                   self._parametro(parametros, "lng", float))
+        fecha = self._parametro(parametros, "fecha", dt.date.fromisoformat,
+                                None)
+        fecha_fin = self._parametro(parametros, "fecha_fin",
+                                    dt.date.fromisoformat, None)
+        evento = self._parametro(parametros, "evento", defecto="salida")
+
+        intervalos = list(itertools.islice(
+            entorno_tw.horario_tatwas(fecha, fecha_fin, evento),
+            MAX_INTERVALOS))
+
+        return {"coordenadas": entorno_tw.coordenadas,
+                "zona_horaria": entorno_tw.zona_horaria,
+                "intervalos": intervalos}
+
+
+    def proximo(self, parametros):
+        """
+        Próximos intervalos en los que ocurre un tatwa.
+        """
+        entorno_tw = self._entorno(self._parametro(parametros, "lat", float),
+                                   self._parametro(parametros, "lng", float))
+        nombre = self._parametro(parametros, "tatwa")
+        ciclo = self._parametro(parametros, "ciclo", int, None)
+        n = self._parametro(parametros, "n", int, 1)
+        if not 0 <= n <= MAX_INTERVALOS:
+            raise ValueError("El número de intervalos debe estar entre 0 y"
+                             " {}".format(MAX_INTERVALOS))
+        evento = self._parametro(parametros, "evento", defecto="salida")
+
+        tatwa = nombre if ciclo is None else tw.Tatwa(nombre, ciclo)
+        intervalos = entorno_tw.proximos_tatwas(
+            tatwa, self._instante(parametros), n, evento)
+
+        return {"coordenadas": entorno_tw.coordenadas,
+                "zona_horaria": entorno_tw.zona_horaria,
+                "intervalos": intervalos}
+
+
+    def estadisticas(self, parametros):
+        """
+        Estadísticas de uso de las cachés y de agrupación de llamadas
+        simultáneas a las API.
+        """
+        estadisticas = \
+            {"cache_eventos_sol": self.cache_eventos_sol.estadisticas(),
+             "cache_zonas": self.cache_zonas.estadisticas(),
+             "vuelo_unico": api.estadisticas_vuelo_unico()}
+        if self.precarga is not None:
+            estadisticas["precarga"] = self.precarga.estadisticas()
+
+        return estadisticas
+
+
+
+class ManejadorTatwas(BaseHTTPRequestHandler):
+    """
+    Manejador HTTP de las rutas del servicio de tatwas. Las conexiones
+    se mantienen abiertas entre peticiones (HTTP/1.1). La ruta /metrics
+    devuelve las métricas en el formato de texto de Prometheus.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    RUTAS = {"/tatwa": ServicioTatwas.tatwa,
+             "/horario": ServicioTatwas.horario,
+             "/proximo": ServicioTatwas.proximo,
+             "/estadisticas": ServicioTatwas.estadisticas}
+
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._enviar(200, metricas.REGISTRO.exportar().encode("utf-8"),
+                         metricas.TIPO_CONTENIDO)
+            return
+
+        ruta = self.RUTAS.get(url.path)
+        if ruta is None:
+            self._responder(404, {"error": "Ruta no encontrada"})
+            return
+
+        inicio = time.perf_counter()
+        try:
+            datos = ruta(self.server.servicio, parse_qs(url.query))
+        except (ValueError, TypeError, OverflowError) as err:
+            estado, datos = 400, {"error": str(err)}
+        except RuntimeError as err:
+            log.error("Error al atender la petición", ruta=url.path,
+                      error=err)
+            estado, datos = 502, {"error": str(err)}
+        else:
+            estado = 200
+        PETICIONES.observar(time.perf_counter() - inicio, ruta=url.path,
+                            estado=estado)
+
+        self._responder(estado, datos)
+
+
+    def _responder(self, estado, datos):
+        """
+        Enviar una respuesta JSON.
+        """
+        self._enviar(estado, json.dumps(datos, default=_serializar,
+                                        ensure_ascii=False).encode("utf-8"),
+                     "application/json; charset=utf-8")
+
+
+    def _enviar(self, estado, cuerpo, tipo_contenido):
+        """
+        Enviar una respuesta con un cuerpo ya codificado.
+        """
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo_contenido)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+    def log_message(self, formato, *args):
+        # Sin registro de cada petición.
+        pass
+
+
+
+def crear_servidor(servicio, host="127.0.0.1", puerto=8080):
+    """
+    Crear el servidor HTTP del servicio de tatwas. Cada petición se
+    atiende en un hilo propio.
+
+    Argumentos:
+        servicio: objeto ServicioTatwas.
+        host, puerto: dirección en la que escuchar. Puerto 0 para uno
+            libre cualquiera.
+
+    Retorno:
+        Objeto ThreadingHTTPServer (usar serve_forever para atender
+        peticiones).
+    """
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorTatwas)
+    servidor.daemon_threads = True
+    servidor.servicio = servicio
+
+    return servidor
+
+
+
+def main():
+    """
+    Función principal
+    """
+    analizador = argparse.ArgumentParser(description="Servicio HTTP/JSON de"
+                                                     " cálculo de tatwas")
+    analizador.add_argument("--host", default="127.0.0.1")
+    analizador.add_argument("--puerto", type=int, default=8080)
+    analizador.add_argument("--fuente", default="api",
+                            choices=sorted(tw.EntornoTatwas
+                                           .FUENTES_EVENTOS_SOL),
+                            help="fuente de las horas de eventos del sol")
+    analizador.add_argument("--zonas", metavar="BINARIO",
+                            help="archivo de zonas horarias compilado con"
+                                 " resolutor_zonas.py (por defecto la API"
+                                 " TimeZoneDB)")
+    analizador.add_argument("--tablas-sol", metavar="BINARIO",
+                            help="archivo de horas de eventos del sol"
+                                 " precalculadas con tablas_sol.py (las"
+                                 " ubicaciones y fechas que no están en él"
+                                 " se piden a la fuente)")
+    analizador.add_argument("--interpolacion-sol", type=int, metavar="DIAS",
+                            help="pedir a la fuente las horas de eventos"
+                                 " del sol solo cada DIAS días e interpolar"
+                                 " las intermedias")
+    analizador.add_argument("--tolerancia-interpolacion", type=float,
+                            default=60, metavar="SEGUNDOS",
+                            help="error máximo estimado de las horas"
+                                 " interpoladas (por defecto 60)")
+    analizador.add_argument("--precarga", type=int, metavar="DIAS",
+                            help="precargar en segundo plano, antes de la"
+                                 " medianoche local de cada ubicación"
+                                 " usada, las horas de eventos del sol de"
+                                 " los próximos DIAS días")
+    analizador.add_argument("--sin-cache", action="store_true",
+                            help="no usar la caché persistente de eventos"
+                                 " del sol")
+    analizador.add_argument("--log-nivel", default="WARNING",
+                            help="nivel mínimo de los mensajes de log")
+    analizador.add_argument("--log-json", action="store_true",
+                            help="emitir el log como líneas JSON")
+    argumentos = analizador.parse_args()
+
+    try:
+        metricas.configurar_log(argumentos.log_nivel, argumentos.log_json)
+    except ValueError as err:
+        analizador.error(str(err))
+    if argumentos.interpolacion_sol is not None \
+       and (argumentos.interpolacion_sol < 2
+            or argumentos.tolerancia_interpolacion < 0):
+        analizador.error("--interpolacion-sol debe ser >= 2 y"
+                         " --tolerancia-interpolacion >= 0")
+    if argumentos.precarga is not None and argumentos.precarga < 1:
+        analizador.error("--precarga debe ser >= 1")
+
+    resolutor_zonas = api.timezonedb_get if argumentos.zonas is None \
+                      else rz.ResolutorZonas(argumentos.zonas)
+    fuente_eventos_sol = argumentos.fuente
+    ruta_cache = None if argumentos.sin_cache \
+                 else cache.RUTA_CACHE_POR_DEFECTO
+    if argumentos.interpolacion_sol is not None \
+       or argumentos.tablas_sol is not None:
+        # La caché persistente solo guarda las horas pedidas a la fuente.
+        fuente_eventos_sol = \
+            tw.EntornoTatwas.FUENTES_EVENTOS_SOL[fuente_eventos_sol]
+        if ruta_cache is not None:
+            fuente_eventos_sol = cache.CacheEventosSol(fuente_eventos_sol,
+                                                       ruta_cache)
+        ruta_cache = None
+    if argumentos.interpolacion_sol is not None:
+        fuente_eventos_sol = isol.InterpolacionSol(
+            fuente_eventos_sol, argumentos.interpolacion_sol,
+            argumentos.tolerancia_interpolacion)
+    if argumentos.tablas_sol is not None:
+        fuente_eventos_sol = ts.TablasSol(argumentos.tablas_sol,
+                                          fuente_eventos_sol)
+
+    servicio = ServicioTatwas(fuente_eventos_sol, ruta_cache,
+                              resolutor_zonas, argumentos.precarga)
+
+    # La hora actual se sincroniza en segundo plano para que las
+    # peticiones no esperen a los servidores NTP.
+    fh.RELOJ_NTP.iniciar()
+    if servicio.precarga is not None:
+        servicio.precarga.iniciar()
+
+    servidor = crear_servidor(servicio, argumentos.host, argumentos.puerto)
+    print("Escuchando en http://{}:{}".format(*servidor.server_address))
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#coding=utf-8
+
+"""
+Módulo de tablas precalculadas de las horas de los eventos del sol
+para ubicaciones fijas.
+
+Las horas de cada evento, ubicación y día de un intervalo de fechas se
+calculan una sola vez y se guardan en un archivo binario de enteros de
+64 bits de tamaño fijo, precedidos de una cabecera con el índice de
+ubicaciones. El archivo se lee mediante mmap sin analizarlo, de modo
+que obtener las horas de cualquier fecha es un acceso directo y varios
+procesos comparten las mismas páginas de memoria:
+
+    python3 tablas_sol.py sol.bin 2024-01-01 3660 40.4168,-3.7038
+"""
+
+import sys
+import mmap
+import struct
+import argparse
+import threading
+import datetime as dt
+from array import array
+import util as ut
+import fechahora as fh
+
+# Dependencias importadas solo cuando se usan por primera vez.
+api = ut.ModuloPerezoso("api")
+ef = ut.ModuloPerezoso("efemerides")
+
+
+# Cabecera del archivo binario: identificador, ordinal de la primera
+# fecha y número de días, ubicaciones, eventos y bytes de los nombres
+# de los eventos.
+_CABECERA = struct.Struct("<8sqIIII")
+_IDENTIFICADOR = b"TWSOL001"
+
+
+
+def compilar_tablas(ruta_binaria, ubicaciones, fecha_inicio, dias,
+                    fuente=None, eventos=None):
+    """
+    Calcular las horas de los eventos del sol de varias ubicaciones y
+    guardarlas en un archivo binario. Cada evento de cada día se guarda
+    como los segundos UNIX de su hora UTC (y "duracion_dia" como su
+    duración en segundos) en la posición
+    ((ubicación * días) + día) * número de eventos + evento.
+
+    Argumentos:
+        ruta_binaria: ruta del archivo binario a generar.
+        ubicaciones: secuencia de tuplas (latitud, longitud).
+        fecha_inicio: objeto datetime.date de la primera fecha.
+        dias: número de días desde fecha_inicio.
+        fuente: función con la interfaz de api.sunrise_sunset usada
+            para calcular las horas. None para efemerides.sunrise_sunset.
+        eventos: secuencia de eventos a guardar. None para todos los
+            devueltos por la fuente.
+
+    Excepciones:
+        ValueError si no hay ubicaciones o días, hay ubicaciones
+            repetidas o la fuente no devuelve algún evento.
+        TypeError si los argumentos no tienen el tipo correcto.
+        RuntimeError si la fuente no puede obtener las horas.
+        OSError si no se puede escribir el archivo.
+    """
+    if fuente is None:
+        fuente = ef.sunrise_sunset
+    if not isinstance(fecha_inicio, dt.date):
+        raise TypeError("La fecha de inicio no es de tipo datetime.date")
+
+    ubicaciones = [(float(latitud), float(longitud))
+                   for latitud, longitud in ubicaciones]
+    if not ubicaciones or dias <= 0:
+        raise ValueError("Se necesita al menos una ubicación y un día")
+    if len(set(ubicaciones)) != len(ubicaciones):
+        raise ValueError("Hay ubicaciones repetidas")
+
+    coordenadas = array("d")
+    tiempos = array("q")
+    for latitud, longitud in ubicaciones:
+        coordenadas.extend((latitud, longitud))
+        for dia in range(dias):
+            fecha = fecha_inicio + dt.timedelta(days=dia)
+            fechahoras_eventos_sol = fuente(latitud, longitud, fecha)
+            if eventos is None:
+                eventos = sorted(fechahoras_eventos_sol)
+
+            for evento in eventos:
+                try:
+                    valor = fechahoras_eventos_sol[evento]
+                except KeyError:
+                    raise ValueError("La fuente no devuelve el evento {}"
+                                     .format(evento))
+                if evento == "duracion_dia":
+                    tiempos.append(round(valor.total_seconds()))
+                else:
+                    tiempos.append(round(valor.timestamp()))
+
+    nombres = "\n".join(eventos).encode("utf-8")
+    nombres += b"\0" * (-len(nombres) % 8)
+
+    with open(ruta_binaria, "wb") as archivo:
+        archivo.write(_CABECERA.pack(_IDENTIFICADOR, fecha_inicio.toordinal(),
+                                     dias, len(ubicaciones), len(eventos),
+                                     len(nombres)))
+        archivo.write(nombres)
+        # Las secciones se guardan en el orden de bytes nativo ya que se
+        # leen directamente desde la memoria mapeada.
+        coordenadas.tofile(archivo)
+        tiempos.tofile(archivo)
+
+
+
+class TablasSol:
+    """
+    Fuente de horas de eventos del sol que las lee de un archivo
+    generado con compilar_tablas. Tiene la misma interfaz que
+    api.sunrise_sunset, de modo que puede usarse como fuente de eventos
+    del sol de EntornoTatwas.
+
+    El archivo se mapea en memoria (solo lectura) la primera vez que se
+    consulta, por lo que varios procesos comparten las mismas páginas
+    de memoria. Las ubicaciones o fechas que no están en las tablas se
+    piden a la fuente de respaldo.
+    """
+
+    def __init__(self, ruta, respaldo=None):
+        """
+        Constructor.
+
+        Argumentos:
+            ruta: ruta del archivo binario generado con compilar_tablas.
+            respaldo: función con la interfaz de api.sunrise_sunset
+                usada para las ubicaciones y fechas fuera de las tablas.
+                None para producir un error en ese caso.
+        """
+        self._ruta = ruta
+        self._respaldo = respaldo
+        self._cerrojo = threading.Lock()
+        self._datos = None
+
+
+    def __reduce__(self):
+        # En otros procesos el archivo se vuelve a mapear al usarse.
+        return type(self), (self._ruta, self._respaldo)
+
+
+    def _cargar(self):
+        """
+        Mapear en memoria el archivo binario y crear las vistas de
+        cada una de sus secciones.
+
+        Excepciones:
+            ValueError si el archivo no tiene el formato esperado.
+            OSError si no se puede abrir el archivo.
+        """
+        with open(self._ruta, "rb") as archivo:
+            memoria = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (identificador, ordinal_inicio, dias, n_ubicaciones, n_eventos,
+         long_nombres) = _CABECERA.unpack_from(memoria, 0)
+        if identificador != _IDENTIFICADOR:
+            raise ValueError("Archivo de tablas del sol inválido")
+
+        vista = memoryview(memoria)
+        posicion = _CABECERA.size
+        eventos = bytes(vista[posicion:posicion + long_nombres]) \
+                  .rstrip(b"\0").decode("utf-8").split("\n")[:n_eventos]
+        posicion += long_nombres
+
+        bytes_coordenadas = n_ubicaciones * 2 * struct.calcsize("d")
+        coordenadas = vista[posicion:posicion + bytes_coordenadas].cast("d")
+        posicion += bytes_coordenadas
+
+        bytes_tiempos = n_ubicaciones * dias * n_eventos \
+                        * struct.calcsize("q")
+        if posicion + bytes_tiempos > len(memoria):
+            raise ValueError("Archivo de tablas del sol incompleto")
+        tiempos = vista[posicion:posicion + bytes_tiempos].cast("q")
+
+        self._datos = {"memoria": memoria, "ordinal_inicio": ordinal_inicio,
+                       "dias": dias, "eventos": tuple(eventos),
+                       "ubicaciones": {(coordenadas[i * 2],
+                                        coordenadas[i * 2 + 1]): i
+                                       for i in range(n_ubicaciones)},
+                       "tiempos": tiempos}
+
+
+    def _obtener_datos(self):
+        """
+        Obtener los datos del archivo, mapeándolo si aún no lo está.
+        """
+        if self._datos is None:
+            with self._cerrojo:
+                if self._datos is None:
+                    self._cargar()
+
+        return self._datos
+
+
+    @property
+    def ubicaciones(self):
+        """
+        Getter de las ubicaciones de las tablas.
+
+        Retorno:
+            Lista de tuplas (latitud, longitud).
+        """
+        return list(self._obtener_datos()["ubicaciones"])
+
+
+    @property
+    def fechas(self):
+        """
+        Getter del intervalo de fechas de las tablas.
+
+        Retorno:
+            Tupla (primera fecha, última fecha) de tipo datetime.date.
+        """
+        datos = self._obtener_datos()
+        return (dt.date.fromordinal(datos["ordinal_inicio"]),
+                dt.date.fromordinal(datos["ordinal_inicio"]
+                                    + datos["dias"] - 1))
+
+
+    def __call__(self, latitud, longitud, fecha=None, local=False,
+                 zona_horaria=None):
+        """
+        Obtener las horas de los eventos del sol de una ubicación y
+        fecha con el formato de api.sunrise_sunset.
+
+        Argumentos:
+            latitud: latitud de la ubicación.
+            longitud: longitud de la ubicación.
+            fecha: objeto datetime.date. Por defecto se toma la fecha
+                solar media actual de la longitud solicitada.
+            local: flag para indicar si las horas a obtener son locales
+                o UTC.
+            zona_horaria: implementación de datetime.tzinfo usada si
+                local es True. Si es None se obtiene mediante la API
+                TimeZoneDB.
+
+        Retorno:
+            Diccionario con la fecha y hora UTC de cada evento del sol
+            guardado en las tablas en formato datetime.datetime,
+            excepto "duracion_dia" que tiene formato datetime.timedelta.
+
+        Excepciones:
+            TypeError si los tipos de argumentos no son correctos.
+            RuntimeError si la ubicación o fecha no están en las tablas
+                y no hay fuente de respaldo, o la fuente de respaldo o
+                la API de zonas horarias producen algún error.
+            OSError o ValueError si no se puede cargar el archivo.
+        """
+        if fecha is None:
+            fecha = (dt.datetime.utcnow()
+                     + dt.timedelta(hours=float(longitud) / 15)).date()
+        elif not isinstance(fecha, dt.date):
+            raise TypeError("La fecha no es de tipo datetime.date o None.")
+
+        try:
+            clave = (float(latitud), float(longitud))
+        except (TypeError, ValueError):
+            raise TypeError("Las coordenadas no están en formato numérico.")
+
+        datos = self._obtener_datos()
+        ubicacion = datos["ubicaciones"].get(clave)
+        dia = fecha.toordinal() - datos["ordinal_inicio"]
+        if ubicacion is None or not 0 <= dia < datos["dias"]:
+            if self._respaldo is None:
+                raise RuntimeError("No hay horas de eventos del sol en las"
+                                   " tablas para {} el {}"
+                                   .format(clave, fecha))
+            return self._respaldo(latitud, longitud, fecha, local)
+
+        if local and zona_horaria is None:
+            zona_horaria = fh.zona_horaria(
+                api.timezonedb_get(clave)["zona_horaria"])
+
+        eventos = datos["eventos"]
+        posicion = (ubicacion * datos["dias"] + dia) * len(eventos)
+        tiempos = datos["tiempos"][posicion:posicion + len(eventos)]
+
+        fechahoras_eventos_sol = dict()
+        for evento, tiempo in zip(eventos, tiempos):
+            if evento == "duracion_dia":
+                fechahoras_eventos_sol[evento] = dt.timedelta(seconds=tiempo)
+            elif local:
+                fechahoras_eventos_sol[evento] = \
+                    dt.datetime.fromtimestamp(tiempo, zona_horaria)
+            else:
+                fechahoras_eventos_sol[evento] = \
+                    dt.datetime.fromtimestamp(tiempo, fh.UTC)
+
+        return fechahoras_eventos_sol
+
+
+
+def main():
+    """
+    Función principal
+    """
+    analizador = argparse.ArgumentParser(description="Compilar las tablas de"
+                                                     " horas de eventos del"
+                                                     " sol")
+    analizador.add_argument("binario")
+    analizador.add_argument("fecha_inicio", type=dt.date.fromisoformat)
+    analizador.add_argument("dias", type=int)
+    analizador.add_argument("ubicacion", nargs="+",
+                            type=ut.evaluar_coordenadas, metavar="LAT,LNG")
+    analizador.add_argument("--fuente", default="efemerides",
+                            choices=("api", "efemerides"),
+                            help="fuente de las horas de eventos del sol")
+    analizador.add_argument("--evento", action="append",
+                            help="evento a guardar (repetible, por defecto"
+                                 " todos)")
+    argumentos = analizador.parse_args()
+
+    fuente = api.sunrise_sunset if argumentos.fuente == "api" \
+             else ef.sunrise_sunset
+    try:
+        compilar_tablas(argumentos.binario, argumentos.ubicacion,
+                        argumentos.fecha_inicio, argumentos.dias, fuente,
+                        argumentos.evento)
+    except (ValueError, RuntimeError, OSError) as err:
+        sys.exit(str(err))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,62 @@
 Módulo de gestión de tatwas
 """
 
+import time
+import itertools
+import threading
+import collections
+import collections.abc
 import datetime as dt
 import util as ut
-import pytz as tz
+import metricas
 import fechahora as fh
-import api
+
+# Dependencias importadas solo cuando se usan por primera vez, de modo
+# que los cálculos con Tatwa no importan los clientes de red ni las
+# bases de datos de zonas horarias.
+api = ut.ModuloPerezoso("api")
+ef = ut.ModuloPerezoso("efemerides")
+cache = ut.ModuloPerezoso("cache")
+asyncio = ut.ModuloPerezoso("asyncio")
+api_async = ut.ModuloPerezoso("api_async")
+
+log = metricas.Log("tatwa")
+
+# Series de métricas de las etapas de EntornoTatwas y de la caché de
+# eventos del sol por fecha de cada entorno.
+_ETAPA_RESOLVER_ZONA = metricas.ETAPAS.etiquetar(etapa="resolver_zona")
+_ETAPA_EVENTOS_SOL = metricas.ETAPAS.etiquetar(etapa="obtener_eventos_sol")
+_ETAPA_CALCULAR_TATWAS = metricas.ETAPAS.etiquetar(etapa="calcular_tatwas")
+_CONSULTAS_EVENTOS = {resultado: metricas.CONSULTAS_CACHE.etiquetar(
+                          cache="eventos_entorno", resultado=resultado)
+                      for resultado in ("acierto", "fallo")}
 
 
 class Tatwa:
     """
     Clase para definir un tatwa en concreto.
+
+    Los objetos Tatwa son inmutables y se comparten: construir dos
+    veces el mismo tatwa (misma posición, o mismo nombre y ciclo)
+    devuelve el mismo objeto.
     """
     
+    __slots__ = ("_nombre", "_ciclo", "_posicion", "_indice_tatwa",
+                 "_atributo")
+
     # Constantes de clase
     SEGUNDOS_TATWA = 24 * 60 #+ 20 26.182 28.8 22.154 20.5714
     NOMBRES_TATWAS = ("akash", "vayu", "tejas", "prithvi", "apas") 
+    _INDICES_NOMBRES = {nombre: indice for indice, nombre
+                        in enumerate(NOMBRES_TATWAS)}
+
+    # Instancias compartidas por posición y por (nombre, ciclo).
+    _MAX_INSTANCIAS = 4096
+    _instancias_posicion = dict()
+    _instancias_nombre = dict()
     
 
-    def __init__(self, tatwa, ciclo=None):
+    def __new__(cls, tatwa, ciclo=None):
         """
         Constructor.
 
@@ -39,93 +77,101 @@ class Tatwa:
             TypeError si los tipos de los argumentos no son permitidos.
             ValueError si el valor de los argumentos no son permitidos.
         """
-        try:
-            self.posicion = tatwa
-        except TypeError:
-            pass
-        else:
-            return
+        if isinstance(tatwa, int):
+            instancia = cls._instancias_posicion.get(tatwa)
+            if instancia is not None:
+                return instancia
 
-        try:
-            self.nombre = tatwa
-        except TypeError:
+            if tatwa < 1:
+                raise ValueError("La nueva posición debe ser > 0.")
+
+            tatwa = int(tatwa)
+            indice_ciclo, indice = divmod(tatwa - 1, len(cls.NOMBRES_TATWAS))
+            instancia = cls._crear(cls.NOMBRES_TATWAS[indice],
+                                   indice_ciclo + 1, tatwa, indice,
+                                   "posicion")
+            if len(cls._instancias_posicion) < cls._MAX_INSTANCIAS:
+                cls._instancias_posicion[tatwa] = instancia
+            return instancia
+
+        if not isinstance(tatwa, str):
             raise TypeError("El primer argumento debe ser str o int")
-    
-        self.ciclo = ciclo
-        
+        if ciclo is not None and not isinstance(ciclo, int):
+            raise TypeError("El ciclo debe ser un entero o None.")
 
-    @property
-    def nombre(self):
+        instancia = cls._instancias_nombre.get((tatwa, ciclo))
+        if instancia is not None:
+            return instancia
+
+        nombre = tatwa.strip().lower()
+        instancia = cls._instancias_nombre.get((nombre, ciclo))
+        if instancia is not None:
+            return instancia
+
+        indice = cls._INDICES_NOMBRES.get(nombre)
+        if indice is None:
+            raise ValueError("Valor incorrecto del nombre del tatwa")
+        if ciclo is not None and ciclo < 1:
+            raise ValueError("El valor entero de ciclo debe ser >= 1")
+
+        indice_ciclo = 0 if ciclo is None else ciclo - 1
+        instancia = cls._crear(nombre, ciclo,
+                               indice + 1 + indice_ciclo
+                               * len(cls.NOMBRES_TATWAS), indice, "nombre")
+        if len(cls._instancias_nombre) < cls._MAX_INSTANCIAS:
+            cls._instancias_nombre[(nombre, ciclo)] = instancia
+        return instancia
+
+
+    @classmethod
+    def _crear(cls, nombre, ciclo, posicion, indice, atributo):
         """
-        Getter del atributo nombre
+        Crear una nueva instancia con todos sus atributos calculados.
         """
-        if self._posicion is None:
-            return self._nombre
+        instancia = object.__new__(cls)
+        asignar = object.__setattr__
+        asignar(instancia, "_nombre", nombre)
+        asignar(instancia, "_ciclo", ciclo)
+        asignar(instancia, "_posicion", posicion)
+        asignar(instancia, "_indice_tatwa", indice)
+        asignar(instancia, "_atributo", atributo)
 
-        numero_tatwas = len(self.NOMBRES_TATWAS)
-        return self.NOMBRES_TATWAS[(self._posicion - 1) % numero_tatwas] 
-     
+        return instancia
 
-    @nombre.setter
-    def nombre(self, nombre):
-        """
-        Setter del atributo nombre_tatwa
 
-        Argumentos:
-            nombre: nombre del tatwa a asignar.
+    def __setattr__(self, nombre, valor):
+        raise AttributeError("Los objetos Tatwa son inmutables")
 
-        Excepciones:
-            TypeError si el argumento no es de tipo str.
-            ValueError si el nombre del tatwa no es uno de los nombres
-                válidos.
-        """
-        if not isinstance(nombre, str):
-            raise TypeError("El nombre del tatwa debe ser un str.")
+    __delattr__ = __setattr__
 
-        nombre = nombre.strip().lower()
-        if nombre not in self.NOMBRES_TATWAS:
-            raise ValueError("Valor incorrecto del nombre del tatwa")
 
-        self._nombre = nombre
-        self._posicion = None
+    def __reduce__(self):
+        if self._atributo == "posicion":
+            return Tatwa, (self._posicion,)
+        return Tatwa, (self._nombre, self._ciclo)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
 
     @property
-    def ciclo(self):
+    def nombre(self):
         """
-        Getter del atributo ciclo.
+        Getter del atributo nombre
         """
-        if self._posicion is None:
-            return self._ciclo
-        
-        return (self._posicion - 1) // len(self.NOMBRES_TATWAS) + 1
-
+        return self._nombre
+     
 
-    @ciclo.setter
-    def ciclo(self, ciclo):
+    @property
+    def ciclo(self):
         """
-        Setter del atributo ciclo.
-
-        Argumentos:
-            ciclo: número entero int del ciclo a asignar al tatwa.
-                None si no se desea considerar ningún número de ciclo
-                para este tatwa. 
-
-        Excepciones:
-            TypeError si el ciclo no es un entero int o None.
-            ValueError si el ciclo int es < 1.
-        """
-        if self._posicion is not None:
-            raise RuntimeError("Ya has marcado este tatwa con una posición."
-                               " Si deseas asignar un ciclo marca antes este" 
-                               " tatwa con un nombre.")
-        if isinstance(ciclo, int):
-            if ciclo < 1:
-                raise ValueError("El valor entero de ciclo debe ser >= 1")
-        elif ciclo is not None:
-            raise TypeError("El ciclo debe ser un entero o None.")
-
-        self._ciclo = ciclo
+        Getter del atributo ciclo. None si el tatwa está determinado
+        por el nombre sin ciclo.
+        """
+        return self._ciclo
 
 
     @property
@@ -139,43 +185,15 @@ class Tatwa:
             Si no, devuelve la posición en función del ciclo asignado
             al tatwa. Si no tiene ciclo, se toma el primero.
         """
-        if self._posicion is not None:
-            return self._posicion
-
-        indice_ciclo = 0 if self.ciclo is None else self.ciclo - 1
-        return (self._indice() + 1) + indice_ciclo * len(self.NOMBRES_TATWAS)
-    
+        return self._posicion
     
-    @posicion.setter    
-    def posicion(self, posicion):
-        """
-        Cambiar el tatwa por el correspondiente a la nueva posición
-        en el ciclo de tatwas (empezando por 1). También modifica
-        el número de ciclo en función de la posición indicada.
-
-        Argumentos:
-            posicion: posición (>= 1) del tatwa en el ciclo de tatwas.
-
-        Excepciones:
-            TypeError si el argumento no es un entero int.
-            ValueError si la posición no es > 0. 
-        """
-        if not isinstance(posicion, int):
-            raise TypeError("La nueva posición debe ser un entero int.")
-
-        if posicion < 1:
-            raise ValueError("La nueva posición debe ser > 0.")
-
-        self._posicion = posicion
-        self._nombre = self._ciclo = None
-
 
     @property
     def atributo(self):
         """
         Getter que informa de qué determina el tatwa: nombre o posición.
         """
-        return "nombre" if self._posicion is None else "posicion"
+        return self._atributo
 
 
     @classmethod
@@ -193,11 +211,12 @@ class Tatwa:
         Excepciones:
             ValueError si el nombre no es de ningún tatwa.
         """
-        try:
-            return cls.NOMBRES_TATWAS.index(nombre)
-        except ValueError:
+        indice = cls._INDICES_NOMBRES.get(nombre)
+        if indice is None:
             raise ValueError("El nombre no corresponde a ningún tatwa")
 
+        return indice
+
 
     def _indice(self):
         """
@@ -207,17 +226,18 @@ class Tatwa:
         Retorno:
             Entero índice del tatwa (>= 0) en el ciclo de tatwas.
         """
-        if self._posicion is not None:
-            return (self._posicion - 1) % len(self.NOMBRES_TATWAS)
-
-        return self._indice_de_nombre_tatwa(self.nombre)
+        return self._indice_tatwa
 
 
     def __str__(self):
-        return self.nombre.capitalize()
+        return self._nombre.capitalize()
         
     def __repr__(self):
-        return "{} ({}/{})".format(self, self.posicion, self.ciclo) 
+        return "{} ({}/{})".format(self, self._posicion, self._ciclo) 
+
+    def __hash__(self):
+        # Igual que el de su posición, ya que se comparan como iguales.
+        return hash(self._posicion)
 
 
     def distancia(self, tatwa):
@@ -241,15 +261,15 @@ class Tatwa:
             ValueError si el argumento es str pero no es un nombre de
                 tatwa válido.
         """
+        if isinstance(tatwa, Tatwa):
+            return tatwa._posicion - self._posicion
         if isinstance(tatwa, int):
             if tatwa < 1:
                 raise ValueError("La posición debe ser > 0")
-            return tatwa - self.posicion
-        if isinstance(tatwa, Tatwa):
-            return tatwa.posicion - self.posicion
+            return tatwa - self._posicion
         if isinstance(tatwa, str):
             indice = self._indice_de_nombre_tatwa(tatwa.strip().lower())
-            return (indice + 1) - self.posicion
+            return (indice + 1) - self._posicion
         
         raise TypeError("Tipo de dato del argumento incorrecto.")
 
@@ -279,13 +299,11 @@ class Tatwa:
         if not isinstance(entero, int):
             return NotImplemented
         
-        if self.ciclo is None:
-            indice = (self._indice() + entero) % len(self.NOMBRES_TATWAS)
-            tatwa_resultado = Tatwa(self.NOMBRES_TATWAS[indice])
-        else:
-            tatwa_resultado = Tatwa(self.posicion + entero)
+        if self._ciclo is None:
+            indice = (self._indice_tatwa + entero) % len(self.NOMBRES_TATWAS)
+            return Tatwa(self.NOMBRES_TATWAS[indice])
 
-        return tatwa_resultado
+        return Tatwa(self._posicion + entero)
 
 
     __radd__ = __add__
@@ -303,29 +321,52 @@ class Tatwa:
             Tatwa con la posición relativa correspondiente al entero
             a partir del tatwa self.
         """
+        if not isinstance(entero, int):
+            return NotImplemented
+
         return self + -entero
 
 
     # Operadores de comparación
 
+    def _distancia_operador(self, tatwa):
+        """
+        Calcular la distancia a otro tatwa para los operadores de
+        comparación.
+
+        Retorno:
+            Distancia entre tatwas o None si el tipo del argumento no
+            es comparable.
+        """
+        if isinstance(tatwa, Tatwa):
+            return tatwa._posicion - self._posicion
+        if isinstance(tatwa, (int, str)):
+            return self.distancia(tatwa)
+
+        return None
+
+
     def __eq__(self, tatwa):
         """
-        Operador == para comparar tatwas.
+        Operador == para comparar tatwas. Un tatwa no es igual a su
+        nombre (str), ya que su hash es el de su posición; para
+        comparar con un nombre se usa tatwa == Tatwa(nombre).
 
         Argumentos:
-            tatwa: puede ser un objeto Tatwa, una posición de un tatwa
-                o el nombre de un tatwa. Si es un objeto sin ciclo o
-                un nombre, se les consideran del primer ciclo.
+            tatwa: puede ser un objeto Tatwa o una posición de un
+                tatwa. Si es un objeto sin ciclo se considera del
+                primer ciclo.
 
         Retorno:
             True/False dependiendo si ambos se refieren al mismo tatwa 
             en el mismo ciclo.
         """
-        try:
-            return self.distancia(tatwa) == 0
-        except TypeError:
+        if isinstance(tatwa, str):
             return NotImplemented
 
+        distancia = self._distancia_operador(tatwa)
+        return NotImplemented if distancia is None else distancia == 0
+
 
     def __gt__(self, tatwa):
         """
@@ -340,10 +381,8 @@ class Tatwa:
             True/False dependiendo si el primer tatwa tiene una 
             posición mayor al segundo.
         """
-        try:
-            return self.distancia(tatwa) < 0
-        except TypeError:
-            return NotImplemented
+        distancia = self._distancia_operador(tatwa)
+        return NotImplemented if distancia is None else distancia < 0
 
 
     def __ge__(self, tatwa):
@@ -359,10 +398,8 @@ class Tatwa:
             True/False dependiendo si el primer tatwa tiene una 
             posición mayor o igual al segundo.
         """
-        try:
-            return self.distancia(tatwa) <= 0
-        except TypeError:
-            return NotImplemented
+        distancia = self._distancia_operador(tatwa)
+        return NotImplemented if distancia is None else distancia <= 0
 
 
     def __lt__(self, tatwa):
@@ -378,10 +415,8 @@ class Tatwa:
             True/False dependiendo si el primer tatwa tiene una 
             posición menor al segundo.
         """
-        try:
-            return self.distancia(tatwa) > 0
-        except TypeError:
-            return NotImplemented
+        distancia = self._distancia_operador(tatwa)
+        return NotImplemented if distancia is None else distancia > 0
 
 
     def __le__(self, tatwa):
@@ -397,10 +432,158 @@ class Tatwa:
             True/False dependiendo si el primer tatwa tiene una 
             posición menor o igual al segundo.
         """
-        try:
-            return self.distancia(tatwa) >= 0
-        except TypeError:
-            return NotImplemented
+        distancia = self._distancia_operador(tatwa)
+        return NotImplemented if distancia is None else distancia >= 0
+
+
+
+class IndiceTatwas:
+    """
+    Índice de los límites de los tatwas de un conjunto de eventos del
+    sol, guardados como microsegundos UNIX enteros. Los límites de los
+    tatwas de cada evento están equiespaciados, de modo que buscar el
+    tatwa de un instante es una única división entera por evento, sin
+    crear objetos datetime ni timedelta ni errores de redondeo.
+    """
+
+    # Número de tatwas de cada evento: un día más un tatwa.
+    NUMERO_TATWAS = 24 * 3600 // Tatwa.SEGUNDOS_TATWA + 1
+
+    # Duración de cada tatwa en microsegundos.
+    MICROSEGUNDOS_TATWA = Tatwa.SEGUNDOS_TATWA * 10 ** 6
+
+
+    def __init__(self, microsegundos_eventos):
+        """
+        Constructor.
+
+        Argumentos:
+            microsegundos_eventos: diccionario {evento: microsegundos}
+                con los microsegundos UNIX (int) de cada evento del sol.
+        """
+        self._eventos = dict(microsegundos_eventos)
+
+
+    @classmethod
+    def obtener(cls, fechahoras_eventos_sol):
+        """
+        Crear el índice de unas horas de eventos del sol.
+
+        Argumentos:
+            fechahoras_eventos_sol: diccionario {evento: fechahora}.
+
+        Retorno:
+            Objeto IndiceTatwas.
+        """
+        return cls({evento: fh.microsegundos_utc(fechahora) for evento,
+                    fechahora in fechahoras_eventos_sol.items()})
+
+
+    def buscar(self, microsegundos):
+        """
+        Buscar el tatwa de cada evento en el que se encuentra un
+        instante.
+
+        Argumentos:
+            microsegundos: microsegundos UNIX (int) del instante.
+
+        Retorno:
+            Diccionario {evento: intervalo} con la tupla (posición,
+            inicio, fin) del tatwa de cada evento, o None si el
+            instante está fuera del rango de tatwas del evento. La
+            posición es la del tatwa desde el evento (el tatwa en la
+            posición i comienza i - 1 tatwas después del evento) e
+            inicio y fin son los microsegundos UNIX de sus límites.
+        """
+        duracion = self.MICROSEGUNDOS_TATWA
+        intervalos = dict()
+        for evento, microsegundos_evento in self._eventos.items():
+            desplazamiento = microsegundos - microsegundos_evento
+            posicion = desplazamiento // duracion + 1
+            if 0 < posicion <= self.NUMERO_TATWAS:
+                inicio = microsegundos - desplazamiento % duracion
+                intervalos[evento] = (posicion, inicio, inicio + duracion)
+            else:
+                intervalos[evento] = None
+
+        return intervalos
+
+
+
+class ResultadoTatwa(collections.abc.Mapping):
+    """
+    Tatwa de un evento del sol calculado por
+    EntornoTatwas.calcular_tatwas. Es un mapeo de solo lectura con las
+    claves "tatwa", "fechahora_fin", "fechahora_inicio" y
+    "segundos_restantes", igual que un diccionario.
+
+    Internamente solo guarda la posición del tatwa y los microsegundos
+    UNIX de sus límites y del instante calculado: el objeto Tatwa, las
+    fechas y horas con zona horaria y el tiempo restante se crean la
+    primera vez que se piden.
+    """
+
+    CLAVES = ("tatwa", "fechahora_fin", "fechahora_inicio",
+              "segundos_restantes")
+
+    __slots__ = ("posicion", "inicio", "fin", "instante", "_zona",
+                 "_valores")
+
+    def __init__(self, posicion, inicio, fin, instante, zona):
+        """
+        Constructor.
+
+        Argumentos:
+            posicion: posición del tatwa desde el evento del sol.
+            inicio: microsegundos UNIX del inicio del tatwa.
+            fin: microsegundos UNIX del fin del tatwa.
+            instante: microsegundos UNIX del instante calculado.
+            zona: implementación de datetime.tzinfo de las fechas y
+                horas.
+        """
+        self.posicion = posicion
+        self.inicio = inicio
+        self.fin = fin
+        self.instante = instante
+        self._zona = zona
+        self._valores = dict()
+
+
+    def __reduce__(self):
+        return type(self), (self.posicion, self.inicio, self.fin,
+                            self.instante, self._zona)
+
+
+    def __getitem__(self, clave):
+        valor = self._valores.get(clave)
+        if valor is not None:
+            return valor
+
+        if clave == "tatwa":
+            valor = Tatwa(self.posicion)
+        elif clave == "fechahora_fin":
+            valor = fh.fechahora_microsegundos(self.fin, self._zona)
+        elif clave == "fechahora_inicio":
+            valor = fh.fechahora_microsegundos(self.inicio, self._zona)
+        elif clave == "segundos_restantes":
+            valor = dt.timedelta(microseconds=self.fin - self.instante)
+        else:
+            raise KeyError(clave)
+
+        self._valores[clave] = valor
+        return valor
+
+
+    def __iter__(self):
+        return iter(self.CLAVES)
+
+
+    def __len__(self):
+        return len(self.CLAVES)
+
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, dict(self))
 
 
 
@@ -413,10 +596,81 @@ class EntornoTatwas:
     _EVENTOS_SOL_PARA_TATWAS = ("salida", "amanecer_astronomico")
                                 #"amanecer_civil", "amanecer_nautico")
 
-    def __init__(self):
+    # Máximo de días solares seguidos sin evento del sol (latitudes
+    # polares) recorridos al buscar intervalos de un tatwa.
+    _MAX_DIAS_SIN_EVENTO = 366
+
+    # Número máximo de fechas cuyas horas de eventos del sol se guardan
+    # en cada entorno.
+    _MAX_FECHAS_EVENTOS_SOL = 32
+
+    # Fuentes disponibles para obtener las horas de los eventos del sol.
+    FUENTES_EVENTOS_SOL = \
+        {"api": ut.FuncionPerezosa("api", "sunrise_sunset"),
+         "efemerides": ut.FuncionPerezosa("efemerides", "sunrise_sunset")}
+
+    # Caché en memoria de api.google_geocode compartida por los entornos
+    # sin geocodificador propio. Se crea la primera vez que se usa.
+    _geocodificador_compartido = None
+    _cerrojo_geocodificador = threading.Lock()
+
+    def __init__(self, fuente_eventos_sol="api", cache_eventos_sol=None,
+                 resolutor_zonas=None, geocodificador=None):
         """
         Constructor
+
+        Argumentos:
+            fuente_eventos_sol: nombre de una de las fuentes de
+                FUENTES_EVENTOS_SOL o función con la misma interfaz
+                que api.sunrise_sunset(latitud, longitud, fecha) usada
+                para obtener las horas UTC de los eventos del sol.
+            cache_eventos_sol: ruta del archivo de caché persistente
+                (cache.CacheEventosSol) que envuelve a la fuente de
+                eventos del sol. None para no usar caché.
+            resolutor_zonas: función con la misma interfaz que
+                api.timezonedb_get(localizacion) usada para obtener la
+                zona horaria y dirección de unas coordenadas, por
+                ejemplo resolutor_zonas.ResolutorZonas. None para
+                api.timezonedb_get.
+            geocodificador: función con la misma interfaz que
+                api.google_geocode(direccion) usada para obtener las
+                coordenadas de una dirección, por ejemplo
+                cache.CacheGeocodificacion. None para una caché en
+                memoria de api.google_geocode compartida por todos los
+                entornos.
+
+        Excepciones:
+            ValueError si el nombre de la fuente no existe.
+            TypeError si la fuente no es un nombre ni una función, o el
+                resolutor de zonas o el geocodificador no son funciones.
         """
+        if isinstance(fuente_eventos_sol, str):
+            try:
+                fuente_eventos_sol = \
+                    self.FUENTES_EVENTOS_SOL[fuente_eventos_sol]
+            except KeyError:
+                raise ValueError("Fuente de eventos del sol desconocida: {}"
+                                 .format(fuente_eventos_sol))
+        elif not callable(fuente_eventos_sol):
+            raise TypeError("La fuente de eventos del sol debe ser un str o"
+                            " una función")
+        if resolutor_zonas is None:
+            resolutor_zonas = ut.FuncionPerezosa("api", "timezonedb_get")
+        if not callable(resolutor_zonas):
+            raise TypeError("El resolutor de zonas debe ser una función")
+        if geocodificador is not None and not callable(geocodificador):
+            raise TypeError("El geocodificador debe ser una función")
+
+        if cache_eventos_sol is not None:
+            fuente_eventos_sol = cache.CacheEventosSol(fuente_eventos_sol,
+                                                       cache_eventos_sol)
+
+        self._fuente_eventos_sol = fuente_eventos_sol
+        self._resolutor_zonas = resolutor_zonas
+        self._geocodificador = geocodificador
+        self._datos_zona = None
+        self._eventos_por_fecha = collections.OrderedDict()
+        self._cerrojo_eventos = threading.Lock()
         self._coordenadas = None
         self._fecha_sol = None
         self._direccion = None
@@ -424,7 +678,9 @@ class EntornoTatwas:
         self._fecha_tw = None
         self._hora_tw = None
         self._fechahora_tw = None
+        self._instante_tw = None
         self._fechahoras_eventos_sol = None
+        self._indice_tatwas = None
         self._tatwas = None
 
 
@@ -436,7 +692,7 @@ class EntornoTatwas:
                                      "Hora tatwa", self._hora_tw,
                                      "Fecha tatwa", self._fecha_tw,
                                      "Fechahora tatwa usada", 
-                                     self._fechahora_tw,
+                                     self.fechahora_tw,
                                      "Fechahoras eventos sol", 
                                      self._fechahoras_eventos_sol, 
                                      "Tatwas", self._tatwas)
@@ -462,7 +718,7 @@ class EntornoTatwas:
             Devuelve la zona horaria fijada por las coordenadas.
                 None si no ha sido fijada.
         """
-        return self._zona_horaria.zone
+        return self._zona_horaria.key
 
 
     def fijar_direccion(self, direccion, localizable=False):
@@ -475,7 +731,8 @@ class EntornoTatwas:
             direccion: cadena con la descripción de la dirección 
                 donde realizar los caĺculos.
             localizable: flag para indicar si debe actualizar las
-                coordenadas a partir de la dirección y región.
+                coordenadas a partir de la dirección y región mediante
+                el geocodificador del entorno.
 
         Excepciones:
             RuntimeError en caso de haber error al intentar obtener
@@ -485,10 +742,14 @@ class EntornoTatwas:
         if not direccion:
             raise ValueError("Valor de dirección vacío")
         if localizable:
+            geocodificador = self._geocodificador
+            if geocodificador is None:
+                geocodificador = self._obtener_geocodificador_compartido()
             try:
-                coordenadas = api.google_geocode(direccion)
+                coordenadas = geocodificador(direccion)
             except RuntimeError as err:
-                print(err)
+                log.warning("Error de geocodificación", direccion=direccion,
+                            error=err)
                 raise RuntimeError("Error al intentar obtener las coordenadas")
 
             self.fijar_coordenadas(coordenadas[0], coordenadas[1], False)
@@ -496,6 +757,21 @@ class EntornoTatwas:
         self._direccion = direccion        
 
 
+    @classmethod
+    def _obtener_geocodificador_compartido(cls):
+        """
+        Obtener la caché de geocodificación compartida por los entornos
+        sin geocodificador propio, creándola si no existe.
+        """
+        if cls._geocodificador_compartido is None:
+            with cls._cerrojo_geocodificador:
+                if cls._geocodificador_compartido is None:
+                    EntornoTatwas._geocodificador_compartido = \
+                        cache.CacheGeocodificacion(api.google_geocode)
+
+        return cls._geocodificador_compartido
+
+
     @property
     def coordenadas(self):
         """
@@ -534,21 +810,72 @@ class EntornoTatwas:
                 de localización. 
         """
         latitud, longitud = ut.convertir_coordenadas(latitud, longitud)
+        if self.coordenadas == (latitud, longitud):
+            self._aplicar_coordenadas(latitud, longitud, self._datos_zona,
+                                      localizable)
+            return
+
+        try:
+            with _ETAPA_RESOLVER_ZONA.medir():
+                datos = self._resolutor_zonas((latitud, longitud))
+        except RuntimeError as err:
+            log.warning("Error al resolver la zona horaria",
+                        latitud=latitud, longitud=longitud, error=err)
+            raise RuntimeError("Error al obtener dirección y zona horaria.")
+
+        self._aplicar_coordenadas(latitud, longitud, datos, localizable)
+
+
+    async def fijar_coordenadas_async(self, latitud, longitud,
+                                      localizable=True):
+        """
+        Versión asíncrona de fijar_coordenadas. La obtención de la zona
+        horaria no bloquea el bucle de eventos.
+        """
+        latitud, longitud = ut.convertir_coordenadas(latitud, longitud)
+        if self.coordenadas == (latitud, longitud):
+            self._aplicar_coordenadas(latitud, longitud, self._datos_zona,
+                                      localizable)
+            return
 
         try:
-            datos = api.timezonedb_get((latitud, longitud))
+            with _ETAPA_RESOLVER_ZONA.medir():
+                datos = await api_async.ejecutar(self._resolutor_zonas,
+                                                 (latitud, longitud))
         except RuntimeError as err:
-            print(err)
+            log.warning("Error al resolver la zona horaria",
+                        latitud=latitud, longitud=longitud, error=err)
             raise RuntimeError("Error al obtener dirección y zona horaria.")
 
+        self._aplicar_coordenadas(latitud, longitud, datos, localizable)
+
+
+    def _aplicar_coordenadas(self, latitud, longitud, datos, localizable):
+        """
+        Guardar internamente las coordenadas y los datos de zona
+        horaria obtenidos para ellas. Las horas de los eventos del sol
+        y los tatwas calculados solo se descartan si las coordenadas
+        cambian.
+
+        Argumentos:
+            latitud: latitud ya convertida a float.
+            longitud: longitud ya convertida a float.
+            datos: diccionario devuelto por el resolutor de zonas.
+            localizable: flag para actualizar también la dirección.
+        """
         if localizable:
             self._direccion = datos["direccion"]
-        
-        self._zona_horaria = tz.timezone(datos["zona_horaria"])
+        if self.coordenadas == (latitud, longitud):
+            return
+
+        self._datos_zona = datos
+        self._zona_horaria = fh.zona_horaria(datos["zona_horaria"])
         self._coordenadas = {"lat": latitud, "lng": longitud}
+        with self._cerrojo_eventos:
+            self._eventos_por_fecha.clear()
         self._fechahoras_eventos_sol = None
         self._tatwas = None
-        self._fechahora_tw = None
+        self._fechahora_tw = self._instante_tw = None
 
 
     def fijar_fechahoras_eventos_sol(self, salida = None, 
@@ -556,9 +883,10 @@ class EntornoTatwas:
                                      amanecer_nautico = None, 
                                      amanecer_astronomico = None):
         """
-        Fijar las horas de los eventos del sol manualmente. Los datos
-        de coordenadas, localización y fecha se eliminan. Los eventos
-        cuyos argumentos reciban valor None no son registrados.
+        Fijar las horas de los eventos del sol manualmente. La fecha
+        del sol se elimina, pero se mantienen las coordenadas y la
+        dirección. Los eventos cuyos argumentos reciban valor None no
+        son registrados.
 
         Argumentos:
             salida: hora de salida del sol. Tipo datetime.datetime.
@@ -573,26 +901,67 @@ class EntornoTatwas:
         """
         if self._coordenadas is None:
             raise ValueError("No se han fijado las coordenadas")
-        
-        self._fechahoras_eventos_sol = dict()
 
+        fechahoras_eventos_sol = dict()
         for evento, fechahora in locals().items():
-            if fechahora is None or evento == "self":
+            if fechahora is None or evento in ("self",
+                                               "fechahoras_eventos_sol"):
                 continue
-            
+
             if not isinstance(fechahora, dt.datetime):
-                self._fechahoras_eventos_sol = None
                 raise TypeError("{} no es datetime.datetime".format(evento))
-           
-            self._fechahoras_eventos_sol[evento] = \
-                self._zona_horaria.localize(fechahora.replace(tzinfo=None))
+
+            fechahoras_eventos_sol[evento] = \
+                fh.localizar(fechahora.replace(tzinfo=None),
+                             self._zona_horaria)
 
         self._fecha_sol = None
-        self._coordenadas = None
-        self._fechahora_tw = None
-        self._direccion = None
+        self._aplicar_fechahoras_eventos_sol(fechahoras_eventos_sol)
         
 
+    def _obtener_fechahoras_eventos_sol(self, fecha):
+        """
+        Obtener las fechas y horas locales de los eventos usados para
+        calcular tatwas en una fecha. Solo se piden a la fuente de
+        eventos del sol la primera vez para cada fecha y coordenadas.
+
+        Argumentos:
+            fecha: objeto datetime.date con la fecha de los eventos.
+
+        Retorno:
+            Diccionario {evento: datetime.datetime local} nuevo, que
+            puede modificarse.
+
+        Excepciones:
+            RuntimeError si la fuente no puede obtener los eventos.
+        """
+        with self._cerrojo_eventos:
+            fechahoras_eventos_sol = self._eventos_por_fecha.get(fecha)
+            if fechahoras_eventos_sol is not None:
+                self._eventos_por_fecha.move_to_end(fecha)
+                _CONSULTAS_EVENTOS["acierto"].incrementar()
+                return dict(fechahoras_eventos_sol)
+        _CONSULTAS_EVENTOS["fallo"].incrementar()
+
+        coordenadas = self._coordenadas
+        with _ETAPA_EVENTOS_SOL.medir():
+            fechahoras_eventos_sol = self._fuente_eventos_sol(
+                coordenadas["lat"], coordenadas["lng"], fecha)
+        fechahoras_eventos_sol = \
+            {evento: fhora.astimezone(self._zona_horaria)
+             for evento, fhora in fechahoras_eventos_sol.items()
+             if evento in self._EVENTOS_SOL_PARA_TATWAS}
+
+        with self._cerrojo_eventos:
+            if coordenadas is self._coordenadas:
+                self._eventos_por_fecha[fecha] = fechahoras_eventos_sol
+                if len(self._eventos_por_fecha) \
+                   > self._MAX_FECHAS_EVENTOS_SOL:
+                    self._eventos_por_fecha.popitem(last=False)
+
+        return dict(fechahoras_eventos_sol)
+
+
     def actualizar_fechahoras_eventos_sol(self):
         """
         Actualizar las horas de los eventos del sol en las
@@ -614,35 +983,399 @@ class EntornoTatwas:
             fecha_sol_ayer = (fechahora_actual - dt.timedelta(days=1)).date() 
         else:
             fecha_sol = self._fecha_sol
+            fechahora_actual = fh_evts_sol_ayer = None
 
         try:
             fechahoras_eventos_sol = \
-                api.sunrise_sunset(self._coordenadas["lat"], 
-                                   self._coordenadas["lng"], fecha_sol)
-            
-            self._fechahoras_eventos_sol = \
-                {evento: self._zona_horaria.fromutc(fhora.replace(tzinfo=None)) 
-                    for evento, fhora in fechahoras_eventos_sol.items() 
-                        if evento in self._EVENTOS_SOL_PARA_TATWAS}
+                self._obtener_fechahoras_eventos_sol(fecha_sol)
 
             if self._fecha_sol is None:
-                fh_evts_sol_ayer = api.sunrise_sunset(self._coordenadas["lat"], 
-                                                      self._coordenadas["lng"],
-                                                      fecha_sol_ayer)
-    
-                for evento, fechahora in self._fechahoras_eventos_sol.items():
-                    if fechahora_actual < fechahora:
-                        fh_ayer = fh_evts_sol_ayer[evento].replace(tzinfo=None)
-                        self._fechahoras_eventos_sol[evento] = \
-                            self._zona_horaria.fromutc(fh_ayer) 
-                            
-        
+                fh_evts_sol_ayer = \
+                    self._obtener_fechahoras_eventos_sol(fecha_sol_ayer)
         except RuntimeError as err:
-            print(err) # Log
+            log.warning("Error al obtener las horas de eventos del sol",
+                        coordenadas=self.coordenadas, error=err)
             raise RuntimeError("Error al obtener las horas de eventos del sol")
-              
+
+        self._aplicar_fechahoras_eventos_sol(fechahoras_eventos_sol,
+                                             fh_evts_sol_ayer,
+                                             fechahora_actual)
+
+
+    async def actualizar_fechahoras_eventos_sol_async(self):
+        """
+        Versión asíncrona de actualizar_fechahoras_eventos_sol. Si la
+        fecha elegida es None, las horas de los eventos de hoy y de
+        ayer se obtienen a la vez.
+        """
+        if self._coordenadas is None:
+            raise ValueError("No se han fijado las coordenadas")
+
+        fecha_sol = self._fecha_sol
+        try:
+            if fecha_sol is None:
+                fechahora_actual = await api_async.ejecutar(
+                    fh.obtener_fechahora, self._zona_horaria)
+                fechahoras_eventos_sol, fh_evts_sol_ayer = \
+                    await asyncio.gather(
+                        api_async.ejecutar(
+                            self._obtener_fechahoras_eventos_sol,
+                            fechahora_actual.date()),
+                        api_async.ejecutar(
+                            self._obtener_fechahoras_eventos_sol,
+                            (fechahora_actual - dt.timedelta(days=1)).date()))
+            else:
+                fechahoras_eventos_sol = await api_async.ejecutar(
+                    self._obtener_fechahoras_eventos_sol, fecha_sol)
+                fh_evts_sol_ayer = fechahora_actual = None
+        except RuntimeError as err:
+            log.warning("Error al obtener las horas de eventos del sol",
+                        coordenadas=self.coordenadas, error=err)
+            raise RuntimeError("Error al obtener las horas de eventos del sol")
+
+        self._aplicar_fechahoras_eventos_sol(fechahoras_eventos_sol,
+                                             fh_evts_sol_ayer,
+                                             fechahora_actual)
+
+
+    def _aplicar_fechahoras_eventos_sol(self, fechahoras_eventos_sol,
+                                        fh_evts_sol_ayer=None,
+                                        fechahora_actual=None):
+        """
+        Guardar internamente las horas de los eventos del sol. Si se
+        indican los eventos del día anterior, se usan para aquellos
+        eventos de hoy que aún no han ocurrido en la fecha y hora
+        actual. Los tatwas calculados solo se descartan si las horas
+        de los eventos cambian.
+
+        Argumentos:
+            fechahoras_eventos_sol: diccionario {evento: fechahora}
+                de la fecha del sol.
+            fh_evts_sol_ayer: diccionario {evento: fechahora} del día
+                anterior o None.
+            fechahora_actual: datetime.datetime local actual usada
+                para elegir entre los eventos de hoy y de ayer.
+        """
+        if fh_evts_sol_ayer is not None:
+            for evento, fechahora in fechahoras_eventos_sol.items():
+                if fechahora_actual < fechahora:
+                    fechahoras_eventos_sol[evento] = fh_evts_sol_ayer[evento]
+
+        if fechahoras_eventos_sol == self._fechahoras_eventos_sol:
+            return
+
+        self._fechahoras_eventos_sol = fechahoras_eventos_sol
         self._tatwas = None
-        self._fechahora_tw = None
+        self._fechahora_tw = self._instante_tw = None
+
+
+    def horario_tatwas(self, fecha_inicio=None, fecha_fin=None,
+                       evento="salida"):
+        """
+        Generador que produce de manera perezosa todos los intervalos
+        de tatwas desde el evento del sol de cada fecha hasta el mismo
+        evento del día siguiente. Las horas de los eventos del sol se
+        obtienen una sola vez por día.
+
+        Argumentos:
+            fecha_inicio: objeto datetime.date con la primera fecha del
+                horario. Si es None se toma la fecha del sol fijada o,
+                en su defecto, la fecha local actual.
+            fecha_fin: objeto datetime.date con la última fecha
+                (incluida) del horario. Si es None solo se genera el
+                horario de fecha_inicio.
+            evento: evento del sol (uno de _EVENTOS_SOL_PARA_TATWAS)
+                desde el cual se cuentan los tatwas.
+
+        Retorno:
+            Generador de diccionarios con el formato:
+                {"fecha_sol": datetime.date del evento del sol,
+                 "tatwa": objeto Tatwa,
+                 "fechahora_inicio": datetime.datetime local de inicio,
+                 "fechahora_fin": datetime.datetime local de fin}
+            El último tatwa de cada día finaliza con el evento del sol
+            del día siguiente. Los días en los que el evento no ocurre
+            (latitudes polares) no producen intervalos, y el generador
+            finaliza si se recorren _MAX_DIAS_SIN_EVENTO días seguidos
+            sin evento del sol.
+
+        Excepciones:
+            ValueError si las coordenadas no han sido fijadas o el
+                evento no es válido.
+            TypeError si las fechas no son datetime.date.
+            RuntimeError si ocurre algún error al intentar obtener las
+               horas de los eventos.
+        """
+        if self._coordenadas is None:
+            raise ValueError("No se han fijado las coordenadas")
+        if evento not in self._EVENTOS_SOL_PARA_TATWAS:
+            raise ValueError("Evento {} no válido para calcular tatwas: {}"
+                             .format(evento, self._EVENTOS_SOL_PARA_TATWAS))
+
+        if fecha_inicio is None:
+            fecha_inicio = self._fecha_sol
+            if fecha_inicio is None:
+                fecha_inicio = fh.obtener_fechahora(self._zona_horaria).date()
+        if fecha_fin is None:
+            fecha_fin = fecha_inicio
+        if not isinstance(fecha_inicio, dt.date) \
+           or not isinstance(fecha_fin, dt.date):
+            raise TypeError("Las fechas deben ser de tipo datetime.date")
+
+        duracion_tatwa = dt.timedelta(seconds=Tatwa.SEGUNDOS_TATWA)
+        dias_sin_evento = 0
+        for fecha, inicio_utc, fin_dia_utc in \
+                self._dias_solares(fecha_inicio, evento):
+            if fecha > fecha_fin:
+                break
+            if inicio_utc is None:
+                dias_sin_evento += 1
+                if dias_sin_evento > self._MAX_DIAS_SIN_EVENTO:
+                    return
+                continue
+            dias_sin_evento = 0
+
+            posicion = 1
+            while inicio_utc < fin_dia_utc:
+                fin_utc = min(inicio_utc + duracion_tatwa, fin_dia_utc)
+                yield self._ventana(fecha, Tatwa(posicion), inicio_utc,
+                                    fin_utc)
+                inicio_utc = fin_utc
+                posicion += 1
+
+
+    def _dias_solares(self, fecha, evento):
+        """
+        Generador infinito de los días solares a partir de una fecha:
+        desde el evento del sol de cada fecha hasta el mismo evento del
+        día siguiente. Las horas de los eventos del sol de cada fecha
+        se obtienen una sola vez.
+
+        Argumentos:
+            fecha: objeto datetime.date con la primera fecha.
+            evento: evento del sol que delimita los días.
+
+        Retorno:
+            Generador de tuplas (fecha, inicio, fin) con los instantes
+            UTC (datetime.datetime) de inicio y fin de cada día solar.
+            Si el evento no ocurre en alguna de las dos fechas
+            (latitudes polares) inicio y fin son None.
+
+        Excepciones:
+            RuntimeError si ocurre algún error al intentar obtener las
+               horas de los eventos.
+        """
+        try:
+            fechahora_evento = \
+                self._obtener_fechahoras_eventos_sol(fecha)[evento]
+        except RuntimeError as err:
+            log.warning("Error al obtener las horas de eventos del sol",
+                        coordenadas=self.coordenadas, error=err)
+            raise RuntimeError("Error al obtener las horas de eventos del sol")
+
+        while True:
+            fecha_siguiente = fecha + dt.timedelta(days=1)
+            try:
+                eventos_siguientes = \
+                    self._obtener_fechahoras_eventos_sol(fecha_siguiente)
+            except RuntimeError as err:
+                log.warning("Error al obtener las horas de eventos del sol",
+                            coordenadas=self.coordenadas,
+                            fecha=fecha_siguiente, error=err)
+                raise RuntimeError("Error al obtener las horas de eventos del"
+                                   " sol")
+
+            fechahora_evento_siguiente = eventos_siguientes[evento]
+            if fechahora_evento == ef.FECHAHORA_EVENTO_INEXISTENTE \
+               or fechahora_evento_siguiente \
+                  == ef.FECHAHORA_EVENTO_INEXISTENTE:
+                yield fecha, None, None
+            else:
+                yield (fecha, fechahora_evento.astimezone(fh.UTC),
+                       fechahora_evento_siguiente.astimezone(fh.UTC))
+
+            fecha = fecha_siguiente
+            fechahora_evento = fechahora_evento_siguiente
+
+
+    def _ventana(self, fecha_sol, tatwa, inicio_utc, fin_utc):
+        """
+        Crear el diccionario de un intervalo de tatwa con las fechas y
+        horas en la zona horaria local.
+        """
+        return {"fecha_sol": fecha_sol, "tatwa": tatwa,
+                "fechahora_inicio": inicio_utc.astimezone(self._zona_horaria),
+                "fechahora_fin": fin_utc.astimezone(self._zona_horaria)}
+
+
+    def _fechahora_utc(self, fechahora):
+        """
+        Convertir una fecha y hora a UTC. Si no tiene zona horaria se
+        considera local de las coordenadas y si es None se toma la
+        fecha y hora actuales.
+        """
+        if fechahora is None:
+            fechahora = fh.obtener_fechahora(self._zona_horaria)
+        elif not isinstance(fechahora, dt.datetime):
+            raise TypeError("La fecha y hora debe ser datetime.datetime")
+        elif fechahora.tzinfo is None:
+            fechahora = fh.localizar(fechahora, self._zona_horaria)
+
+        return fechahora.astimezone(fh.UTC)
+
+
+    def _ventanas_tatwa(self, tatwa, desde_utc, evento):
+        """
+        Generador de los intervalos de un tatwa que finalizan después
+        de un instante. Los intervalos de cada día solar se calculan
+        aritméticamente a partir del evento del sol, sin recorrer los
+        tatwas intermedios.
+
+        Argumentos:
+            tatwa: nombre del tatwa (str) u objeto Tatwa. Si el tatwa
+                tiene ciclo solo se considera esa posición del día; si
+                no, todas las posiciones con ese nombre.
+            desde_utc: datetime.datetime UTC a partir del cual buscar.
+            evento: evento del sol desde el cual se cuentan los tatwas.
+
+        Retorno:
+            Generador de diccionarios con el formato de horario_tatwas.
+            Finaliza si se recorren _MAX_DIAS_SIN_EVENTO días seguidos
+            sin evento del sol.
+        """
+        if self._coordenadas is None:
+            raise ValueError("No se han fijado las coordenadas")
+        if evento not in self._EVENTOS_SOL_PARA_TATWAS:
+            raise ValueError("Evento {} no válido para calcular tatwas: {}"
+                             .format(evento, self._EVENTOS_SOL_PARA_TATWAS))
+        if isinstance(tatwa, str):
+            tatwa = Tatwa(tatwa)
+        elif not isinstance(tatwa, Tatwa):
+            raise TypeError("El tatwa debe ser un str o un Tatwa")
+
+        segundos_tatwa = Tatwa.SEGUNDOS_TATWA
+        numero_tatwas = len(Tatwa.NOMBRES_TATWAS)
+        posicion_fija = None if tatwa.ciclo is None else tatwa.posicion
+        indice = tatwa._indice()
+
+        # El día solar que contiene el instante puede empezar la fecha
+        # local anterior.
+        fecha = desde_utc.astimezone(self._zona_horaria).date() \
+                - dt.timedelta(days=1)
+        dias_sin_evento = 0
+
+        for fecha, inicio_dia, fin_dia in self._dias_solares(fecha, evento):
+            if inicio_dia is None:
+                dias_sin_evento += 1
+                if dias_sin_evento > self._MAX_DIAS_SIN_EVENTO:
+                    return
+                continue
+            dias_sin_evento = 0
+            if fin_dia <= desde_utc:
+                continue
+
+            segundos = (desde_utc - inicio_dia).total_seconds()
+            posicion = 1 if segundos < 0 \
+                       else int(segundos // segundos_tatwa) + 1
+            if posicion_fija is None:
+                posicion += (indice - (posicion - 1)) % numero_tatwas
+                paso = numero_tatwas
+            elif posicion_fija >= posicion:
+                posicion, paso = posicion_fija, None
+            else:
+                continue
+
+            while True:
+                inicio = inicio_dia + dt.timedelta(
+                    seconds=(posicion - 1) * segundos_tatwa)
+                if inicio >= fin_dia:
+                    break
+                fin = min(inicio + dt.timedelta(seconds=segundos_tatwa),
+                          fin_dia)
+                yield self._ventana(fecha, Tatwa(posicion), inicio, fin)
+                if paso is None:
+                    break
+                posicion += paso
+
+
+    def proximos_tatwas(self, tatwa, fechahora=None, n=1, evento="salida"):
+        """
+        Obtener los próximos intervalos en los que ocurre un tatwa,
+        incluido el que está en curso en el instante indicado.
+
+        Argumentos:
+            tatwa: nombre del tatwa (str) u objeto Tatwa. Si el tatwa
+                tiene ciclo solo se considera esa posición de cada día.
+            fechahora: datetime.datetime a partir del cual buscar. Si
+                no tiene zona horaria se considera hora local. None para
+                la fecha y hora actuales.
+            n: número de intervalos a obtener.
+            evento: evento del sol desde el cual se cuentan los tatwas.
+
+        Retorno:
+            Lista de hasta n diccionarios con el formato de
+            horario_tatwas, ordenados por fecha y hora de inicio.
+
+        Excepciones:
+            ValueError si las coordenadas no han sido fijadas o los
+                argumentos tienen valores incorrectos.
+            TypeError si los argumentos son de tipo incorrecto.
+            RuntimeError si ocurre algún error al intentar obtener las
+               horas de los eventos.
+        """
+        if not isinstance(n, int) or n < 0:
+            raise ValueError("El número de intervalos debe ser un entero"
+                             " >= 0")
+
+        return list(itertools.islice(
+            self._ventanas_tatwa(tatwa, self._fechahora_utc(fechahora),
+                                 evento), n))
+
+
+    def ventanas_tatwa(self, tatwa, fechahora_inicio, fechahora_fin,
+                       evento="salida"):
+        """
+        Generador de todos los intervalos de un tatwa que se solapan
+        con un rango de fechas y horas.
+
+        Argumentos:
+            tatwa: nombre del tatwa (str) u objeto Tatwa. Si el tatwa
+                tiene ciclo solo se considera esa posición de cada día.
+            fechahora_inicio: datetime.datetime de inicio del rango. Si
+                no tiene zona horaria se considera hora local.
+            fechahora_fin: datetime.datetime de fin del rango.
+            evento: evento del sol desde el cual se cuentan los tatwas.
+
+        Retorno:
+            Generador de diccionarios con el formato de horario_tatwas.
+
+        Excepciones:
+            Las mismas que proximos_tatwas.
+        """
+        fin_utc = self._fechahora_utc(fechahora_fin)
+        for ventana in self._ventanas_tatwa(
+                tatwa, self._fechahora_utc(fechahora_inicio), evento):
+            if ventana["fechahora_inicio"] >= fin_utc:
+                return
+            yield ventana
+
+
+    @property
+    def timestamps_eventos_sol(self):
+        """
+        Getter que obtiene los segundos UNIX UTC de las horas de los
+        eventos del sol para tatwas, en el formato usado por
+        vectorial.calcular_tatwas_vectorial.
+
+        Retorno:
+            Diccionario {evento: timestamp} o None si las horas de los
+            eventos del sol no han sido fijadas.
+        """
+        if self._fechahoras_eventos_sol is None:
+            return None
+
+        return {evento: fechahora.timestamp() for evento, fechahora
+                in self._fechahoras_eventos_sol.items()}
 
 
     def calcular_tatwas(self):
@@ -656,43 +1389,120 @@ class EntornoTatwas:
         """
         if self._fechahoras_eventos_sol is None:
             raise ValueError("No se han obtenido las horas de eventos del sol")
-  
-        self._fechahora_tw = fh.combinar_fecha_hora(self._fecha_tw,
-                                                    self._hora_tw,
-                                                    self._zona_horaria)
-        self._tatwas = dict()
 
-        for evento, fechahora_evento in self._fechahoras_eventos_sol.items():
-            if self._fechahora_tw < fechahora_evento \
-               or (self._fechahora_tw >= 
-                   fechahora_evento + dt.timedelta(1, Tatwa.SEGUNDOS_TATWA)):
-                self._tatwas[evento] = None
-                continue
+        # Los tatwas ya calculados siguen siendo válidos mientras no
+        # cambie ningún dato y la fecha y hora no sean las actuales.
+        if self._tatwas is not None and self._fecha_tw is not None \
+           and self._hora_tw is not None:
+            return
 
-            segundos_evento_tw = \
-                (self._fechahora_tw - fechahora_evento).total_seconds()
-            posicion_tatwa = segundos_evento_tw // Tatwa.SEGUNDOS_TATWA + 1
-            segundos_restantes = Tatwa.SEGUNDOS_TATWA - \
-                                 segundos_evento_tw % Tatwa.SEGUNDOS_TATWA
-            segundos_inicio = (posicion_tatwa - 1) * Tatwa.SEGUNDOS_TATWA
-            fechahora_inicio = fechahora_evento \
-                               + dt.timedelta(seconds=segundos_inicio)
-            fechahora_fin = fechahora_inicio \
-                            + dt.timedelta(seconds=Tatwa.SEGUNDOS_TATWA)
-        
-            self._tatwas[evento] = \
-                {"tatwa": Tatwa(int(posicion_tatwa)), 
-                 "fechahora_fin": fechahora_fin, 
-                 "fechahora_inicio": fechahora_inicio,
-                 "segundos_restantes": 
-                 dt.timedelta(seconds=segundos_restantes)}
+        # Los límites se calculan con aritmética entera sobre
+        # microsegundos UNIX: sumar tiempo a una fecha y hora con zona
+        # horaria es aritmética de hora local, incorrecta si entre
+        # medias hay un cambio de hora. Las fechas y horas (la del
+        # instante y las de los resultados) solo se crean si se piden.
+        if self._fecha_tw is not None and self._hora_tw is not None \
+           and self._zona_horaria is not None:
+            fechahora = None
+            instante = fh.microsegundos_local(
+                dt.datetime.combine(self._fecha_tw, self._hora_tw),
+                self._zona_horaria)
+        else:
+            fechahora = fh.combinar_fecha_hora(self._fecha_tw,
+                                               self._hora_tw,
+                                               self._zona_horaria)
+            instante = fh.microsegundos_utc(fechahora)
+
+        self._calcular_tatwas_instante(instante, fechahora)
+
+
+    def _calcular_tatwas_instante(self, instante, fechahora=None):
+        """
+        Calcular los tatwas en un instante absoluto.
+
+        Argumentos:
+            instante: microsegundos UNIX (int) del instante.
+            fechahora: datetime.datetime local del instante o None
+                para crearla solo si se pide.
+
+        Excepciones:
+            ValueError si no hay ningún evento para calcular tatwas.
+        """
+        inicio_etapa = time.perf_counter()
+        if self._indice_tatwas is None \
+           or self._indice_tatwas[0] is not self._fechahoras_eventos_sol:
+            self._indice_tatwas = \
+                (self._fechahoras_eventos_sol,
+                 IndiceTatwas.obtener(self._fechahoras_eventos_sol))
+
+        self._fechahora_tw = fechahora
+        self._instante_tw = instante
+        self._tatwas = dict()
+
+        indice_tatwas = self._indice_tatwas[1]
+        for evento, intervalo in indice_tatwas.buscar(instante).items():
+            self._tatwas[evento] = None if intervalo is None \
+                else ResultadoTatwa(*intervalo, instante, self._zona_horaria)
+        _ETAPA_CALCULAR_TATWAS.observar(time.perf_counter() - inicio_etapa)
 
         if len(self._tatwas) == 0:
             self._tatwas = None
-            self._fechahora_tw = None
+            self._fechahora_tw = self._instante_tw = None
             raise ValueError("No hay ninguna hora de los siguientes eventos"
                              " para calcular tatwas: {}"
-                             .format(_EVENTOS_SOL_PARA_TATWAS))
+                             .format(self._EVENTOS_SOL_PARA_TATWAS))
+
+
+    def calcular_tatwas_fechahora(self, fechahora=None):
+        """
+        Calcular los tatwas en un instante usando los últimos eventos
+        del sol ocurridos antes de dicho instante, obteniendo las horas
+        de los eventos de su fecha y de la fecha anterior.
+
+        Argumentos:
+            fechahora: datetime.datetime del instante. Si no tiene zona
+                horaria se considera hora local. None para la fecha y
+                hora actuales.
+
+        Retorno:
+            Diccionario de tatwas con el formato de _tatwas.
+
+        Excepciones:
+            ValueError si las coordenadas no han sido fijadas o no hay
+                tatwas en el instante.
+            TypeError si la fecha y hora no es datetime.datetime.
+            RuntimeError si ocurre algún error al intentar obtener las
+               horas de los eventos.
+        """
+        if self._coordenadas is None:
+            raise ValueError("No se han fijado las coordenadas")
+
+        fechahora = self._fechahora_utc(fechahora) \
+                        .astimezone(self._zona_horaria)
+        try:
+            fechahoras_eventos_sol = \
+                self._obtener_fechahoras_eventos_sol(fechahora.date())
+            fh_evts_sol_ayer = self._obtener_fechahoras_eventos_sol(
+                fechahora.date() - dt.timedelta(days=1))
+        except RuntimeError as err:
+            log.warning("Error al obtener las horas de eventos del sol",
+                        coordenadas=self.coordenadas, error=err)
+            raise RuntimeError("Error al obtener las horas de eventos del sol")
+
+        self._aplicar_fechahoras_eventos_sol(fechahoras_eventos_sol,
+                                             fh_evts_sol_ayer, fechahora)
+        self.fecha_tw = fechahora.date()
+        self.hora_tw = fechahora.time()
+
+        # El índice se consulta con el instante absoluto y no con la
+        # fecha y hora local, que en la hora repetida al retrasar la
+        # hora es ambigua (las horas comparan igual sin tener en cuenta
+        # fold).
+        instante = fh.microsegundos_utc(fechahora)
+        if self._tatwas is None or self._instante_tw != instante:
+            self._calcular_tatwas_instante(instante, fechahora)
+
+        return self._tatwas
 
 
     @property
@@ -721,10 +1531,12 @@ class EntornoTatwas:
         """
         if fecha is not None and not isinstance(fecha, dt.date):
             raise TypeError("Argumento no es de tipo datetime.date")
-            
+        if fecha == self._fecha_sol and fecha is not None:
+            return
+
         self._fecha_sol = fecha
         self._fechahoras_eventos_sol = None
-        self._fechahora_tw = None
+        self._fechahora_tw = self._instante_tw = None
         self._tatwas = None
 
 
@@ -755,13 +1567,32 @@ class EntornoTatwas:
         """
         if hora is not None and not isinstance(hora, dt.time):
             raise TypeError("Argumento no es de tipo datetime.time")
+        if hora == self._hora_tw and hora is not None:
+            return
 
         self._hora_tw = hora
         self._tatwas = None
-        self._fechahora_tw = None
+        self._fechahora_tw = self._instante_tw = None
    
    
              
+    @property
+    def fechahora_tw(self):
+        """
+        Getter que obtiene la fecha y hora en la que se han calculado
+        los últimos tatwas. Se crea la primera vez que se pide.
+
+        Retorno:
+            Valor datetime.datetime local o None si no se han
+            calculado tatwas.
+        """
+        if self._fechahora_tw is None and self._instante_tw is not None:
+            self._fechahora_tw = fh.fechahora_microsegundos(
+                self._instante_tw, self._zona_horaria)
+
+        return self._fechahora_tw
+
+
     @property
     def fecha_tw(self):
         """
@@ -789,7 +1620,53 @@ class EntornoTatwas:
         """
         if fecha is not None and not isinstance(fecha, dt.date):
             raise TypeError("Argumento no es de tipo datetime.date")
+        if fecha == self._fecha_tw and fecha is not None:
+            return
 
         self._fecha_tw = fecha
         self._tatwas = None
-        self._fechahora_tw = None
+        self._fechahora_tw = self._instante_tw = None
+
+
+
+async def calcular_tatwas_ubicaciones(ubicaciones, fecha_tw=None,
+                                      hora_tw=None, max_concurrentes=100,
+                                      **opciones_entorno):
+    """
+    Calcular de manera concurrente los tatwas de muchas ubicaciones
+    desde un único bucle de eventos. Las peticiones de red de cada
+    ubicación se solapan con las del resto.
+
+    Argumentos:
+        ubicaciones: secuencia de coordenadas (latitud, longitud).
+        fecha_tw: objeto datetime.date con la fecha local a calcular
+            los tatwas. None para la fecha actual de cada ubicación.
+        hora_tw: objeto datetime.time con la hora local a calcular los
+            tatwas. None para la hora actual de cada ubicación.
+        max_concurrentes: número máximo de ubicaciones procesándose a
+            la vez.
+        opciones_entorno: argumentos pasados al constructor de cada
+            EntornoTatwas.
+
+    Retorno:
+        Lista, en el mismo orden que ubicaciones, con el diccionario de
+        tatwas calculados de cada ubicación (mismo formato que el
+        calculado por EntornoTatwas.calcular_tatwas) o la excepción
+        producida al calcularlos.
+    """
+    semaforo = asyncio.Semaphore(max_concurrentes)
+
+    async def calcular(latitud, longitud):
+        async with semaforo:
+            entorno_tw = EntornoTatwas(**opciones_entorno)
+            await entorno_tw.fijar_coordenadas_async(latitud, longitud)
+            await entorno_tw.actualizar_fechahoras_eventos_sol_async()
+            entorno_tw.fecha_tw = fecha_tw
+            entorno_tw.hora_tw = hora_tw
+            entorno_tw.calcular_tatwas()
+            return entorno_tw._tatwas
+
+    return await asyncio.gather(*(calcular(latitud, longitud)
+                                  for latitud, longitud in ubicaciones),
+                                return_exceptions=True)
+
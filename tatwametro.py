@@ -8,9 +8,6 @@ Programa para calcular tatwas
 este archivo y los módulos que contengan el proyecto usarán ese archivo
 común para escribir logs.
 - Coordenadas por IP
-- Tabla de Horario de Tatwas.
-- Hora más próxima de ocurrir un tatwa.
-- Horario de un tatwa en concreto.
 - Solucionar fecha de sol para día de hoy.
 - Hacer interfaz.
 - Gestión correcta de excepciones.
@@ -18,25 +15,138 @@ común para escribir logs.
 - Mejorar documentación.
 - No se puede acceder al resultado de los tatwas mediante _tatwas.
 - Guardar zona horaria como tz.timezone en lugar de como cadena.
-- Mirar el argumento final de localize.
 """
 
+import argparse
 import util as ut
 import tatwa as tw
 import datetime as dt
 import api
+import cache
+import metricas
+import demonio as dm
+import tablas_sol as ts
+import interpolacion_sol as isol
+import resolutor_zonas as rz
 
 
-def main():
+def evaluar_ubicacion(entrada):
     """
-    Función principal
+    Evaluar una ubicación del demonio con el formato
+    "nombre=latitud,longitud".
+
+    Argumentos:
+        entrada: cadena a evaluar.
+
+    Retorno:
+        Tupla (nombre, latitud, longitud).
+
+    Excepciones:
+        argparse.ArgumentTypeError si la cadena no tiene un formato
+            correcto.
+    """
+    nombre, separador, coordenadas = entrada.partition("=")
+    if not separador or not nombre:
+        raise argparse.ArgumentTypeError("La ubicación debe tener el formato"
+                                         " nombre=latitud,longitud")
+    try:
+        return (nombre,) + ut.evaluar_coordenadas(coordenadas)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+
+def crear_fuentes(argumentos):
+    """
+    Crear la fuente de horas de eventos del sol y el resolutor de zonas
+    horarias indicados en la línea de comandos.
+
+    Argumentos:
+        argumentos: argumentos de la línea de comandos.
+
+    Retorno:
+        Tupla (cache_eventos_sol, fuente_eventos_sol, resolutor_zonas):
+        caché de eventos del sol que debe cerrarse al terminar, fuente
+        de eventos del sol de los entornos (la caché, o InterpolacionSol
+        o TablasSol sobre ella) y resolutor de zonas.
+    """
+    if argumentos.zonas is None:
+        resolutor_zonas = api.timezonedb_get
+    else:
+        resolutor_zonas = rz.ResolutorZonas(argumentos.zonas)
+
+    # Una única caché de eventos del sol para todas las ubicaciones.
+    cache_eventos_sol = cache.CacheEventosSol(
+        tw.EntornoTatwas.FUENTES_EVENTOS_SOL[argumentos.fuente])
+    fuente_eventos_sol = cache_eventos_sol
+    if argumentos.interpolacion_sol is not None:
+        # Solo las fechas pedidas a la fuente se guardan en la caché.
+        fuente_eventos_sol = isol.InterpolacionSol(
+            cache_eventos_sol, argumentos.interpolacion_sol,
+            argumentos.tolerancia_interpolacion)
+    if argumentos.tablas_sol is not None:
+        fuente_eventos_sol = ts.TablasSol(argumentos.tablas_sol,
+                                          fuente_eventos_sol)
+
+    return cache_eventos_sol, fuente_eventos_sol, resolutor_zonas
+
+
+
+def ejecutar_demonio(argumentos):
+    """
+    Emitir un evento en cada cambio de tatwa de las ubicaciones
+    indicadas hasta que se interrumpa el programa.
+
+    Argumentos:
+        argumentos: argumentos de la línea de comandos.
+    """
+    cache_eventos_sol, fuente_eventos_sol, resolutor_zonas = \
+        crear_fuentes(argumentos)
+
+    emisor = None
+    if argumentos.socket is not None:
+        emisor = dm.EmisorSocket(argumentos.socket)
+
+    demonio_tw = dm.DemonioTatwas(emisor, argumentos.evento,
+                                  fuente_eventos_sol=fuente_eventos_sol,
+                                  resolutor_zonas=resolutor_zonas)
+    for nombre, latitud, longitud in argumentos.ubicacion:
+        demonio_tw.agregar_ubicacion(nombre, latitud, longitud)
+
+    try:
+        demonio_tw.ejecutar()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cache_eventos_sol.cerrar()
+        if emisor is not None:
+            emisor.cerrar()
+
+
+
+def interactivo(argumentos):
     """
+    Calcular los tatwas de una ubicación pidiendo los datos al usuario.
+
+    Argumentos:
+        argumentos: argumentos de la línea de comandos.
+    """
+    cache_eventos_sol, fuente_eventos_sol, resolutor_zonas = \
+        crear_fuentes(argumentos)
+    try:
+        _interactivo(fuente_eventos_sol, resolutor_zonas)
+    finally:
+        cache_eventos_sol.cerrar()
+
+
+
+def _interactivo(fuente_eventos_sol, resolutor_zonas):
     ancho_pantalla = 79
     print("", "*" * ancho_pantalla,
           "  T A T W Á M E T R O  ".center(ancho_pantalla, "*"),
           "*" * ancho_pantalla, "", sep = "\n")
 
-    entorno_tw = tw.EntornoTatwas()
+    entorno_tw = tw.EntornoTatwas(fuente_eventos_sol, None, resolutor_zonas)
 
     coordenadas = ut.obtener_dato("Introduce coordenadas (latitud, longitud): ",
                                   ut.evaluar_coordenadas)
@@ -72,7 +182,7 @@ def main():
     entorno_tw.calcular_tatwas()
     
     print(" INFORMACIÓN DE LOS TATWAS CALCULADOS ({}) "
-          .format(entorno_tw._fechahora_tw.strftime("%H:%M:%S | %d/%m/%Y"))
+          .format(entorno_tw.fechahora_tw.strftime("%H:%M:%S | %d/%m/%Y"))
           .center(ancho_pantalla, "·"), "\n")
     for ev, tatwa in entorno_tw._tatwas.items():
         print("*", api.EVENTOS_SOL_DESCRIPCION[ev].capitalize())
@@ -93,5 +203,103 @@ def main():
         print("")
 
 
+
+def main():
+    """
+    Función principal
+    """
+    analizador = argparse.ArgumentParser(description="Cálculo de tatwas")
+    analizador.add_argument("--demonio", action="store_true",
+                            help="emitir un evento en cada cambio de tatwa"
+                                 " de las ubicaciones indicadas")
+    analizador.add_argument("--ubicacion", action="append", default=[],
+                            type=evaluar_ubicacion,
+                            metavar="NOMBRE=LAT,LNG",
+                            help="ubicación del demonio (repetible, solo"
+                                 " con --demonio)")
+    analizador.add_argument("--evento",
+                            choices=tw.EntornoTatwas._EVENTOS_SOL_PARA_TATWAS,
+                            help="evento del sol desde el que se cuentan"
+                                 " los tatwas del demonio (solo con"
+                                 " --demonio, por defecto salida)")
+    analizador.add_argument("--fuente", default="api",
+                            choices=sorted(tw.EntornoTatwas
+                                           .FUENTES_EVENTOS_SOL),
+                            help="fuente de las horas de eventos del sol")
+    analizador.add_argument("--zonas", metavar="BINARIO",
+                            help="archivo de zonas horarias compilado con"
+                                 " resolutor_zonas.py (por defecto la API"
+                                 " TimeZoneDB)")
+    analizador.add_argument("--tablas-sol", metavar="BINARIO",
+                            help="archivo de horas de eventos del sol"
+                                 " precalculadas con tablas_sol.py (las"
+                                 " ubicaciones y fechas que no están en él"
+                                 " se piden a la fuente)")
+    analizador.add_argument("--interpolacion-sol", type=int, metavar="DIAS",
+                            help="pedir a la fuente las horas de eventos"
+                                 " del sol solo cada DIAS días e interpolar"
+                                 " las intermedias")
+    analizador.add_argument("--tolerancia-interpolacion", type=float,
+                            default=60, metavar="SEGUNDOS",
+                            help="error máximo estimado de las horas"
+                                 " interpoladas (por defecto 60)")
+    analizador.add_argument("--socket", metavar="RUTA",
+                            help="enviar los eventos del demonio a un"
+                                 " socket UNIX de datagramas en lugar de"
+                                 " escribirlos como líneas JSON en la salida"
+                                 " estándar (solo con --demonio)")
+    analizador.add_argument("--metricas", type=int, metavar="PUERTO",
+                            help="servir las métricas en formato"
+                                 " Prometheus en http://127.0.0.1:PUERTO"
+                                 "/metrics")
+    analizador.add_argument("--archivo-metricas", metavar="RUTA",
+                            help="escribir las métricas en formato"
+                                 " Prometheus en un archivo cada 15"
+                                 " segundos y al terminar")
+    analizador.add_argument("--log-nivel", default="WARNING",
+                            help="nivel mínimo de los mensajes de log")
+    analizador.add_argument("--log-json", action="store_true",
+                            help="emitir el log como líneas JSON")
+    analizador.add_argument("--log-archivo", metavar="RUTA",
+                            help="añadir el log a un archivo en lugar de"
+                                 " a la salida de error")
+    argumentos = analizador.parse_args()
+
+    try:
+        metricas.configurar_log(argumentos.log_nivel, argumentos.log_json,
+                                argumentos.log_archivo)
+    except (ValueError, OSError) as err:
+        analizador.error(str(err))
+    if argumentos.interpolacion_sol is not None \
+       and (argumentos.interpolacion_sol < 2
+            or argumentos.tolerancia_interpolacion < 0):
+        analizador.error("--interpolacion-sol debe ser >= 2 y"
+                         " --tolerancia-interpolacion >= 0")
+    if not argumentos.demonio \
+       and (argumentos.evento is not None or argumentos.ubicacion
+            or argumentos.socket is not None):
+        analizador.error("--evento, --ubicacion y --socket solo se usan con"
+                         " --demonio")
+    if argumentos.evento is None:
+        argumentos.evento = "salida"
+    if argumentos.metricas is not None:
+        metricas.iniciar_servidor_metricas(argumentos.metricas)
+    if argumentos.archivo_metricas is not None:
+        detener_metricas = \
+            metricas.iniciar_escritura_metricas(argumentos.archivo_metricas)
+
+    try:
+        if not argumentos.demonio:
+            interactivo(argumentos)
+        elif not argumentos.ubicacion:
+            analizador.error("--demonio necesita al menos una --ubicacion")
+        else:
+            ejecutar_demonio(argumentos)
+    finally:
+        if argumentos.archivo_metricas is not None:
+            detener_metricas.set()
+            metricas.REGISTRO.escribir(argumentos.archivo_metricas)
+
+
 if __name__ in ("__main__", "__console__"):
     main()
@@ -0,0 +1,32 @@
+#coding=utf-8
+
+"""
+Pruebas del coste de importación de los módulos, con las mismas
+comprobaciones que la batería de benchmark.py.
+
+Uso:
+    python3 -m pytest test_benchmark.py
+"""
+
+import benchmark
+
+
+
+def test_importacion_tatwa_presupuesto():
+    """
+    Importar tatwa no supera PRESUPUESTO_IMPORTACION_MS ni importa
+    dependencias perezosas.
+    """
+    resultado = benchmark.medir_importacion("tatwa")
+
+    assert resultado["milisegundos"] \
+           <= benchmark.PRESUPUESTO_IMPORTACION_MS, resultado
+    assert resultado["dependencias"] == []
+
+
+
+def test_importacion_sin_dependencias_red():
+    """
+    Importar tatwa, api o tatwametro no importa dependencias de red.
+    """
+    assert benchmark.dependencias_red_importadas() == {}
@@ -0,0 +1,128 @@
+#coding=utf-8
+
+"""
+Pruebas de las cachés sin acceso a red (funciones de geocodificación
+simuladas).
+
+Uso:
+    python3 -m pytest test_cache.py
+"""
+
+import pytest
+import cache
+
+
+class _Geocodificacion:
+    """
+    Función de geocodificación simulada que cuenta sus llamadas y
+    produce un error con el mensaje indicado, si lo hay.
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+        self.llamadas = 0
+        self.localizaciones = list()
+
+
+    def __call__(self, localizacion):
+        self.llamadas += 1
+        self.localizaciones.append(localizacion)
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return (40.4168, -3.7038)
+
+
+
+@pytest.mark.parametrize("ruta", [None, ":memory:"])
+def test_geocodificacion_guarda_sin_resultados(ruta):
+    """
+    Las localizaciones sin resultados se guardan durante ttl_error.
+    """
+    funcion = _Geocodificacion("Error API de Google: ZERO_RESULTS")
+    cache_gc = cache.CacheGeocodificacion(funcion, ruta=ruta)
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError, match="ZERO_RESULTS"):
+            cache_gc("Calle inexistente")
+    assert funcion.llamadas == 1
+    assert cache_gc.estadisticas()["aciertos_error"] == 2
+
+
+
+@pytest.mark.parametrize("error", [
+    "Error de conexión con google: tiempo de espera agotado",
+    "Error API de Google: OVER_QUERY_LIMIT",
+    "Error API de Google: UNKNOWN_ERROR"])
+@pytest.mark.parametrize("ruta", [None, ":memory:"])
+def test_geocodificacion_no_guarda_errores_transitorios(ruta, error):
+    """
+    Los errores transitorios se propagan sin guardarse, en memoria ni
+    en la base de datos, y la siguiente consulta llama a la función.
+    """
+    funcion = _Geocodificacion(error)
+    cache_gc = cache.CacheGeocodificacion(funcion, ruta=ruta)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match=error):
+            cache_gc("Madrid")
+    assert funcion.llamadas == 2
+    assert cache_gc.estadisticas()["entradas"] == 0
+
+    funcion.error = None
+    assert cache_gc("Madrid") == (40.4168, -3.7038)
+    assert cache_gc("Madrid") == (40.4168, -3.7038)
+    assert funcion.llamadas == 3
+
+
+
+def test_normalizar_direccion():
+    assert cache.normalizar_direccion("  Gran  Vía ,,Madrid ,ESPAÑA ") \
+           == "gran vía, madrid, españa"
+    assert cache.normalizar_direccion("ＭＡＤＲＩＤ") == "madrid"
+
+
+
+def test_geocodificacion_claves():
+    """
+    Las direcciones equivalentes y las coordenadas que coinciden con la
+    precisión indicada comparten entrada, y la función recibe las
+    coordenadas cuantizadas.
+    """
+    funcion = _Geocodificacion()
+    cache_gc = cache.CacheGeocodificacion(funcion, precision=3)
+
+    cache_gc("Gran Vía, Madrid")
+    cache_gc("  gran vía ,madrid ")
+    cache_gc((40.41681, -3.70379))
+    cache_gc([40.4168, -3.7038])
+
+    assert funcion.llamadas == 2
+    assert funcion.localizaciones == ["Gran Vía, Madrid", (40.417, -3.704)]
+    with pytest.raises(TypeError):
+        cache_gc(" , ")
+
+
+
+def test_geocodificacion_persistente_y_caducidad(tmp_path):
+    """
+    Las entradas guardadas en SQLite se comparten entre instancias y
+    caducan pasado ttl.
+    """
+    ruta = str(tmp_path / "geocodificacion.sqlite")
+    ahora = [1000.0]
+    funcion = _Geocodificacion()
+
+    primera = cache.CacheGeocodificacion(funcion, ruta=ruta, ttl=60,
+                                         reloj=lambda: ahora[0])
+    assert primera("Madrid") == (40.4168, -3.7038)
+    primera.cerrar()
+
+    segunda = cache.CacheGeocodificacion(funcion, ruta=ruta, ttl=60,
+                                         reloj=lambda: ahora[0])
+    assert segunda("madrid") == (40.4168, -3.7038)
+    assert funcion.llamadas == 1
+
+    ahora[0] += 61
+    segunda("Madrid")
+    assert funcion.llamadas == 2
+    segunda.cerrar()
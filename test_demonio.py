@@ -0,0 +1,73 @@
+#coding=utf-8
+
+"""
+Pruebas del demonio de tatwas sin acceso a red (eventos del sol
+calculados con efemerides y zona horaria fija).
+
+Uso:
+    python3 -m pytest test_demonio.py
+"""
+
+import time
+import threading
+import demonio
+
+
+def _resolutor_utc(localizacion):
+    return {"zona_horaria": "UTC", "direccion": ""}
+
+
+
+def test_agregar_ubicacion_polar():
+    """
+    Una ubicación sin salidas del sol se agrega sin emitir eventos y
+    sin bloquear el demonio, y se reintenta pasado un día.
+    """
+    eventos = list()
+    demonio_tw = demonio.DemonioTatwas(
+        eventos.append, fuente_eventos_sol="efemerides",
+        resolutor_zonas=_resolutor_utc)
+
+    inicio = time.monotonic()
+    demonio_tw.agregar_ubicacion("polo", 90, 0)
+
+    assert time.monotonic() - inicio < 10
+    assert eventos == []
+    timestamp, _, ubicacion = demonio_tw._programados[0]
+    assert ubicacion["nombre"] == "polo"
+    assert timestamp > time.time() + demonio.SEGUNDOS_SIN_EVENTOS - 60
+
+
+
+def test_emisor_lento_no_bloquea():
+    """
+    Mientras el emisor está bloqueado se pueden agregar y quitar
+    ubicaciones y detener el demonio.
+    """
+    emitiendo = threading.Event()
+    liberar = threading.Event()
+
+    def emisor(evento_tw):
+        if evento_tw["ubicacion"] == "madrid":
+            emitiendo.set()
+            liberar.wait(10)
+
+    demonio_tw = demonio.DemonioTatwas(
+        emisor, fuente_eventos_sol="efemerides",
+        resolutor_zonas=_resolutor_utc)
+    hilo = threading.Thread(target=demonio_tw.agregar_ubicacion,
+                            args=("madrid", 40.4168, -3.7038), daemon=True)
+    hilo.start()
+    assert emitiendo.wait(10)
+
+    try:
+        inicio = time.monotonic()
+        demonio_tw.agregar_ubicacion("paris", 48.8566, 2.3522)
+        demonio_tw.quitar_ubicacion("paris")
+        demonio_tw.detener()
+        assert time.monotonic() - inicio < 5
+    finally:
+        liberar.set()
+        hilo.join(10)
+
+    assert "madrid" in demonio_tw._ubicaciones
@@ -0,0 +1,131 @@
+#coding=utf-8
+
+"""
+Pruebas de la interpolación de horas de eventos del sol, con
+efemerides como fuente y como modelo (sin acceso a red).
+
+Uso:
+    python3 -m pytest test_interpolacion_sol.py
+"""
+
+import pickle
+import datetime as dt
+import pytest
+import efemerides as ef
+import interpolacion_sol as isol
+
+
+class _Fuente:
+    """
+    Fuente de eventos del sol que anota las fechas pedidas.
+    """
+
+    def __init__(self):
+        self.fechas = list()
+
+
+    def __call__(self, latitud, longitud, fecha=None, local=False):
+        self.fechas.append(fecha)
+        return ef.sunrise_sunset(latitud, longitud, fecha)
+
+
+
+def _fecha_intermedia(dias_muestra):
+    """
+    Obtener una fecha situada a mitad de dos fechas de muestra.
+    """
+    fecha = dt.date(2024, 3, 1)
+    return fecha + dt.timedelta(days=dias_muestra // 2
+                                - fecha.toordinal() % dias_muestra)
+
+
+
+def test_interpolar_fecha_intermedia():
+    """
+    Las fechas intermedias se interpolan desde las dos muestras, con un
+    error real acotado por el estimado.
+    """
+    fuente = _Fuente()
+    interpolacion = isol.InterpolacionSol(fuente, dias_muestra=8,
+                                          tolerancia=600)
+    fecha = _fecha_intermedia(8)
+
+    horas, error = interpolacion.interpolar(40.4168, -3.7038, fecha)
+
+    assert fecha not in fuente.fechas and len(fuente.fechas) == 2
+    assert 0 < error <= 600
+    for evento, valor in ef.sunrise_sunset(40.4168, -3.7038, fecha).items():
+        assert abs((horas[evento] - valor).total_seconds()) <= error + 1
+    assert interpolacion.estadisticas()["interpoladas"] == 1
+
+
+
+def test_interpolar_limite_tolerancia():
+    """
+    Con una tolerancia igual al error estimado la fecha se interpola;
+    justo por debajo se pide a la fuente real.
+    """
+    fecha = _fecha_intermedia(8)
+    _, error = isol.InterpolacionSol(_Fuente(), dias_muestra=8,
+                                     tolerancia=600) \
+        .interpolar(40.4168, -3.7038, fecha)
+
+    fuente = _Fuente()
+    interpolacion = isol.InterpolacionSol(fuente, dias_muestra=8,
+                                          tolerancia=error)
+    assert interpolacion.interpolar(40.4168, -3.7038, fecha)[1] == error
+    assert fecha not in fuente.fechas
+
+    fuente = _Fuente()
+    interpolacion = isol.InterpolacionSol(fuente, dias_muestra=8,
+                                          tolerancia=error - 0.001)
+    horas, error_real = interpolacion.interpolar(40.4168, -3.7038, fecha)
+    assert error_real == 0
+    assert fuente.fechas[-1] == fecha
+    assert horas == ef.sunrise_sunset(40.4168, -3.7038, fecha)
+    assert interpolacion.estadisticas()["fuera_tolerancia"] == 1
+
+    # La fecha pedida se guarda y no vuelve a pedirse.
+    interpolacion.interpolar(40.4168, -3.7038, fecha)
+    assert fuente.fechas.count(fecha) == 1
+
+
+
+def test_interpolar_discontinuidad_polar():
+    """
+    Si un evento deja de ocurrir entre las muestras (inicio del día
+    polar) la fecha se pide a la fuente real.
+    """
+    fuente = _Fuente()
+    interpolacion = isol.InterpolacionSol(fuente, dias_muestra=14,
+                                          tolerancia=3600)
+
+    for dias in range(120):
+        fecha = dt.date(2024, 3, 1) + dt.timedelta(days=dias)
+        horas, _ = interpolacion.interpolar(78.2232, 15.6267, fecha)
+        esperadas = ef.sunrise_sunset(78.2232, 15.6267, fecha)
+        for evento, valor in esperadas.items():
+            if valor == ef.FECHAHORA_EVENTO_INEXISTENTE:
+                assert horas[evento] == valor, (fecha, evento)
+
+    assert interpolacion.estadisticas()["fuera_tolerancia"] > 0
+
+
+
+def test_fecha_actual_y_serializacion():
+    """
+    Las peticiones sin fecha van directamente a la fuente y las
+    muestras no se copian al serializar.
+    """
+    fuente = _Fuente()
+    interpolacion = isol.InterpolacionSol(fuente, dias_muestra=8)
+    interpolacion(40.4168, -3.7038)
+    interpolacion(40.4168, -3.7038, _fecha_intermedia(8))
+
+    assert fuente.fechas[0] is None
+    assert interpolacion.estadisticas()["muestras"] == 2
+    copia = pickle.loads(pickle.dumps(interpolacion))
+    assert copia.estadisticas()["muestras"] == 0
+
+    with pytest.raises(TypeError):
+        interpolacion.interpolar(40.4168, -3.7038, "2024-03-01")
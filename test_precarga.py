@@ -0,0 +1,127 @@
+#coding=utf-8
+
+"""
+Pruebas de la planificación de la precarga de eventos del sol, con un
+reloj simulado y sin hilos.
+
+Uso:
+    python3 -m pytest test_precarga.py
+"""
+
+import heapq
+import datetime as dt
+import fechahora as fh
+import precarga
+
+
+_MADRID = fh.zona_horaria("Europe/Madrid")
+
+
+def _timestamp(*fechahora):
+    return dt.datetime(*fechahora, tzinfo=_MADRID).timestamp()
+
+
+def _precarga(ahora, **opciones):
+    reloj = lambda: ahora[0]
+    return precarga.PrecargaEventosSol(lambda *args: None, reloj=reloj,
+                                       **opciones)
+
+
+def _planificar(precarga_sol, ahora):
+    """
+    Encolar las fechas de la siguiente precarga programada, como el
+    hilo planificador al llegar su instante.
+
+    Retorno:
+        Tupla (fechas encoladas, timestamp de la siguiente precarga).
+    """
+    _, _, ubicacion = heapq.heappop(precarga_sol._programados)
+    precarga_sol._encolar(ubicacion, ahora)
+
+    fechas = list()
+    while not precarga_sol._cola.empty():
+        fechas.append(precarga_sol._cola.get_nowait()[2])
+
+    return fechas, precarga_sol._programados[0][0] \
+                   if precarga_sol._programados else None
+
+
+
+def test_encolar_antes_de_medianoche():
+    """
+    Al registrarse se encolan la fecha local y los días siguientes, y
+    la siguiente precarga se programa antes de la medianoche local,
+    encolando solo el nuevo día.
+    """
+    ahora = [_timestamp(2024, 6, 10, 12, 0)]
+    precarga_sol = _precarga(ahora, dias=2, antelacion=600)
+    precarga_sol.registrar(40.4168, -3.7038, _MADRID)
+
+    fechas, siguiente = _planificar(precarga_sol, ahora[0])
+    assert fechas == [dt.date(2024, 6, 10), dt.date(2024, 6, 11),
+                      dt.date(2024, 6, 12)]
+    assert siguiente == _timestamp(2024, 6, 11) - 600
+
+    ahora[0] = siguiente
+    fechas, siguiente = _planificar(precarga_sol, ahora[0])
+    assert fechas == [dt.date(2024, 6, 13)]
+    assert siguiente == _timestamp(2024, 6, 12) - 600
+
+
+
+def test_encolar_dentro_de_antelacion():
+    """
+    Si la ubicación se registra dentro de la antelación de la
+    medianoche, se encolan también los días siguientes a la nueva
+    fecha y la siguiente precarga es la de la medianoche posterior.
+    """
+    ahora = [_timestamp(2024, 6, 10, 23, 55)]
+    precarga_sol = _precarga(ahora, dias=1, antelacion=600)
+    precarga_sol.registrar(40.4168, -3.7038, _MADRID)
+
+    fechas, siguiente = _planificar(precarga_sol, ahora[0])
+    assert fechas == [dt.date(2024, 6, 10), dt.date(2024, 6, 11),
+                      dt.date(2024, 6, 12)]
+    assert siguiente == _timestamp(2024, 6, 12) - 600
+
+
+
+def test_encolar_cambio_de_hora():
+    """
+    La medianoche se calcula en la zona local también el día del
+    cambio de hora (días de 23 horas).
+    """
+    ahora = [_timestamp(2024, 3, 30, 12, 0)]
+    precarga_sol = _precarga(ahora, dias=1, antelacion=600)
+    precarga_sol.registrar(40.4168, -3.7038, _MADRID)
+    _planificar(precarga_sol, ahora[0])
+
+    ahora[0] = _timestamp(2024, 3, 31, 12, 0)
+    _, siguiente = _planificar(precarga_sol, ahora[0])
+    assert siguiente == _timestamp(2024, 4, 1) - 600
+    assert siguiente - _timestamp(2024, 3, 31) == 23 * 3600 - 600
+
+
+
+def test_encolar_cola_llena_y_caducidad():
+    """
+    Con la cola llena se reintenta pasados SEGUNDOS_REINTENTO sin
+    perder fechas, y las ubicaciones sin usar dejan de precargarse.
+    """
+    ahora = [_timestamp(2024, 6, 10, 12, 0)]
+    precarga_sol = _precarga(ahora, dias=2, max_pendientes=2,
+                             caducidad=86400)
+    precarga_sol.registrar(40.4168, -3.7038, _MADRID)
+
+    fechas, siguiente = _planificar(precarga_sol, ahora[0])
+    assert fechas == [dt.date(2024, 6, 10), dt.date(2024, 6, 11)]
+    assert siguiente == ahora[0] + precarga.SEGUNDOS_REINTENTO
+
+    ahora[0] = siguiente
+    fechas, _ = _planificar(precarga_sol, ahora[0])
+    assert fechas == [dt.date(2024, 6, 12)]
+
+    ahora[0] += 2 * 86400
+    assert _planificar(precarga_sol, ahora[0]) == ([], None)
+    assert precarga_sol.estadisticas()["ubicaciones"] == 0
+    assert precarga_sol.estadisticas()["caducadas"] == 1
@@ -0,0 +1,91 @@
+#coding=utf-8
+
+"""
+Pruebas de la compilación y consulta del archivo binario de zonas
+horarias con un GeoJSON sintético.
+
+Uso:
+    python3 -m pytest test_resolutor_zonas.py
+"""
+
+import json
+import pytest
+import resolutor_zonas as rz
+
+
+def _cuadrado(oeste, sur, este, norte):
+    return [[oeste, sur], [este, sur], [este, norte], [oeste, norte],
+            [oeste, sur]]
+
+
+_GEOJSON = {"type": "FeatureCollection", "features": [
+    # Polígono con un agujero ocupado por otra zona.
+    {"type": "Feature", "properties": {"tzid": "Europe/Madrid"},
+     "geometry": {"type": "Polygon",
+                  "coordinates": [_cuadrado(-9.5, 36, 3.5, 44),
+                                  _cuadrado(-4, 40, -3, 41)]}},
+    {"type": "Feature", "properties": {"tzid": "Europe/Andorra"},
+     "geometry": {"type": "Polygon",
+                  "coordinates": [_cuadrado(-4, 40, -3, 41)]}},
+    # Zona formada por varios polígonos separados.
+    {"type": "Feature", "properties": {"tzid": "Atlantic/Canary"},
+     "geometry": {"type": "MultiPolygon",
+                  "coordinates": [[_cuadrado(-18.5, 27.5, -16, 29.5)],
+                                  [_cuadrado(-15, 27.5, -13, 29.5)]]}}]}
+
+
+
+@pytest.fixture(scope="module")
+def resolutor(tmp_path_factory):
+    directorio = tmp_path_factory.mktemp("zonas")
+    ruta_geojson = directorio / "zonas.json"
+    ruta_geojson.write_text(json.dumps(_GEOJSON), encoding="utf-8")
+    ruta_binaria = str(directorio / "zonas.bin")
+    rz.compilar_zonas(str(ruta_geojson), ruta_binaria, tamaño_celda=2.0)
+
+    return rz.ResolutorZonas(ruta_binaria)
+
+
+
+@pytest.mark.parametrize("latitud, longitud, zona", [
+    (37.39, -5.98, "Europe/Madrid"),
+    (40.5, -3.5, "Europe/Andorra"),
+    (28.1, -17.0, "Atlantic/Canary"),
+    (28.1, -14.0, "Atlantic/Canary"),
+    (28.1, -15.5, "Etc/GMT+1"),
+    (0, 0, "Etc/GMT"),
+    (-33.9, 151.2, "Etc/GMT-10")])
+def test_zona_horaria(resolutor, latitud, longitud, zona):
+    """
+    Cada punto se resuelve a la zona del polígono que lo contiene
+    (respetando los agujeros) o a la zona náutica de su longitud.
+    """
+    assert resolutor.zona_horaria(latitud, longitud) == zona
+    assert resolutor([latitud, longitud])["zona_horaria"] == zona
+
+
+
+def test_formato_timezonedb(resolutor):
+    """
+    El resultado tiene los campos de api.timezonedb_get usados por
+    EntornoTatwas y rechaza localizaciones incorrectas.
+    """
+    datos = resolutor((28.1, -17.0), timestamp=0)
+
+    assert set(datos) == {"zona_horaria", "direccion", "nombre_pais",
+                          "codigo_pais"}
+    assert datos["direccion"].startswith("Canary")
+    with pytest.raises(TypeError):
+        resolutor("Madrid")
+
+
+
+def test_archivo_incorrecto(tmp_path):
+    """
+    Un archivo que no es de zonas horarias produce ValueError.
+    """
+    ruta = tmp_path / "zonas.bin"
+    ruta.write_bytes(b"\0" * 128)
+
+    with pytest.raises(ValueError):
+        rz.ResolutorZonas(str(ruta)).zona_horaria(0, 0)
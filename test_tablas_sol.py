@@ -0,0 +1,91 @@
+#coding=utf-8
+
+"""
+Pruebas de la compilación y lectura de las tablas de horas de eventos
+del sol, calculadas con efemerides (sin acceso a red).
+
+Uso:
+    python3 -m pytest test_tablas_sol.py
+"""
+
+import pickle
+import datetime as dt
+import pytest
+import efemerides as ef
+import tablas_sol as ts
+
+
+_UBICACIONES = [(40.4168, -3.7038), (78.2232, 15.6267)]
+_INICIO = dt.date(2024, 1, 1)
+_DIAS = 400
+
+
+
+@pytest.fixture(scope="module")
+def ruta_tablas(tmp_path_factory):
+    ruta = str(tmp_path_factory.mktemp("tablas") / "sol.bin")
+    ts.compilar_tablas(ruta, _UBICACIONES, _INICIO, _DIAS)
+
+    return ruta
+
+
+
+@pytest.mark.parametrize("latitud, longitud", _UBICACIONES)
+@pytest.mark.parametrize("dias", [0, 120, 172, _DIAS - 1])
+def test_ida_y_vuelta(ruta_tablas, latitud, longitud, dias):
+    """
+    Las horas leídas coinciden (redondeadas al segundo) con las de la
+    fuente, también en los días polares de Svalbard.
+    """
+    fecha = _INICIO + dt.timedelta(days=dias)
+    esperadas = ef.sunrise_sunset(latitud, longitud, fecha)
+    horas = ts.TablasSol(ruta_tablas)(latitud, longitud, fecha)
+
+    assert set(horas) == set(esperadas)
+    for evento, valor in esperadas.items():
+        if evento != "duracion_dia":
+            assert horas[evento].utcoffset() == dt.timedelta(0)
+        assert abs((horas[evento] - valor).total_seconds()) <= 0.5, evento
+
+
+
+def test_metadatos_y_serializacion(ruta_tablas):
+    """
+    Las ubicaciones y fechas de las tablas se mantienen, también al
+    serializar la fuente para otros procesos.
+    """
+    tablas = pickle.loads(pickle.dumps(ts.TablasSol(ruta_tablas)))
+
+    assert tablas.ubicaciones == _UBICACIONES
+    assert tablas.fechas == (_INICIO,
+                             _INICIO + dt.timedelta(days=_DIAS - 1))
+
+
+
+def test_respaldo(ruta_tablas):
+    """
+    Las ubicaciones y fechas fuera de las tablas se piden a la fuente
+    de respaldo o producen RuntimeError si no existe.
+    """
+    consultas = list()
+
+    def respaldo(latitud, longitud, fecha, local=False):
+        consultas.append((latitud, longitud, fecha))
+        return ef.sunrise_sunset(latitud, longitud, fecha)
+
+    fecha_fuera = _INICIO - dt.timedelta(days=1)
+    with pytest.raises(RuntimeError):
+        ts.TablasSol(ruta_tablas)(40.4168, -3.7038, fecha_fuera)
+
+    tablas = ts.TablasSol(ruta_tablas, respaldo)
+    tablas(40.4168, -3.7038, fecha_fuera)
+    tablas(0, 0, _INICIO)
+    tablas(40.4168, -3.7038, _INICIO)
+    assert consultas == [(40.4168, -3.7038, fecha_fuera), (0, 0, _INICIO)]
+
+
+
+def test_ubicaciones_repetidas(tmp_path):
+    with pytest.raises(ValueError):
+        ts.compilar_tablas(str(tmp_path / "sol.bin"),
+                           [(1, 2), (1.0, 2.0)], _INICIO, 1)
@@ -0,0 +1,121 @@
+#coding=utf-8
+
+"""
+Pruebas del cálculo de tatwas en los cambios de hora, sin acceso a red
+(eventos del sol calculados con efemerides y zona horaria fija).
+
+Uso:
+    python3 -m pytest test_tatwa.py
+"""
+
+import datetime as dt
+import pytest
+import tatwa as tw
+import fechahora as fh
+import efemerides as ef
+
+
+def _resolutor_madrid(localizacion):
+    return {"zona_horaria": "Europe/Madrid", "direccion": "Madrid"}
+
+
+def _resolutor_utc(localizacion):
+    return {"zona_horaria": "UTC", "direccion": ""}
+
+
+
+@pytest.mark.parametrize("inicio_utc", [
+    dt.datetime(2024, 10, 27, 0, 0, tzinfo=fh.UTC),
+    dt.datetime(2024, 3, 31, 0, 0, tzinfo=fh.UTC)])
+def test_calcular_tatwas_fechahora_cambio_hora(inicio_utc):
+    """
+    Cada instante alrededor del cambio de hora (incluida la hora que se
+    repite al retrasar la hora) cae dentro de los intervalos de tatwas
+    calculados para él.
+    """
+    entorno_tw = tw.EntornoTatwas("efemerides",
+                                  resolutor_zonas=_resolutor_madrid)
+    entorno_tw.fijar_coordenadas(40.4168, -3.7038, localizable=False)
+
+    for minutos in range(0, 4 * 60, 5):
+        instante = inicio_utc + dt.timedelta(minutes=minutos)
+        tatwas = entorno_tw.calcular_tatwas_fechahora(instante)
+
+        # Las fechas y horas de la hora repetida se comparan como
+        # timestamps: entre zonas distintas nunca son iguales (PEP 495).
+        assert entorno_tw.fechahora_tw.timestamp() == instante.timestamp()
+        for evento, resultado in tatwas.items():
+            if resultado is None:
+                continue
+            assert resultado["fechahora_inicio"].timestamp() \
+                   <= instante.timestamp() \
+                   < resultado["fechahora_fin"].timestamp(), evento
+
+
+
+def test_horario_tatwas_polar_finaliza():
+    """
+    En el polo el horario sin fecha final termina tras
+    _MAX_DIAS_SIN_EVENTO días sin salida del sol en lugar de recorrer
+    días indefinidamente.
+    """
+    dias_pedidos = list()
+
+    def fuente(latitud, longitud, fecha):
+        dias_pedidos.append(fecha)
+        return ef.sunrise_sunset(latitud, longitud, fecha)
+
+    entorno_tw = tw.EntornoTatwas(fuente, resolutor_zonas=_resolutor_utc)
+    entorno_tw.fijar_coordenadas(90, 0, localizable=False)
+
+    assert list(entorno_tw.horario_tatwas(dt.date(2024, 1, 1),
+                                          dt.date.max)) == []
+    assert len(dias_pedidos) <= tw.EntornoTatwas._MAX_DIAS_SIN_EVENTO + 3
+
+
+
+def test_tatwa_igualdad_y_hash():
+    """
+    Los tatwas iguales tienen el mismo hash, también al compararse con
+    su posición, y no son iguales a su nombre.
+    """
+    akash = tw.Tatwa("akash")
+
+    assert akash == tw.Tatwa(1) == 1
+    assert hash(akash) == hash(tw.Tatwa(1)) == hash(1)
+    assert akash != "akash" and "akash" != akash
+    assert len({akash, tw.Tatwa(1), 1, "akash"}) == 2
+    assert akash < "vayu" and tw.Tatwa("vayu") >= "vayu"
+
+
+
+def test_horario_tatwas_contiguo():
+    """
+    Los intervalos del horario son contiguos, se obtienen las horas de
+    los eventos del sol una vez por día y coinciden con los tatwas
+    calculados en el punto medio de cada intervalo.
+    """
+    dias_pedidos = list()
+
+    def fuente(latitud, longitud, fecha):
+        dias_pedidos.append(fecha)
+        return ef.sunrise_sunset(latitud, longitud, fecha)
+
+    entorno_tw = tw.EntornoTatwas(fuente, resolutor_zonas=_resolutor_madrid)
+    entorno_tw.fijar_coordenadas(40.4168, -3.7038, localizable=False)
+
+    horario = list(entorno_tw.horario_tatwas(dt.date(2024, 10, 26),
+                                             dt.date(2024, 10, 27)))
+
+    assert len(set(dias_pedidos)) == len(dias_pedidos)
+    assert [ventana["tatwa"].posicion for ventana in horario[:3]] == [1, 2, 3]
+    for anterior, siguiente in zip(horario, horario[1:]):
+        assert anterior["fechahora_fin"].timestamp() \
+               == siguiente["fechahora_inicio"].timestamp()
+    for ventana in horario:
+        # Punto medio en UTC: la hora local se repite el 27/10.
+        medio = dt.datetime.fromtimestamp(
+            (ventana["fechahora_inicio"].timestamp()
+             + ventana["fechahora_fin"].timestamp()) / 2, fh.UTC)
+        tatwas = entorno_tw.calcular_tatwas_fechahora(medio)
+        assert tatwas["salida"]["tatwa"] == ventana["tatwa"]
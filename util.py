@@ -6,6 +6,8 @@ Módulo con utilidades generales.
 """
 
 # imports
+import importlib
+import threading
 import datetime as dt
 from collections.abc import Sequence
 from numbers import Number
@@ -68,8 +70,7 @@ def evaluar_coordenadas(entrada):
     """
     try:
         return convertir_coordenadas(*literal_eval(entrada))
-    except (ValueError, SyntaxError, TypeError) as err:
-        #print(err) Log
+    except (ValueError, SyntaxError, TypeError):
         raise ValueError("Introduce solo dos valores (latitud, longitud)"
                          " separadas por coma.")
 
@@ -93,8 +94,7 @@ def evaluar_fechahora(entrada, formato="%H:%M:%S %d-%m-%Y"):
     """
     try:
         return dt.datetime.strptime(entrada, formato)
-    except (ValueError, TypeError) as err:
-        #print(err) Log
+    except (ValueError, TypeError):
         raise ValueError("Introduce fecha/hora en formato {}".format(formato))
         
 
@@ -195,3 +195,114 @@ def obtener_dato(mensaje, evaluar=None, comprobar=None, fin=None):
                 continue
 
         return dato
+
+
+
+class ModuloPerezoso:
+    """
+    Sustituto de un módulo que solo lo importa la primera vez que se
+    accede a alguno de sus atributos. Permite que importar un módulo
+    del proyecto no importe también dependencias costosas (clientes de
+    red, bases de datos de zonas horarias, claves) que quizá no se
+    lleguen a usar.
+
+    Uso:
+        requests = ModuloPerezoso("requests")
+    """
+
+    def __init__(self, nombre):
+        """
+        Constructor.
+
+        Argumentos:
+            nombre: nombre completo del módulo a importar.
+        """
+        object.__setattr__(self, "_nombre", nombre)
+        object.__setattr__(self, "_modulo", None)
+        object.__setattr__(self, "_cerrojo", threading.Lock())
+
+
+    def _cargar(self):
+        """
+        Importar el módulo si aún no se ha importado.
+
+        Retorno:
+            El módulo importado.
+
+        Excepciones:
+            ImportError si el módulo no puede importarse.
+        """
+        modulo = self._modulo
+        if modulo is None:
+            with self._cerrojo:
+                modulo = self._modulo
+                if modulo is None:
+                    modulo = importlib.import_module(self._nombre)
+                    object.__setattr__(self, "_modulo", modulo)
+
+        return modulo
+
+
+    def __getattr__(self, atributo):
+        return getattr(self._cargar(), atributo)
+
+
+    def __setattr__(self, atributo, valor):
+        setattr(self._cargar(), atributo, valor)
+
+
+    def __dir__(self):
+        return dir(self._cargar())
+
+
+    def __repr__(self):
+        estado = "importado" if self._modulo is not None else "sin importar"
+        return "<ModuloPerezoso {} ({})>".format(self._nombre, estado)
+
+
+
+class FuncionPerezosa:
+    """
+    Función de un módulo que solo se importa la primera vez que se
+    llama. Puede enviarse a otros procesos (pickle) sin importar el
+    módulo.
+    """
+
+    def __init__(self, modulo, nombre):
+        """
+        Constructor.
+
+        Argumentos:
+            modulo: nombre completo del módulo de la función.
+            nombre: nombre de la función dentro del módulo.
+        """
+        self._modulo = modulo
+        self._nombre = nombre
+        self._funcion = None
+
+
+    def __call__(self, *args, **kwargs):
+        funcion = self._funcion
+        if funcion is None:
+            funcion = self._funcion = \
+                getattr(importlib.import_module(self._modulo), self._nombre)
+
+        return funcion(*args, **kwargs)
+
+
+    def __reduce__(self):
+        return (FuncionPerezosa, (self._modulo, self._nombre))
+
+
+    def __eq__(self, otro):
+        if not isinstance(otro, FuncionPerezosa):
+            return NotImplemented
+        return (self._modulo, self._nombre) == (otro._modulo, otro._nombre)
+
+
+    def __hash__(self):
+        return hash((self._modulo, self._nombre))
+
+
+    def __repr__(self):
+        return "<FuncionPerezosa {}.{}>".format(self._modulo, self._nombre)
@@ -0,0 +1,78 @@
+#coding=utf-8
+
+"""
+Módulo de cálculo vectorial de tatwas sobre arrays de timestamps
+usando NumPy.
+"""
+
+import numpy as np
+from tatwa import Tatwa
+
+
+
+def calcular_tatwas_vectorial(timestamps, timestamps_eventos):
+    """
+    Calcular los tatwas de un conjunto de instantes en una única pasada
+    vectorial. Es el equivalente por lotes de
+    EntornoTatwas.calcular_tatwas.
+
+    Argumentos:
+        timestamps: array (o secuencia) de segundos UNIX UTC de los
+            instantes en los cuales calcular los tatwas.
+        timestamps_eventos: diccionario {evento: timestamp} con los
+            segundos UNIX UTC de cada evento del sol. Cada timestamp
+            puede ser un escalar o un array con la misma forma que
+            timestamps (un evento distinto por instante).
+
+    Retorno:
+        Diccionario {evento: columnas}, donde columnas es un
+        diccionario de arrays enmascarados (numpy.ma) con la misma
+        forma que timestamps:
+            {"posicion": posición del tatwa (int64),
+             "ciclo": ciclo del tatwa (int64),
+             "timestamp_inicio": segundos UNIX de inicio del tatwa,
+             "timestamp_fin": segundos UNIX de fin del tatwa,
+             "segundos_restantes": segundos hasta el fin del tatwa}
+        Los instantes fuera del rango del evento (anteriores al mismo
+        o posteriores a un día más un tatwa) están enmascarados, igual
+        que los valores None de EntornoTatwas.calcular_tatwas.
+
+    Excepciones:
+        ValueError si la forma de los timestamps de eventos no es
+            compatible con la de timestamps.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    segundos_tatwa = Tatwa.SEGUNDOS_TATWA
+    segundos_maximos = 24 * 3600 + segundos_tatwa
+    numero_tatwas = len(Tatwa.NOMBRES_TATWAS)
+
+    tatwas = dict()
+    for evento, timestamp_evento in timestamps_eventos.items():
+        timestamp_evento = np.asarray(timestamp_evento, dtype=np.float64)
+        try:
+            segundos_evento_tw = timestamps - timestamp_evento
+        except ValueError:
+            raise ValueError("Forma de timestamps del evento {} incompatible"
+                             .format(evento))
+
+        fuera_rango = (segundos_evento_tw < 0) \
+                      | (segundos_evento_tw >= segundos_maximos)
+        indice_tatwa, segundos_transcurridos = \
+            np.divmod(segundos_evento_tw, segundos_tatwa)
+        indice_tatwa = indice_tatwa.astype(np.int64)
+        timestamp_inicio = timestamp_evento + indice_tatwa * segundos_tatwa
+
+        tatwas[evento] = \
+            {"posicion": np.ma.masked_array(indice_tatwa + 1, fuera_rango),
+             "ciclo": np.ma.masked_array(indice_tatwa // numero_tatwas + 1,
+                                         fuera_rango),
+             "timestamp_inicio": np.ma.masked_array(timestamp_inicio,
+                                                    fuera_rango),
+             "timestamp_fin": np.ma.masked_array(timestamp_inicio
+                                                 + segundos_tatwa,
+                                                 fuera_rango),
+             "segundos_restantes":
+                np.ma.masked_array(segundos_tatwa - segundos_transcurridos,
+                                   fuera_rango)}
+
+    return tatwas